@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Timer wakeup latency on the workload cores, with and without the daemons.
+
+Usage: python3 bench/bench_jitter.py [seconds] [period_us]
+
+One timer loop per workload core (every CPU except the housekeeping ones,
+see scripts/isolation.py; YAHBOOM_ISOLATE picks them like it does for the
+daemons) sleeps until the next period and records how late it woke up.
+That runs three times:
+
+- none:     no status daemons
+- daemons:  the OLED daemon and the portal's web server, default priority
+- isolated: the same with YAHBOOM_ISOLATE (housekeeping CPU, SCHED_IDLE,
+            idle I/O priority, mlock, load backoff)
+
+The OLED daemon reads the real /proc and /sys with a fake SSD1306
+(sim.fake_adafruit) and rotates pages every second, the portal serves
+wifi_setup's handler on 127.0.0.1 with the in-memory backend (sim.fake_nm).
+Stop the yahboom services first to measure the daemons alone. On a single
+CPU the timer shares its core with the daemons.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(REPO, "scripts"))
+sys.path.insert(0, REPO)
+
+import isolation
+
+
+def timer_child(cpu, seconds, period_us):
+    os.sched_setaffinity(0, [cpu])
+    period = period_us / 1e6
+    late = []
+    start = time.monotonic()
+    deadline = start + period
+    end = start + seconds
+    while deadline < end:
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        late.append(time.monotonic() - deadline)
+        deadline += period
+    print(json.dumps(late))
+
+
+def daemon_child(name):
+    isolated = isolation.isolate()
+    if name == "oled":
+        from sim import fake_adafruit
+        fake_adafruit.install()
+        import oled
+        display = oled.Yahboom_OLED(snapshot_path=None, portal_socket=None, broker_socket=None,
+                                    page_interval=1,
+                                    backoff=isolation.LoadBackoff() if isolated else None)
+        while True:
+            display.main_program()
+            time.sleep(1)
+    else:
+        from sim.fake_nm import FakeBackend
+        import wifi_setup
+        wifi_setup.backend = FakeBackend()
+        server = wifi_setup.StoppableHTTPServer(("127.0.0.1", 0), wifi_setup.WifiHandler)
+        server.serve_forever(poll_interval=0.5)
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_phase(cpus, seconds, period_us, daemons, env):
+    children = [subprocess.Popen([sys.executable, __file__, "--daemon", name], env=env,
+                                 stdout=subprocess.DEVNULL)
+                for name in daemons]
+    time.sleep(1.0 if daemons else 0)   # past the daemons' start-up
+    timers = [subprocess.Popen([sys.executable, __file__, "--timer", str(cpu), str(seconds),
+                                str(period_us)], stdout=subprocess.PIPE, text=True)
+              for cpu in cpus]
+    late = []
+    for timer in timers:
+        late.extend(json.loads(timer.communicate()[0]))
+    for child in children:
+        child.terminate()
+        child.wait()
+    late.sort()
+    return {"wakeups": len(late),
+            "p50_us": percentile(late, 0.5) * 1e6,
+            "p99_us": percentile(late, 0.99) * 1e6,
+            "p999_us": percentile(late, 0.999) * 1e6,
+            "max_us": late[-1] * 1e6}
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    period_us = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    housekeeping = isolation.housekeeping_cpus(os.environ.get(isolation.ENV) or "1")
+    allowed = sorted(os.sched_getaffinity(0))
+    workload = [cpu for cpu in allowed if cpu not in housekeeping] or allowed
+    print("housekeeping CPUs %s, timer loops on CPUs %s, %d us period, %.0f s per phase" % (
+        housekeeping, workload, period_us, seconds))
+
+    env = dict(os.environ)
+    env.pop(isolation.ENV, None)
+    isolated = dict(env)
+    # "N-N": a bare "0" or "1" would mean off / the default
+    isolated[isolation.ENV] = ",".join("%d-%d" % (cpu, cpu) for cpu in housekeeping)
+    rows = [
+        ("none", run_phase(workload, seconds, period_us, [], env)),
+        ("daemons", run_phase(workload, seconds, period_us, ["oled", "portal"], env)),
+        ("isolated", run_phase(workload, seconds, period_us, ["oled", "portal"], isolated)),
+    ]
+    print("%-10s %8s %10s %10s %10s %10s" % ("daemons", "wakeups", "p50 us", "p99 us",
+                                            "p99.9 us", "max us"))
+    for name, r in rows:
+        print("%-10s %8d %10.1f %10.1f %10.1f %10.1f" % (
+            name, r["wakeups"], r["p50_us"], r["p99_us"], r["p999_us"], r["max_us"]))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--timer"]:
+        timer_child(int(sys.argv[2]), float(sys.argv[3]), int(sys.argv[4]))
+    elif sys.argv[1:2] == ["--daemon"]:
+        daemon_child(sys.argv[2])
+    else:
+        main()
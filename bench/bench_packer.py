@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Image -> SSD1306 page buffer conversion speed.
+
+Usage: python3 bench/bench_packer.py [frames]
+
+"adafruit" is the per-pixel loop from Adafruit_SSD1306.SSD1306Base.image()
+that refresh() used to run every frame; the others are oled_driver's bulk
+packers. Every packer is checked against the Adafruit output first.
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from PIL import Image, ImageDraw, ImageFont
+
+import oled_driver
+
+
+def adafruit_image(image, width=128, pages=4):
+    pix = image.load()
+    buf = [0] * (width * pages)
+    index = 0
+    for page in range(pages):
+        for x in range(width):
+            bits = 0
+            for bit in [0, 1, 2, 3, 4, 5, 6, 7]:
+                bits = bits << 1
+                bits |= 0 if pix[(x, page * 8 + 7 - bit)] == 0 else 1
+            buf[index] = bits
+            index += 1
+    return bytes(buf)
+
+
+def sample_frame():
+    image = Image.new('1', (128, 32))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    draw.text((0, -2), "CPU:23%", font=font, fill=255)
+    draw.text((68, -2), "48.1C", font=font, fill=255)
+    draw.text((0, 6), "RAM:41% -> 7.4GB ", font=font, fill=255)
+    draw.text((0, 14), "SDC:19% -> 234.0GB", font=font, fill=255)
+    draw.text((0, 22), "IP:192.168.1.23", font=font, fill=255)
+    rng = random.Random(0)
+    for _ in range(200):
+        image.putpixel((rng.randrange(128), rng.randrange(32)), 255)
+    return image
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    image = sample_frame()
+    packers = [
+        ("adafruit", adafruit_image),
+        ("table", lambda im: oled_driver.pack_rows(im.tobytes(), 128, 32)),
+    ]
+    if oled_driver.numpy is not None:
+        packers.append(("numpy", lambda im: oled_driver.pack_rows_numpy(im.tobytes(), 128, 32)))
+
+    expected = adafruit_image(image)
+    print("%-10s %12s %12s" % ("packer", "frames/s", "us/frame"))
+    for name, pack in packers:
+        assert pack(image) == expected, name
+        n = frames // 10 if name == "adafruit" else frames
+        t0 = time.perf_counter()
+        for _ in range(n):
+            pack(image)
+        per_frame = (time.perf_counter() - t0) / n
+        print("%-10s %12.0f %12.1f" % (name, 1 / per_frame, per_frame * 1e6))
+
+
+if __name__ == "__main__":
+    main()
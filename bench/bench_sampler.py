@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""CPU cost per metrics sample: shell pipelines vs. the in-process sampler.
+
+Usage: python3 bench/bench_sampler.py [samples]
+
+The legacy path is the pre-sampler Yahboom_OLED code (cat /proc/stat, free,
+df and ifconfig through a shell). CPU time includes the forked children, so
+the numbers are what the daemon really costs the box per sample. It comes
+from getrusage() (microseconds, not os.times()' clock ticks), and each path
+runs at least `samples` times and until it has used MIN_CPU_SECONDS, so
+the totals are far above the timer's resolution.
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from sampler import SystemSampler
+
+MIN_CPU_SECONDS = 0.5
+
+
+def legacy_sample():
+    stat = os.popen("cat /proc/stat", 'r').readline()
+    [int(v) for v in stat.split()[1:11]]
+    subprocess.check_output(
+        "free | awk 'NR==2{printf \"RAM:%2d%% -> %.1fGB \", 100*($2-$7)/$2, ($2/1048576.0)}'",
+        shell=True)
+    subprocess.check_output(
+        "df -h | awk '$NF==\"/\"{printf \"SDC:%s -> %.1fGB\", $5, $2}'", shell=True)
+    try:
+        with open("/sys/devices/virtual/thermal/thermal_zone0/temp", "r") as f:
+            int(f.read().strip())
+    except (OSError, ValueError):
+        pass
+    os.popen("/sbin/ifconfig enP8p1s0 2>/dev/null | grep 'inet' | awk '{print $2}'").read()
+    os.popen("/sbin/ifconfig wlP1p1s0 2>/dev/null | grep 'inet' | awk '{print $2}'").read()
+
+
+def make_sampler_sample():
+    sampler = SystemSampler()
+
+    def sample():
+        sampler.cpu_percent()
+        sampler.ram()
+        sampler.disk("/")
+        sampler.temperatures()
+        sampler.ipv4_address("enP8p1s0") or sampler.ipv4_address("wlP1p1s0")
+    return sample
+
+
+def cpu_seconds():
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def measure(fn, samples, min_cpu=MIN_CPU_SECONDS):
+    fn()
+    wall0 = time.perf_counter()
+    cpu0 = cpu_seconds()
+    done = 0
+    while done < samples or cpu_seconds() - cpu0 < min_cpu:
+        for _ in range(samples):
+            fn()
+        done += samples
+    cpu = cpu_seconds() - cpu0
+    wall = time.perf_counter() - wall0
+    return cpu / done, wall / done, done
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rows = [
+        ("legacy (shell)", measure(legacy_sample, max(1, samples // 10))),
+        ("sampler", measure(make_sampler_sample(), samples)),
+    ]
+    print("%-16s %14s %14s %9s" % ("implementation", "CPU us/sample", "wall us/sample", "samples"))
+    for name, (cpu, wall, done) in rows:
+        print("%-16s %14.1f %14.1f %9d" % (name, cpu * 1e6, wall * 1e6, done))
+    print("speedup (CPU): %.0fx" % (rows[0][1][0] / max(rows[1][1][0], 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
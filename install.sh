@@ -2,7 +2,7 @@
 set -e
 
 # Yahboom Jetson Orin Nano CUBE Case Setup
-# Installs OLED display, RGB blue cycling, and fan control
+# Installs OLED display, temperature-driven RGB, and fan control
 # Works with: Jetson Orin Nano (SUB/Official) + CUBE NANO Case
 
 INSTALL_DIR="$(cd "$(dirname "$0")" && pwd)"
@@ -19,7 +19,7 @@ echo ""
 # --- 1. Install system dependencies ---
 echo "[1/5] Installing system dependencies..."
 sudo apt-get update -qq
-sudo apt-get install -y -qq python3-pip python3-smbus i2c-tools libjpeg-dev zlib1g-dev git
+sudo apt-get install -y -qq python3-pip python3-smbus python3-dbus python3-gi i2c-tools libjpeg-dev zlib1g-dev git
 
 # --- 2. Install Python dependencies ---
 echo "[2/5] Installing Python packages..."
@@ -75,22 +75,33 @@ if [ -z "$I2C_BUS" ]; then
 fi
 
 # Update scripts with detected bus
-sed -i "s/i2c_bus=[0-9]*/i2c_bus=$I2C_BUS/g" "$INSTALL_DIR/scripts/oled.py"
-sed -i "s/i2c_bus=[0-9]*/i2c_bus=$I2C_BUS/g" "$INSTALL_DIR/scripts/rgb_blue.py"
+sed -i "s/i2c_bus=[0-9][0-9]*/i2c_bus=$I2C_BUS/g" "$INSTALL_DIR/scripts/oled.py"
+sed -i "s/i2c_bus=[0-9][0-9]*/i2c_bus=$I2C_BUS/g" "$INSTALL_DIR/scripts/rgb_blue.py"
+sed -i "s/i2c_bus=[0-9][0-9]*/i2c_bus=$I2C_BUS/g" "$INSTALL_DIR/scripts/i2c_broker.py"
 
 # --- 5. Install systemd services ---
 echo "[5/5] Installing systemd services..."
 
-for svc in yahboom_wifi_setup yahboom_oled yahboom_rgb; do
+for svc in yahboom_wifi_setup yahboom_i2c yahboom_oled yahboom_rgb; do
     sed -e "s|__USER__|$USER|g" \
         -e "s|__HOME__|$HOME_DIR|g" \
         -e "s|__INSTALL_DIR__|$INSTALL_DIR|g" \
         "$INSTALL_DIR/services/${svc}.service" | sudo tee "/etc/systemd/system/${svc}.service" > /dev/null
 done
 
+# /run/yahboom holds runtime state shared between the daemons (metrics snapshot, portal and I2C broker sockets)
+echo "d /run/yahboom 0755 $USER $USER -" | sudo tee /etc/tmpfiles.d/yahboom.conf > /dev/null
+sudo systemd-tmpfiles --create /etc/tmpfiles.d/yahboom.conf
+
+# While the setup hotspot is up, answer every DNS name with the portal's address
+# so phones find the captive portal (NetworkManager reads this for shared
+# connections only, i.e. the hotspot)
+sudo mkdir -p /etc/NetworkManager/dnsmasq-shared.d
+echo "address=/#/10.42.0.1" | sudo tee /etc/NetworkManager/dnsmasq-shared.d/yahboom-portal.conf > /dev/null
+
 sudo systemctl daemon-reload
-sudo systemctl enable yahboom_wifi_setup.service yahboom_oled.service yahboom_rgb.service
-sudo systemctl restart yahboom_wifi_setup.service yahboom_oled.service yahboom_rgb.service
+sudo systemctl enable yahboom_wifi_setup.service yahboom_i2c.service yahboom_oled.service yahboom_rgb.service
+sudo systemctl restart yahboom_wifi_setup.service yahboom_i2c.service yahboom_oled.service yahboom_rgb.service
 
 echo ""
 echo "============================================"
@@ -98,13 +109,14 @@ echo " Setup complete!"
 echo "============================================"
 echo ""
 echo " OLED:  showing CPU%, temp, RAM, disk, IP"
-echo " RGB:   blue cycle breathing"
-echo " Fan:   ON"
+echo " RGB:   blue breathing when cool, yellow/red as it nears throttling"
+echo " Fan:   on above 55C, off below 45C"
 echo " I2C:   bus $I2C_BUS"
 echo " WiFi:  setup portal (hotspot if no network)"
 echo ""
 echo " Services (auto-start on boot):"
 echo "   sudo systemctl status yahboom_wifi_setup"
+echo "   sudo systemctl status yahboom_i2c"
 echo "   sudo systemctl status yahboom_oled"
 echo "   sudo systemctl status yahboom_rgb"
 echo ""
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Boot and service timeline tracing in Chrome trace-event JSON.
+
+Tracing is off unless the YAHBOOM_TRACE environment variable is set
+("1" for TRACE_DIR, or a directory). A daemon calls start("name") once;
+after that
+
+    with boottrace.span("scan", networks=3):
+        ...
+    boottrace.instant("first frame")
+    boottrace.flush()
+
+record complete ("X") and instant ("i") events, and flush() writes them to
+<dir>/trace-<name>.json. Timestamps are CLOCK_BOOTTIME, so the files of
+different daemons line up with each other and with the kernel's boot.
+
+When tracing is off, span() returns one shared no-op context manager and
+instant()/flush() do nothing: the cost is a function call, so call sites
+stay in production code.
+
+    python3 boottrace.py merge [out.json] [dir]   # one file for Perfetto /
+                                                  # chrome://tracing
+"""
+
+import atexit
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_DIR = "/run/yahboom"
+ENV = "YAHBOOM_TRACE"
+MAX_EVENTS = 20000   # a daemon left traced for days stops recording, not growing
+
+
+def _now_us():
+    return time.clock_gettime(time.CLOCK_BOOTTIME) * 1e6
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = _now_us()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add({"name": self.name, "ph": "X", "ts": round(self.start, 1),
+                         "dur": round(end - self.start, 1), "args": self.args})
+        return False
+
+
+class Tracer:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.pid = os.getpid()
+        self.events = [{"name": "process_name", "ph": "M", "pid": self.pid, "tid": 0,
+                        "args": {"name": name}}]
+        self.dropped = 0
+        self.__lock = threading.Lock()
+
+    def add(self, event):
+        event["pid"] = self.pid
+        event["tid"] = threading.get_native_id()
+        with self.__lock:
+            if len(self.events) < MAX_EVENTS:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    def instant(self, name, **args):
+        self.add({"name": name, "ph": "i", "s": "p", "ts": round(_now_us(), 1),
+                  "args": args})
+
+    def flush(self):
+        with self.__lock:
+            data = {"traceEvents": list(self.events), "displayTimeUnit": "ms",
+                    "otherData": {"clock": "CLOCK_BOOTTIME", "dropped": self.dropped}}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+
+def _null_span(name, **args):
+    return _NULL_SPAN
+
+
+def _nothing(*args, **kwargs):
+    pass
+
+
+# rebound by start() when tracing is on
+span = _null_span
+instant = _nothing
+flush = _nothing
+tracer = None
+
+
+def start(name, setting=None):
+    """Turn tracing on for this process if YAHBOOM_TRACE (or `setting`) asks."""
+    global span, instant, flush, tracer
+    setting = os.environ.get(ENV, "") if setting is None else setting
+    if setting in ("", "0"):
+        return None
+    directory = TRACE_DIR if setting == "1" else setting
+    tracer = Tracer(name, os.path.join(directory, "trace-%s.json" % name))
+    span, instant, flush = tracer.span, tracer.instant, tracer.flush
+    atexit.register(tracer.flush)
+    return tracer
+
+
+def merge(paths):
+    """Combine trace files into one trace-event document."""
+    events = []
+    for path in paths:
+        try:
+            with open(path, "r") as f:
+                events.extend(json.load(f)["traceEvents"])
+        except (OSError, ValueError, KeyError):
+            continue
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["merge"]:
+        print(__doc__)
+        sys.exit(2)
+    out = sys.argv[2] if len(sys.argv) > 2 else "boot-trace.json"
+    directory = sys.argv[3] if len(sys.argv) > 3 else TRACE_DIR
+    paths = sorted(glob.glob(os.path.join(directory, "trace-*.json")))
+    with open(out, "w") as f:
+        json.dump(merge(paths), f)
+    print("%s: %d files merged" % (out, len(paths)))
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Compact in-memory metric history.
+
+Each metric is a Series of array-backed ring buffers at several
+resolutions: raw samples for the last 10 minutes, 10 s buckets for 2 hours
+and 1 min buckets for 24 hours, about 11 KB per metric. Coarser levels are
+fed by folding finished buckets of the level below (mean, or max so short
+spikes survive downsampling).
+
+The OLED daemon dumps its history to HISTORY_DUMP on SIGUSR1:
+
+    python3 history.py dump [out.bin]   # ask the daemon for a dump
+    python3 history.py show file.bin    # print a summary of a dump
+"""
+
+import array
+import os
+import shutil
+import signal
+import struct
+import sys
+import time
+
+HISTORY_DUMP = "/run/yahboom/history.bin"
+PID_FILE = "/run/yahboom/oled.pid"
+
+# (seconds per point, seconds covered)
+RESOLUTIONS = [(1, 600), (10, 7200), (60, 86400)]
+
+DUMP_MAGIC = b"YBHS"
+DUMP_VERSION = 1
+
+
+class RingBuffer:
+    """Fixed-capacity ring of floats in an array('f')."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.__data = array.array('f', bytes(4 * capacity))
+        self.__next = 0
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def append(self, value):
+        self.__data[self.__next] = value
+        self.__next = (self.__next + 1) % self.capacity
+        if self.__count < self.capacity:
+            self.__count += 1
+
+    def values(self, last=None):
+        """Return up to `last` values, oldest first."""
+        count = self.__count if last is None else min(last, self.__count)
+        start = (self.__next - count) % self.capacity
+        if start + count <= self.capacity:
+            return self.__data[start:start + count].tolist()
+        return (self.__data[start:] + self.__data[:self.__next]).tolist()
+
+    def to_array(self):
+        return array.array('f', self.values())
+
+
+class Series:
+    def __init__(self, step, agg="mean", resolutions=RESOLUTIONS):
+        """step: seconds between appended samples; agg: "mean" or "max"."""
+        self.step = step
+        self.agg = agg
+        levels = {}
+        for seconds, span in resolutions:
+            seconds = max(seconds, step)
+            levels[seconds] = max(levels.get(seconds, 0), span)
+        self.levels = [(seconds, RingBuffer(int(span // seconds)))
+                       for seconds, span in sorted(levels.items())]
+        # pending bucket per coarser level: [sum or max, count]
+        self.__pending = [[0.0, 0] for _ in self.levels[1:]]
+
+    def append(self, value):
+        self.levels[0][1].append(value)
+        for i, pending in enumerate(self.__pending):
+            seconds = self.levels[i + 1][0]
+            ratio = round(seconds / self.levels[i][0])
+            if self.agg == "max":
+                pending[0] = value if pending[1] == 0 else max(pending[0], value)
+            else:
+                pending[0] += value
+            pending[1] += 1
+            if pending[1] < ratio:
+                return
+            value = pending[0] if self.agg == "max" else pending[0] / pending[1]
+            self.levels[i + 1][1].append(value)
+            pending[0], pending[1] = 0.0, 0
+
+    def values(self, resolution, last=None):
+        """Values of the finest level with points at least `resolution` s apart."""
+        for seconds, ring in self.levels:
+            if seconds >= resolution:
+                return ring.values(last)
+        return self.levels[-1][1].values(last)
+
+
+class History:
+    def __init__(self, metrics):
+        """metrics: {name: (step seconds, "mean" | "max")}."""
+        self.series = {name: Series(step, agg) for name, (step, agg) in metrics.items()}
+
+    def record(self, name, value):
+        if value is not None and name in self.series:
+            self.series[name].append(value)
+
+    def dump(self, path):
+        """Write every level of every series to a binary file (atomically)."""
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(struct.pack("<4sHH d", DUMP_MAGIC, DUMP_VERSION,
+                                len(self.series), time.time()))
+            for name, series in self.series.items():
+                raw = name.encode()
+                f.write(struct.pack("<B", len(raw)) + raw)
+                f.write(struct.pack("<4sdB", series.agg.encode()[:4].ljust(4),
+                                    series.step, len(series.levels)))
+                for seconds, ring in series.levels:
+                    data = ring.to_array()
+                    if sys.byteorder != "little":
+                        data.byteswap()
+                    f.write(struct.pack("<dII", seconds, ring.capacity, len(data)))
+                    f.write(data.tobytes())
+        os.replace(tmp, path)
+
+
+def load_dump(path):
+    """Read a dump back as (timestamp, {name: {"agg", "step", "levels"}}).
+
+    "levels" is a list of (seconds per point, [values oldest first]).
+    """
+    with open(path, "rb") as f:
+        blob = f.read()
+    magic, version, count, timestamp = struct.unpack_from("<4sHH d", blob, 0)
+    if magic != DUMP_MAGIC or version != DUMP_VERSION:
+        raise ValueError("%s is not a version %d history dump" % (path, DUMP_VERSION))
+    pos = struct.calcsize("<4sHH d")
+    result = {}
+    for _ in range(count):
+        (n,) = struct.unpack_from("<B", blob, pos)
+        name = blob[pos + 1:pos + 1 + n].decode()
+        pos += 1 + n
+        agg, step, n_levels = struct.unpack_from("<4sdB", blob, pos)
+        pos += struct.calcsize("<4sdB")
+        levels = []
+        for _ in range(n_levels):
+            seconds, _, length = struct.unpack_from("<dII", blob, pos)
+            pos += struct.calcsize("<dII")
+            data = array.array('f')
+            data.frombytes(blob[pos:pos + 4 * length])
+            if sys.byteorder != "little":
+                data.byteswap()
+            pos += 4 * length
+            levels.append((seconds, data.tolist()))
+        result[name] = {"agg": agg.decode().strip(), "step": step, "levels": levels}
+    return timestamp, result
+
+
+def write_pid(pid_file=None):
+    """Let `history.py dump` find this process; optional, so errors are ignored."""
+    try:
+        with open(pid_file or PID_FILE, "w") as f:
+            f.write("%d\n" % os.getpid())
+    except OSError:
+        pass
+
+
+def remove_pid(pid_file=None):
+    """Remove the PID file if it is still ours."""
+    pid_file = pid_file or PID_FILE
+    try:
+        with open(pid_file, "r") as f:
+            if int(f.read().strip()) == os.getpid():
+                os.remove(pid_file)
+    except (OSError, ValueError):
+        pass
+
+
+def _is_oled_daemon(pid):
+    try:
+        with open("/proc/%d/cmdline" % pid, "rb") as f:
+            return b"oled.py" in f.read()
+    except OSError:
+        return False
+
+
+def request_dump(out=None, timeout=5.0):
+    """Signal the running OLED daemon to dump its history and wait for it."""
+    with open(PID_FILE, "r") as f:
+        pid = int(f.read().strip())
+    if not _is_oled_daemon(pid):
+        # left behind by a daemon that was killed; the PID may be reused
+        raise ProcessLookupError("no OLED daemon runs as pid %d (stale %s)" % (pid, PID_FILE))
+    try:
+        before = os.stat(HISTORY_DUMP).st_mtime_ns
+    except OSError:
+        before = None
+    os.kill(pid, signal.SIGUSR1)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if os.stat(HISTORY_DUMP).st_mtime_ns != before:
+                break
+        except OSError:
+            pass
+        time.sleep(0.05)
+    else:
+        raise TimeoutError("the OLED daemon did not write " + HISTORY_DUMP)
+    if out:
+        shutil.copyfile(HISTORY_DUMP, out)
+        return out
+    return HISTORY_DUMP
+
+
+def main(argv):
+    if len(argv) >= 1 and argv[0] == "dump":
+        print(request_dump(argv[1] if len(argv) > 1 else None))
+    elif len(argv) == 2 and argv[0] == "show":
+        timestamp, series = load_dump(argv[1])
+        print("dumped at", time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)))
+        for name, info in series.items():
+            for seconds, values in info["levels"]:
+                if values:
+                    print("%-10s %4ds x %4d  min %7.1f  max %7.1f  last %7.1f" % (
+                        name, seconds, len(values), min(values), max(values), values[-1]))
+                else:
+                    print("%-10s %4ds x    0" % (name, seconds))
+    else:
+        print(__doc__.strip().split("\n\n")[-1])
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""One process that owns the CUBE case's I2C bus.
+
+The OLED (SSD1306) and the fan/RGB controller (CubeNano) sit on the same
+bus. Instead of each daemon opening it, the broker opens it once and
+serves clients over a Unix socket (SOCK_SEQPACKET, one message per
+transfer request):
+
+    N<name>       introduce the client (shown in the stats); the reply
+                  says which devices the broker has, e.g.
+                  {"display": true, "leds": false}
+    F<page bytes> a whole SSD1306 framebuffer (oled_driver page format)
+    L<json>       fan/RGB settings, e.g. {"fan": 1, "color": 2}
+    S             reply with per-client stats as JSON
+
+Nothing is written while messages are being read. After every wakeup the
+broker writes the newest framebuffer (through DiffDisplay, so only changed
+columns go out) and then the newest value of each LED setting that differs
+from what the CubeNano already has. A framebuffer or setting replaced before
+it reached the bus counts as coalesced for its client. Only the broker's
+thread touches the bus, so transfers never interleave, and a frame waits
+for at most one batch of LED register writes.
+
+The stats give every client its messages, coalesced updates, bus writes,
+bytes and bus time, and the longest wait between a message arriving and
+its bus write. A write the bus rejects is counted as an error and kept
+pending for the next wakeup; the broker keeps running.
+
+A device that did not answer when the broker started is tried again every
+DEVICE_RETRY_INTERVAL seconds. Clients that find no broker, or a broker
+without their device (connect(need=...)), open the bus themselves and look
+for the broker again every RECONNECT_INTERVAL seconds, so after a broker
+restart or once it has their device they go back to it.
+
+    python3 i2c_broker.py [bus=7] [debug]   # run the broker
+    python3 i2c_broker.py stats             # print per-client stats
+    python3 i2c_broker.py clear             # blank the OLED
+"""
+
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import sys
+import time
+
+from oled_driver import DiffDisplay, pack_image
+from scheduler import Scheduler
+
+BROKER_SOCKET = "/run/yahboom/i2c.sock"
+MAX_MESSAGE = 4096
+CLIENT_TIMEOUT = 1.0
+# how often a client that fell back to opening the bus looks for the broker again
+RECONNECT_INTERVAL = 5.0
+# how often the broker tries again to open a device that did not answer
+DEVICE_RETRY_INTERVAL = 5.0
+
+# LED setting -> CubeNano setter, in the order they are written (fan first)
+LED_SETTERS = [
+    ("fan", "set_Fan"),
+    ("effect", "set_RGB_Effect"),
+    ("color", "set_RGB_Color"),
+    ("speed", "set_RGB_Speed"),
+]
+
+
+class _Client:
+    def __init__(self, sock, pid):
+        self.sock = sock
+        self.name = "pid %d" % pid
+        self.pid = pid
+        self.messages = 0
+        self.coalesced = 0
+        self.writes = 0
+        self.bytes = 0
+        self.bus_s = 0.0
+        self.max_wait_s = 0.0
+
+    def charge(self, received, started, ended, sent):
+        self.writes += 1
+        self.bytes += sent
+        self.bus_s += ended - started
+        self.max_wait_s = max(self.max_wait_s, ended - received)
+
+    def stats(self):
+        return {"pid": self.pid, "messages": self.messages, "coalesced": self.coalesced,
+                "writes": self.writes, "bytes": self.bytes,
+                "bus_ms": round(self.bus_s * 1000, 3),
+                "max_wait_ms": round(self.max_wait_s * 1000, 3)}
+
+
+class BusBroker:
+    def __init__(self, display=None, bot=None, socket_path=BROKER_SOCKET,
+                 clock=time.monotonic, debug=False, display_opener=None, bot_opener=None):
+        """display: a DiffDisplay for the OLED, bot: a CubeNano; either may
+        be None when that device did not answer. display_opener and
+        bot_opener return a missing device or None; the broker keeps calling
+        them until the device is there."""
+        self.display = display
+        self.bot = bot
+        self.__openers = {"display": display_opener, "bot": bot_opener}
+        self.socket_path = socket_path
+        self.clock = clock
+        self.debug = debug
+        self.sched = Scheduler(clock)
+        self.dropped = 0
+        self.errors = 0
+        self.__clients = {}
+        self.__gone = {}
+        self.__frame = None         # (client, received, buf)
+        self.__leds = {}            # setting -> (client, received, value)
+        self.__led_state = {}
+
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            try:
+                os.unlink(socket_path)
+            except FileNotFoundError:
+                pass
+            self.__sock.bind(socket_path)
+            # the services all run as the installing user; nobody else may drive the fan
+            os.chmod(socket_path, 0o660)
+            self.__sock.listen(8)
+        except OSError:
+            self.__sock.close()
+            raise
+        self.__sock.setblocking(False)
+        self.sched.add_reader(self.__sock, self.__accept)
+        self.__retry = None
+        if self.__missing():
+            self.__retry = self.sched.every(DEVICE_RETRY_INTERVAL, self.__open_missing,
+                                            delay=DEVICE_RETRY_INTERVAL)
+
+    def fileno(self):
+        return self.__sock.fileno()
+
+    def __missing(self):
+        return [attr for attr, opener in self.__openers.items()
+                if opener is not None and getattr(self, attr) is None]
+
+    def __open_missing(self):
+        for attr in self.__missing():
+            device = self.__openers[attr]()
+            if device is not None:
+                setattr(self, attr, device)
+                if self.debug:
+                    print("---I2C broker opened the %s---" % attr)
+        if not self.__missing():
+            self.__retry.cancel()
+
+    def devices(self):
+        """Which devices clients can reach through the broker."""
+        return {"display": self.display is not None, "leds": self.bot is not None}
+
+    def __accept(self):
+        try:
+            sock, _ = self.__sock.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        try:
+            creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                    struct.calcsize("3i"))
+            pid = struct.unpack("3i", creds)[0]
+        except OSError:
+            pid = 0
+        client = _Client(sock, pid)
+        self.__clients[sock.fileno()] = client
+        self.sched.add_reader(sock, lambda: self.__receive(client))
+
+    def __receive(self, client):
+        while True:
+            try:
+                data = client.sock.recv(MAX_MESSAGE)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b""
+            if not data:
+                self.__drop(client)
+                return
+            self.__handle(client, data)
+
+    def __drop(self, client):
+        self.sched.remove_reader(client.sock)
+        del self.__clients[client.sock.fileno()]
+        client.sock.close()
+        # keep its numbers: a client that reconnects continues them
+        self.__gone[client.name] = client
+
+    def __handle(self, client, data):
+        kind, body = data[:1], data[1:]
+        now = self.clock()
+        if kind == b"N":
+            name = body.decode(errors="replace")
+            old = self.__gone.pop(name, None)
+            if old is not None:
+                for field in ("messages", "coalesced", "writes", "bytes", "bus_s"):
+                    setattr(client, field, getattr(client, field) + getattr(old, field))
+                client.max_wait_s = max(client.max_wait_s, old.max_wait_s)
+            client.name = name
+            try:
+                client.sock.send(json.dumps(self.devices()).encode())
+            except OSError:
+                pass
+        elif kind == b"F":
+            client.messages += 1
+            if self.__frame is not None:
+                self.__frame[0].coalesced += 1
+            self.__frame = (client, now, body)
+        elif kind == b"L":
+            client.messages += 1
+            try:
+                settings = json.loads(body)
+            except ValueError:
+                return
+            for key, value in settings.items():
+                if key in self.__leds:
+                    self.__leds[key][0].coalesced += 1
+                self.__leds[key] = (client, now, value)
+        elif kind == b"S":
+            try:
+                client.sock.send(json.dumps(self.stats()).encode())
+            except OSError:
+                pass
+
+    def flush(self):
+        """Write what is pending: the framebuffer first, then LED settings."""
+        if self.__frame is not None:
+            client, received, buf = self.__frame
+            self.__frame = None
+            if self.display is None:
+                self.dropped += 1
+            else:
+                started = self.clock()
+                try:
+                    sent = self.display.show(buf)
+                except OSError as e:
+                    # the panel's state is unknown now: resend it whole
+                    self.display.invalidate()
+                    self.__failed("frame", e)
+                    self.__frame = (client, received, buf)
+                    sent = 0
+                if sent:
+                    client.charge(received, started, self.clock(), sent)
+        leds, self.__leds = self.__leds, {}
+        for key, setter in LED_SETTERS:
+            if key not in leds:
+                continue
+            client, received, value = leds[key]
+            if self.bot is None:
+                self.dropped += 1
+                continue
+            if self.__led_state.get(key) == value:
+                continue
+            started = self.clock()
+            try:
+                getattr(self.bot, setter)(value)
+            except OSError as e:
+                self.__led_state.pop(key, None)
+                self.__failed(key, e)
+                self.__leds.setdefault(key, leds[key])
+                continue
+            self.__led_state[key] = value
+            # a CubeNano register write: address, register, value
+            client.charge(received, started, self.clock(), 3)
+
+    def __failed(self, what, error):
+        self.errors += 1
+        if self.debug:
+            print("---I2C broker %s write failed---:" % what, error)
+
+    def stats(self):
+        clients = {}
+        for client in list(self.__gone.values()) + list(self.__clients.values()):
+            clients[client.name] = client.stats()
+        return dict(self.devices(), clients=clients, dropped=self.dropped,
+                    errors=self.errors, wakeups=self.sched.wakeups)
+
+    def run_forever(self):
+        self.sched.run_forever(after=self.flush)
+
+    def close(self):
+        for client in list(self.__clients.values()):
+            self.__drop(client)
+        self.sched.remove_reader(self.__sock)
+        self.__sock.close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+class BrokerClient:
+    """Connection to the broker. Calls raise OSError once the broker is gone."""
+
+    def __init__(self, name, socket_path=BROKER_SOCKET, timeout=CLIENT_TIMEOUT):
+        self.name = name
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.__sock.settimeout(timeout)
+            self.__sock.connect(socket_path)
+            self.__sock.send(b"N" + name.encode())
+            reply = self.__sock.recv(MAX_MESSAGE)
+        except OSError:
+            self.__sock.close()
+            raise
+        try:
+            # {"display": bool, "leds": bool}: what the broker can drive
+            self.devices = json.loads(reply)
+        except ValueError:
+            self.__sock.close()
+            raise OSError("no device list from the I2C broker")
+
+    def fileno(self):
+        return self.__sock.fileno()
+
+    def connected(self):
+        """False once the broker has closed the connection (it stopped)."""
+        # past the device list the broker only sends stats replies, so
+        # readable means EOF
+        try:
+            return not select.select([self.__sock], [], [], 0)[0]
+        except (OSError, ValueError):
+            return False
+
+    def show(self, buf):
+        self.__sock.send(b"F" + bytes(buf))
+
+    def set_leds(self, **settings):
+        self.__sock.send(b"L" + json.dumps(settings).encode())
+
+    def stats(self):
+        self.__sock.send(b"S")
+        return json.loads(self.__sock.recv(65536))
+
+    def close(self):
+        self.__sock.close()
+
+
+class BrokerDisplay:
+    """DiffDisplay look-alike that hands frames to the broker.
+
+    Unchanged frames are skipped here; the broker works out which columns
+    changed on the panel. total_bytes counts framebuffer bytes handed over.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.__last = None
+        self.frames = 0
+        self.skipped = 0
+        self.last_bytes = 0
+        self.total_bytes = 0
+
+    def invalidate(self):
+        self.__last = None
+
+    def show(self, buf):
+        buf = bytes(buf)
+        self.frames += 1
+        if buf == self.__last:
+            self.skipped += 1
+            self.last_bytes = 0
+            return 0
+        self.client.show(buf)
+        self.__last = buf
+        self.last_bytes = len(buf)
+        self.total_bytes += len(buf)
+        return len(buf)
+
+    def show_image(self, image):
+        return self.show(pack_image(image))
+
+
+class BrokerCubeNano:
+    """The CubeNano setters rgb_blue uses, sent through the broker."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def set_Fan(self, state):
+        self.client.set_leds(fan=state)
+
+    def set_RGB_Effect(self, effect):
+        self.client.set_leds(effect=effect)
+
+    def set_RGB_Color(self, color):
+        self.client.set_leds(color=color)
+
+    def set_RGB_Speed(self, speed):
+        self.client.set_leds(speed=speed)
+
+
+def connect(name, socket_path=BROKER_SOCKET, need=None):
+    """Return a BrokerClient, or None if no broker is listening or it does
+    not have the device named by need ("display" or "leds")."""
+    if not socket_path:
+        return None
+    try:
+        client = BrokerClient(name, socket_path)
+    except OSError:
+        return None
+    if need is not None and not client.devices.get(need):
+        client.close()
+        return None
+    return client
+
+
+def open_display(i2c_bus, width=128, height=32):
+    try:
+        import Adafruit_SSD1306 as SSD
+        oled = SSD.SSD1306_128_32(rst=None, i2c_bus=i2c_bus, gpio=1)
+        oled.begin()
+        oled.clear()
+        oled.display()
+        return DiffDisplay(oled._i2c, width, height)
+    except Exception:
+        return None
+
+
+def open_bot(i2c_bus):
+    try:
+        from CubeNanoLib import CubeNano
+        return CubeNano(i2c_bus=i2c_bus)
+    except Exception:
+        return None
+
+
+def main(i2c_bus=7, debug=False, socket_path=BROKER_SOCKET):
+    broker = BusBroker(open_display(i2c_bus), open_bot(i2c_bus), socket_path, debug=debug,
+                       display_opener=lambda: open_display(i2c_bus),
+                       bot_opener=lambda: open_bot(i2c_bus))
+    if debug:
+        print("---I2C broker on bus %d: display %s, leds %s---" % (
+            i2c_bus, broker.display is not None, broker.bot is not None))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        broker.run_forever()
+    finally:
+        try:
+            if broker.bot is not None:
+                # nobody controls the fan any more
+                broker.bot.set_Fan(1)
+        except OSError:
+            pass
+        broker.close()
+
+
+if __name__ == "__main__":
+    broker_args = {}
+    command = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("bus="):
+            broker_args["i2c_bus"] = int(arg[len("bus="):])
+        elif arg.startswith("socket="):
+            broker_args["socket_path"] = arg[len("socket="):]
+        elif arg == "debug":
+            broker_args["debug"] = True
+        elif arg in ("stats", "clear"):
+            command = arg
+    if command is None:
+        try:
+            main(**broker_args)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    client = connect(command, broker_args.get("socket_path", BROKER_SOCKET),
+                     need="display" if command == "clear" else None)
+    if client is None:
+        print("no I2C broker listening" if command == "stats" else "no I2C broker driving the OLED")
+        sys.exit(1)
+    if command == "clear":
+        client.show(bytes(128 * 32 // 8))
+    else:
+        for name, s in sorted(client.stats()["clients"].items()):
+            if name == "stats":
+                continue
+            print("%-12s msgs %-7d coalesced %-7d writes %-7d bytes %-9d bus %9.1f ms  max wait %.1f ms" % (
+                name, s["messages"], s["coalesced"], s["writes"], s["bytes"],
+                s["bus_ms"], s["max_wait_ms"]))
+    client.close()
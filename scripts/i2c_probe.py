@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Find the I2C bus the OLED sits on.
+
+Every /dev/i2c-* is probed at once, each probe in its own thread with a
+timeout, with the same SMBus quick-write i2cdetect uses. The winning bus is
+remembered in a small state file so later starts go straight to it; the
+buses are only rescanned when that bus stops answering.
+
+    python3 i2c_probe.py [address]    # print the buses that answer
+"""
+
+import fcntl
+import glob
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+SSD1306_ADDRESS = 0x3C
+I2C_DEV_GLOB = "/dev/i2c-*"
+STATE_FILE = os.path.expanduser("~/.cache/yahboom/oled_i2c_bus")
+PROBE_TIMEOUT = 0.5
+
+I2C_SLAVE = 0x0703
+I2C_SMBUS = 0x0720
+I2C_SMBUS_WRITE = 0
+I2C_SMBUS_QUICK = 0
+
+
+def list_buses(pattern=I2C_DEV_GLOB):
+    """Return the numbers of all I2C bus device nodes, sorted."""
+    buses = []
+    for path in glob.glob(pattern):
+        try:
+            buses.append(int(path.rsplit("-", 1)[1]))
+        except ValueError:
+            continue
+    return sorted(buses)
+
+
+def probe_bus(bus, address=SSD1306_ADDRESS):
+    """Return True if a device ACKs `address` on /dev/i2c-<bus>."""
+    try:
+        fd = os.open("/dev/i2c-%d" % bus, os.O_RDWR)
+    except OSError:
+        return False
+    try:
+        fcntl.ioctl(fd, I2C_SLAVE, address)
+        # struct i2c_smbus_ioctl_data {u8 read_write; u8 command; u32 size; data *}
+        fcntl.ioctl(fd, I2C_SMBUS, struct.pack(
+            "BBIP", I2C_SMBUS_WRITE, 0, I2C_SMBUS_QUICK, 0))
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+def discover(address=SSD1306_ADDRESS, buses=None, timeout=PROBE_TIMEOUT,
+             probe=probe_bus):
+    """Probe all buses concurrently and return those where address answers.
+
+    A probe that has not finished after `timeout` seconds (a wedged bus) is
+    counted as a miss; its thread is left to finish in the background.
+    """
+    if buses is None:
+        buses = list_buses()
+    results = queue.Queue()
+
+    def worker(bus):
+        try:
+            results.put((bus, probe(bus, address)))
+        except Exception:
+            results.put((bus, False))
+
+    for bus in buses:
+        threading.Thread(target=worker, args=(bus,), daemon=True).start()
+
+    found = []
+    pending = len(buses)
+    deadline = time.monotonic() + timeout
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            bus, ok = results.get(timeout=remaining)
+        except queue.Empty:
+            break
+        pending -= 1
+        if ok:
+            found.append(bus)
+    return sorted(found)
+
+
+def read_state(state_file=STATE_FILE):
+    try:
+        with open(state_file, "r") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def write_state(bus, state_file=STATE_FILE):
+    try:
+        os.makedirs(os.path.dirname(state_file), exist_ok=True)
+        tmp = state_file + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("%d\n" % bus)
+        os.replace(tmp, state_file)
+    except OSError:
+        pass
+
+
+def forget_state(state_file=STATE_FILE):
+    try:
+        os.remove(state_file)
+    except OSError:
+        pass
+
+
+def find_bus(address=SSD1306_ADDRESS, preferred=(), state_file=STATE_FILE,
+             timeout=PROBE_TIMEOUT, buses=None, probe=probe_bus):
+    """Return the bus to use for `address`, or None if no bus answers.
+
+    The cached bus is tried first; otherwise every bus is scanned and, if
+    several answer, the first one in `preferred` wins.
+    """
+    cached = read_state(state_file)
+    if cached is not None and cached in discover(address, [cached], timeout, probe):
+        return cached
+    found = discover(address, buses, timeout, probe)
+    if not found:
+        forget_state(state_file)
+        return None
+    ranked = [bus for bus in preferred if bus in found] + found
+    write_state(ranked[0], state_file)
+    return ranked[0]
+
+
+if __name__ == "__main__":
+    addr = int(sys.argv[1], 0) if len(sys.argv) > 1 else SSD1306_ADDRESS
+    print(" ".join(str(bus) for bus in discover(addr)) or "none")
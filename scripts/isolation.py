@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Keep the status daemons out of the way of a real-time workload.
+
+With YAHBOOM_ISOLATE set (in /etc/default/yahboom, read by the OLED and
+portal services), isolate() moves the calling process to the housekeeping
+CPU(s), where the kernel already runs most of its own work, and makes it
+the last thing to get CPU time and disk I/O there:
+
+- CPU affinity: "1" means CPU 0, anything else is a CPU list ("2",
+  "0-1", "0,2"; CPU 1 alone is "1-1"). "0" turns isolation off.
+- SCHED_IDLE, and nice 19 for whatever SCHED_IDLE does not cover
+- I/O priority class idle
+- mlockall(MCL_CURRENT | MCL_FUTURE | MCL_ONFAULT): the pages the daemon
+  touches stay resident, so a wakeup never waits for a page-in, and pages
+  it never touches are not pulled in
+
+Call it before the process starts threads or children; they inherit all
+of it. Every step is best effort: what could not be applied is reported,
+not raised.
+
+LoadBackoff stretches the OLED's sampling intervals while the system is
+busy and restores them when it calms down.
+
+    python3 isolation.py [cpus]      # isolate this process and show what stuck
+"""
+
+import ctypes
+import ctypes.util
+import os
+import platform
+import sys
+
+ENV = "YAHBOOM_ISOLATE"
+HOUSEKEEPING_CPUS = [0]
+
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+SYS_IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "armv7l": 314}
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+MCL_ONFAULT = 4
+
+BACKOFF_CPU = 80        # overall CPU percent that starts backing off
+RESUME_CPU = 60         # ...and that ends it
+BACKOFF_FACTOR = 4
+
+
+def parse_cpus(text):
+    """"0-2,5" -> [0, 1, 2, 5]."""
+    cpus = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def housekeeping_cpus(setting):
+    """CPUs to run on for a YAHBOOM_ISOLATE value, or None for "off"."""
+    if setting in ("", "0", None):
+        return None
+    if setting == "1":
+        return list(HOUSEKEEPING_CPUS)
+    return parse_cpus(setting)
+
+
+def _libc():
+    return ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+
+def set_ioprio_idle(libc=None):
+    number = SYS_IOPRIO_SET.get(platform.machine())
+    if number is None:
+        raise OSError("ioprio_set: unknown syscall number on %s" % platform.machine())
+    libc = libc or _libc()
+    if libc.syscall(number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, "ioprio_set: " + os.strerror(err))
+
+
+def lock_memory(libc=None):
+    libc = libc or _libc()
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE | MCL_ONFAULT) == 0:
+        return
+    # kernels before 4.4 do not know MCL_ONFAULT
+    if ctypes.get_errno() == 22 and libc.mlockall(MCL_CURRENT | MCL_FUTURE) == 0:
+        return
+    err = ctypes.get_errno()
+    raise OSError(err, "mlockall: " + os.strerror(err))
+
+
+def isolate(setting=None):
+    """Apply isolation if YAHBOOM_ISOLATE (or `setting`) asks for it.
+
+    Returns {step: "ok" or the reason it failed}, or None when off.
+    """
+    setting = os.environ.get(ENV, "") if setting is None else setting
+    cpus = housekeeping_cpus(setting)
+    if cpus is None:
+        return None
+    applied = {}
+    try:
+        allowed = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, [cpu for cpu in cpus if cpu in allowed] or allowed)
+        applied["affinity"] = "ok"
+    except (OSError, ValueError) as e:
+        applied["affinity"] = str(e)
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+        applied["sched_idle"] = "ok"
+    except (OSError, AttributeError) as e:
+        applied["sched_idle"] = str(e)
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, 19)
+        applied["nice"] = "ok"
+    except OSError as e:
+        applied["nice"] = str(e)
+    for name, step in (("ioprio", set_ioprio_idle), ("mlock", lock_memory)):
+        try:
+            step()
+            applied[name] = "ok"
+        except (OSError, AttributeError) as e:
+            applied[name] = str(e)
+    return applied
+
+
+class LoadBackoff:
+    """Interval multiplier from the overall CPU load: `factor` from the
+    moment load reaches `backoff` percent until it drops below `resume`."""
+
+    def __init__(self, backoff=BACKOFF_CPU, resume=RESUME_CPU, factor=BACKOFF_FACTOR):
+        self.backoff = backoff
+        self.resume = resume
+        self.factor = factor
+        self.active = False
+        self.changes = 0
+
+    def update(self, cpu):
+        """Feed one CPU percent sample; returns the interval multiplier."""
+        if cpu is not None:
+            active = cpu >= self.backoff if not self.active else cpu >= self.resume
+            if active != self.active:
+                self.active = active
+                self.changes += 1
+        return self.factor if self.active else 1
+
+
+if __name__ == "__main__":
+    print("%s=%r" % (ENV, os.environ.get(ENV, "")))
+    result = isolate(sys.argv[1] if len(sys.argv) > 1 else "1")
+    if result is None:
+        print("  off")
+        sys.exit(0)
+    for step, outcome in result.items():
+        print("  %-10s %s" % (step, outcome))
+    print("  now on CPUs %s, policy %d, nice %d" % (
+        sorted(os.sched_getaffinity(0)), os.sched_getscheduler(0),
+        os.getpriority(os.PRIO_PROCESS, 0)))
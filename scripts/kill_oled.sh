@@ -2,6 +2,12 @@
 SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 sudo systemctl stop yahboom_oled.service
 
+# With the I2C broker running, it blanks the panel itself
+if python3 "$SCRIPT_DIR/i2c_broker.py" clear; then
+    echo "OLED cleared through the I2C broker"
+    exit 0
+fi
+
 len1=$(ps -ef | grep oled.py | grep -v grep | wc -l)
 echo "Number of processes=$len1"
 
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""What wifi_setup has learned about WiFi networks, kept across boots.
+
+For every SSID seen in a scan: the last signal and when it was seen; for
+every connect attempt: when it last worked or failed, how many times in a
+row it failed and how long joining took. wifi_setup ranks the saved
+networks that are visible with it at boot and tries the best ones itself
+before it falls back to the hotspot. Passwords stay in NetworkManager.
+
+    python3 known_networks.py [store]     # print the store, best first
+"""
+
+import json
+import os
+import sys
+import time
+
+STORE_FILE = "/var/lib/yahboom/known_networks.json"
+FORGET_AFTER = 90 * 86400   # drop networks that were neither seen nor joined for this long
+RECENT = 7 * 86400          # a success this recent counts as "works here"
+
+
+class KnownNetworks:
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self.networks = {}
+        try:
+            with open(path, "r") as f:
+                self.networks = json.load(f).get("networks", {})
+        except (OSError, ValueError):
+            pass
+
+    def __entry(self, ssid):
+        return self.networks.setdefault(ssid, {
+            "signal": None, "last_seen": None, "last_success": None,
+            "last_failure": None, "failures": 0, "join_s": None})
+
+    def record_scan(self, aps, now=None):
+        """Remember the strongest signal per SSID from one scan."""
+        now = time.time() if now is None else now
+        best = {}
+        for ap in aps:
+            best[ap["ssid"]] = max(ap["signal"], best.get(ap["ssid"], 0))
+        for ssid, signal in best.items():
+            entry = self.__entry(ssid)
+            entry["signal"] = signal
+            entry["last_seen"] = now
+        self.__forget(now)
+
+    def record_attempt(self, ssid, ok, join_s=None, now=None):
+        """Remember the outcome of joining ssid (join_s: seconds it took)."""
+        now = time.time() if now is None else now
+        entry = self.__entry(ssid)
+        if ok:
+            entry["last_success"] = now
+            entry["failures"] = 0
+            if join_s is not None:
+                # smooth it so one slow DHCP server does not decide the order
+                old = entry["join_s"]
+                entry["join_s"] = round(join_s if old is None else 0.7 * old + 0.3 * join_s, 2)
+        else:
+            entry["last_failure"] = now
+            entry["failures"] += 1
+
+    def __forget(self, now):
+        for ssid, entry in list(self.networks.items()):
+            last = max(entry["last_seen"] or 0, entry["last_success"] or 0)
+            if now - last > FORGET_AFTER:
+                del self.networks[ssid]
+
+    def score(self, ssid, signal, now=None):
+        """Higher is better: signal, plus a bonus for a recent success,
+        minus penalties for failures in a row and slow joins."""
+        now = time.time() if now is None else now
+        entry = self.networks.get(ssid, {})
+        score = float(signal)
+        if entry.get("last_success") and now - entry["last_success"] < RECENT:
+            score += 30
+        score -= 15 * entry.get("failures", 0)
+        if entry.get("join_s"):
+            score -= min(entry["join_s"], 20)
+        return score
+
+    def ranked(self, visible, saved, now=None):
+        """SSIDs in both `visible` ({ssid: signal}) and `saved`, best first."""
+        candidates = [ssid for ssid in visible if ssid in saved]
+        return sorted(candidates, key=lambda ssid: self.score(ssid, visible[ssid], now),
+                      reverse=True)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"networks": self.networks}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+if __name__ == "__main__":
+    store = KnownNetworks(sys.argv[1] if len(sys.argv) > 1 else STORE_FILE)
+    now = time.time()
+    entries = sorted(store.networks.items(),
+                     key=lambda item: store.score(item[0], item[1]["signal"] or 0, now),
+                     reverse=True)
+    for ssid, e in entries:
+        def ago(t):
+            return "never" if t is None else "%dh ago" % ((now - t) / 3600)
+        print("%-32s signal %-4s seen %-9s ok %-9s failed %-9s (%d in a row) join %s s" % (
+            ssid, e["signal"], ago(e["last_seen"]), ago(e["last_success"]),
+            ago(e["last_failure"]), e["failures"], e["join_s"]))
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""OpenMetrics / Prometheus text endpoint for the OLED daemon's samples.
+
+MetricsEndpoint is a listening TCP socket on the daemon's Scheduler, like
+the portal and netlink sockets: a scrape is served from the daemon's own
+loop, no thread. Connections are non-blocking and each one is watched by
+the Scheduler until its request is complete, so a slow or idle client
+never holds up the loop; one that sends nothing within REQUEST_TIMEOUT is
+dropped. It only ever formats what the
+providers last sampled. The body is serialized on the first scrape after
+a sample and that copy is reused until the next one (invalidate()), so
+scraping never reads /proc or /sys.
+
+Besides the values, the body has the daemon's own cost: scheduler
+wakeups, seconds spent running its loop, how late its timed tasks ran,
+process CPU seconds and resident memory, and each provider's interval and
+measured sampling cost. The per-metric sample age
+(yahboom_sample_age_seconds) is the one part computed per scrape, from
+the kept sample times.
+
+GET /metrics answers in OpenMetrics 1.0 when the scraper asks for it
+(Accept: application/openmetrics-text), otherwise in Prometheus text 0.0.4.
+
+By default it listens on 127.0.0.1 only; give a host ("0.0.0.0:9101") to
+let other machines scrape it.
+
+    python3 metrics_http.py [host:]port   # fetch and print /metrics
+"""
+
+import http.client
+import os
+import socket
+import sys
+
+from sampler import FileSource
+
+OPENMETRICS_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+REQUEST_TIMEOUT = 0.5
+MAX_REQUEST = 4096
+MAX_CONNECTIONS = 8
+GIB = 1073741824
+
+# value key, metric family, help, multiplier to base units
+GAUGES = [
+    ("cpu", "yahboom_cpu_usage_percent", "CPU usage over the last sample interval.", 1),
+    ("ram_used", "yahboom_memory_used_percent", "RAM in use, as free's used column.", 1),
+    ("ram_total", "yahboom_memory_total_bytes", "Total RAM.", GIB),
+    ("disk_used", "yahboom_disk_used_percent", "Root filesystem usage, as df's Use%.", 1),
+    ("disk_total", "yahboom_disk_total_bytes", "Root filesystem size.", GIB),
+    ("gpu_load", "yahboom_gpu_load_percent", "GPU load.", 1),
+    ("gpu_clock", "yahboom_gpu_clock_hertz", "Current GPU clock.", 1000000),
+    ("gpu_clock_max", "yahboom_gpu_clock_max_hertz", "Highest GPU clock allowed.", 1000000),
+    ("emc_clock", "yahboom_emc_clock_hertz", "Current memory controller clock (root only).", 1000000),
+    ("emc_clock_max", "yahboom_emc_clock_max_hertz", "Highest memory controller clock.", 1000000),
+]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in labels)
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value) if value == value else "NaN"
+    return str(value)
+
+
+def families(values, registry=None, sched=None, display=None):
+    """Build [(name, type, help, [(labels, value)])] from the daemon's state.
+
+    Counters are named without _total; render() adds it.
+    """
+    out = []
+
+    def add(name, kind, text, samples):
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if samples:
+            out.append((name, kind, text, samples))
+
+    for key, name, text, scale in GAUGES:
+        value = values.get(key)
+        add(name, "gauge", text, [((), None if value is None else value * scale)])
+    add("yahboom_cpu_core_usage_percent", "gauge", "Per-core CPU usage.",
+        [((("core", i),), load) for i, load in enumerate(values.get("cpu_cores") or ())])
+    add("yahboom_thermal_zone_celsius", "gauge", "Thermal zone temperature.",
+        [((("zone", zone),), temp) for zone, temp in sorted((values.get("temps") or {}).items())])
+    if values.get("ip"):
+        add("yahboom_ip_address", "gauge", "Address shown on the IP line (always 1).",
+            [((("ip", values["ip"]),), 1)])
+    portal = values.get("portal")
+    if portal:
+        add("yahboom_portal_state", "gauge", "WiFi-setup portal state (always 1).",
+            [((("state", portal.get("state", "idle")),), 1)])
+
+    if sched is not None:
+        add("yahboom_loop_wakeups", "counter", "Scheduler wakeups.", [((), sched.wakeups)])
+        add("yahboom_loop_busy_seconds", "counter",
+            "Time spent running the loop's callbacks and redraws.", [((), sched.busy)])
+        add("yahboom_loop_late_seconds", "gauge",
+            "How late the last timed task ran.", [((), sched.last_late)])
+        add("yahboom_loop_late_max_seconds", "gauge",
+            "Worst lateness of a timed task since start.", [((), sched.max_late)])
+    if registry is not None:
+        stats = sorted(registry.stats().items())
+        add("yahboom_provider_interval_seconds", "gauge", "Provider sampling interval.",
+            [((("provider", name),), interval * registry.slowdown)
+             for name, (interval, _, _) in stats])
+        add("yahboom_provider_cost_seconds", "gauge", "CPU time of the provider's last sample.",
+            [((("provider", name),), None if cost is None else cost / 1e6)
+             for name, (_, _, cost) in stats])
+    if display is not None:
+        add("yahboom_display_frames", "counter", "Frames drawn.", [((), display["frames"])])
+        add("yahboom_display_skipped_frames", "counter", "Frames not sent because nothing changed.",
+            [((), display["skipped"])])
+        add("yahboom_display_bytes", "counter", "Bytes sent to the panel.", [((), display["bytes"])])
+
+    times = os.times()
+    add("yahboom_process_cpu_seconds", "counter", "CPU time of the daemon.",
+        [((), times.user + times.system)])
+    add("yahboom_process_resident_memory_bytes", "gauge", "Resident set size of the daemon.",
+        [((), _resident_bytes())])
+    return out
+
+
+_STATM = FileSource("/proc/self/statm", 256)
+
+
+def _resident_bytes():
+    try:
+        return int(_STATM.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def render(fams, openmetrics):
+    """Serialize families; the OpenMetrics form is missing its "# EOF"."""
+    lines = []
+    for name, kind, text, samples in fams:
+        sample_name = name + "_total" if kind == "counter" else name
+        family = name if openmetrics else sample_name
+        lines.append("# HELP %s %s" % (family, text))
+        lines.append("# TYPE %s %s" % (family, kind))
+        for labels, value in samples:
+            lines.append("%s%s %s" % (sample_name, _labels(labels), _number(value)))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def render_ages(sampled_at, now):
+    lines = ["# HELP yahboom_sample_age_seconds Seconds since the value was sampled.",
+             "# TYPE yahboom_sample_age_seconds gauge"]
+    for key in sorted(sampled_at):
+        lines.append('yahboom_sample_age_seconds{metric="%s"} %.3f' % (
+            _escape(key), max(0.0, now - sampled_at[key])))
+    return ("\n".join(lines) + "\n").encode()
+
+
+class MetricsEndpoint:
+    def __init__(self, address, collect, sched, sampled_at=None):
+        """address: (host, port); collect() returns families().
+        sched: the daemon's Scheduler, which watches the listening socket and
+        every open connection. sampled_at: {metric: clock time} for the
+        sample ages."""
+        self.address = address
+        self.collect = collect
+        self.sched = sched
+        self.sampled_at = sampled_at if sampled_at is not None else {}
+        self.clock = sched.clock
+        self.scrapes = 0
+        self.renders = 0
+        self.dropped = 0
+        self.__bodies = {}
+        self.__conns = {}           # socket -> [request bytes so far, timeout task]
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.__sock.bind(address)
+            self.__sock.listen(MAX_CONNECTIONS)
+        except OSError:
+            self.__sock.close()
+            raise
+        self.__sock.setblocking(False)
+        sched.add_reader(self.__sock, self.__accept)
+
+    def fileno(self):
+        return self.__sock.fileno()
+
+    @property
+    def port(self):
+        return self.__sock.getsockname()[1]
+
+    def invalidate(self):
+        """New values were sampled: serialize again on the next scrape."""
+        self.__bodies = {}
+
+    def body(self, openmetrics):
+        cached = self.__bodies.get(openmetrics)
+        if cached is None:
+            cached = self.__bodies[openmetrics] = render(self.collect(), openmetrics)
+            self.renders += 1
+        body = cached + render_ages(self.sampled_at, self.clock())
+        return body + b"# EOF\n" if openmetrics else body
+
+    def __accept(self):
+        # nothing here may block: the loop also drives the display and sampling
+        while True:
+            try:
+                conn, _ = self.__sock.accept()
+            except OSError:
+                return
+            if len(self.__conns) >= MAX_CONNECTIONS:
+                self.dropped += 1
+                conn.close()
+                continue
+            conn.setblocking(False)
+            self.__conns[conn] = [b"", self.sched.call_later(
+                REQUEST_TIMEOUT, lambda conn=conn: self.__drop(conn, timed_out=True))]
+            self.sched.add_reader(conn, lambda conn=conn: self.__receive(conn))
+
+    def __receive(self, conn):
+        try:
+            data = conn.recv(MAX_REQUEST)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if data:
+            request = self.__conns[conn][0] + data
+            if b"\r\n\r\n" not in request and len(request) < MAX_REQUEST:
+                self.__conns[conn][0] = request
+                return
+            try:
+                self.__answer(conn, request)
+            except OSError:
+                pass
+        self.__drop(conn)
+
+    def __drop(self, conn, timed_out=False):
+        pending = self.__conns.pop(conn, None)
+        if pending is None:
+            return
+        pending[1].cancel()
+        if timed_out:
+            self.dropped += 1
+        self.sched.remove_reader(conn)
+        conn.close()
+
+    def __answer(self, conn, request):
+        head = request.split(b"\r\n\r\n", 1)[0].decode("latin-1")
+        lines = head.split("\r\n")
+        parts = lines[0].split()
+        if len(parts) < 2 or parts[0] not in ("GET", "HEAD"):
+            conn.send(b"HTTP/1.0 405 Method Not Allowed\r\nContent-Length: 0\r\n\r\n")
+            return
+        if parts[1].split("?", 1)[0] != "/metrics":
+            conn.send(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            return
+        accept = ""
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "accept":
+                accept = value
+        openmetrics = "application/openmetrics-text" in accept
+        body = self.body(openmetrics)
+        self.scrapes += 1
+        header = "HTTP/1.0 200 OK\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n" % (
+            OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE, len(body))
+        response = header.encode() + (body if parts[0] == "GET" else b"")
+        # a fresh connection's send buffer takes the whole body; a client
+        # that cannot take it in one go gets a short response, not a stall
+        if conn.send(response) < len(response):
+            self.dropped += 1
+
+    def close(self):
+        for conn in list(self.__conns):
+            self.__drop(conn)
+        self.sched.remove_reader(self.__sock)
+        self.__sock.close()
+
+
+def parse_address(text, default_host="127.0.0.1"):
+    """"9101" or "0.0.0.0:9101" -> (host, port); a bare port is loopback only."""
+    host, _, port = text.rpartition(":")
+    return (host or default_host, int(port))
+
+
+if __name__ == "__main__":
+    host, port = parse_address(sys.argv[1] if len(sys.argv) > 1 else "9101")
+    client = http.client.HTTPConnection(host, port, timeout=2)
+    client.request("GET", "/metrics", headers={"Accept": OPENMETRICS_TYPE})
+    sys.stdout.write(client.getresponse().read().decode())
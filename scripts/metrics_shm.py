@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Metrics snapshot shared through a memory-mapped file.
+
+The OLED daemon publishes every new sample into a fixed-layout file under
+/run; any other process can map it and read the current metrics in a few
+microseconds without touching /proc or forking anything.
+
+Writers follow the seqlock protocol: the sequence counter is odd while a
+snapshot is being written and even once it is complete. Readers retry until
+they see the same even counter before and after copying the record, and the
+record carries a CRC32 as well, so a torn read is never returned.
+
+    python3 metrics_shm.py [path]     # print the current snapshot as JSON
+"""
+
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+SHM_PATH = "/run/yahboom/metrics"
+MAGIC = b"YBMS"
+LAYOUT_VERSION = 1
+
+MAX_CORES = 16
+MAX_ZONES = 16
+NAME_LEN = 16
+
+# magic, layout version, sequence counter
+HEADER = struct.Struct("<4sIQ")
+# crc32 of the rest, timestamp, cpu, temp, ram used/total, disk used/total,
+# gpu load, gpu/emc clock, core count, zone count, per-core loads, ip,
+# portal setup ip, then MAX_ZONES x (zone name, temperature)
+RECORD = struct.Struct("<Id9dBB6x%dd16s16s%s" % (
+    MAX_CORES, "16sd" * MAX_ZONES))
+SIZE = HEADER.size + RECORD.size
+
+_SCALARS = ["cpu", "temp", "ram_used", "ram_total", "disk_used",
+            "disk_total", "gpu_load", "gpu_clock", "emc_clock"]
+
+
+def _num(value):
+    return float("nan") if value is None else float(value)
+
+
+def _opt(value):
+    return None if math.isnan(value) else value
+
+
+def _text(value):
+    return (value or "").encode()[:NAME_LEN]
+
+
+def pack(values, timestamp=None):
+    """Serialize a provider value dict into a RECORD."""
+    cores = list(values.get("cpu_cores") or [])[:MAX_CORES]
+    zones = list((values.get("temps") or {}).items())[:MAX_ZONES]
+    fields = [time.time() if timestamp is None else timestamp]
+    fields += [_num(values.get(key)) for key in _SCALARS]
+    fields += [len(cores), len(zones)]
+    fields += [float(c) for c in cores] + [0.0] * (MAX_CORES - len(cores))
+    fields += [_text(values.get("ip")), _text(values.get("setup"))]
+    for name, temp in zones:
+        fields += [_text(name), _num(temp)]
+    fields += [b"", 0.0] * (MAX_ZONES - len(zones))
+    body = RECORD.pack(0, *fields)
+    crc = zlib.crc32(body[4:])
+    return struct.pack("<I", crc) + body[4:]
+
+
+def unpack(record):
+    """Parse a RECORD back into a dict, or return None if the CRC is wrong."""
+    fields = RECORD.unpack(record)
+    if fields[0] != zlib.crc32(record[4:]):
+        return None
+    snap = {"timestamp": fields[1]}
+    for i, key in enumerate(_SCALARS):
+        snap[key] = _opt(fields[2 + i])
+    n_cores, n_zones = fields[11], fields[12]
+    snap["cpu_cores"] = list(fields[13:13 + n_cores])
+    pos = 13 + MAX_CORES
+    snap["ip"] = fields[pos].rstrip(b"\0").decode() or None
+    snap["setup"] = fields[pos + 1].rstrip(b"\0").decode() or None
+    pos += 2
+    snap["temps"] = {fields[pos + 2 * i].rstrip(b"\0").decode(): _opt(fields[pos + 2 * i + 1])
+                     for i in range(n_zones)}
+    return snap
+
+
+class SnapshotWriter:
+    def __init__(self, path=SHM_PATH):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, SIZE)
+            self.__map = mmap.mmap(fd, SIZE, mmap.MAP_SHARED,
+                                   mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        magic, _, seq = HEADER.unpack_from(self.__map, 0)
+        self.__seq = seq + (seq & 1) if magic == MAGIC else 0
+        HEADER.pack_into(self.__map, 0, MAGIC, LAYOUT_VERSION, self.__seq)
+        self.published = 0
+
+    def publish(self, values, timestamp=None):
+        record = pack(values, timestamp)
+        self.__seq += 1
+        struct.pack_into("<Q", self.__map, 8, self.__seq)
+        self.__map[HEADER.size:SIZE] = record
+        self.__seq += 1
+        struct.pack_into("<Q", self.__map, 8, self.__seq)
+        self.published += 1
+
+    def close(self):
+        self.__map.close()
+
+
+class SnapshotReader:
+    """Keeps the snapshot file mapped; read() costs a copy and a CRC."""
+
+    def __init__(self, path=SHM_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self.__map = mmap.mmap(f.fileno(), SIZE, mmap.MAP_SHARED,
+                                   mmap.PROT_READ)
+        magic, version, _ = HEADER.unpack_from(self.__map, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            self.__map.close()
+            raise ValueError("%s is not a version %d metrics snapshot"
+                             % (path, LAYOUT_VERSION))
+
+    def read(self, retries=1000):
+        """Return the latest complete snapshot, or None if none was published."""
+        m = self.__map
+        for _ in range(retries):
+            (seq1,) = struct.unpack_from("<Q", m, 8)
+            if seq1 & 1:
+                continue
+            record = m[HEADER.size:SIZE]
+            (seq2,) = struct.unpack_from("<Q", m, 8)
+            if seq1 != seq2:
+                continue
+            if seq1 == 0:
+                return None
+            snap = unpack(record)
+            if snap is not None:
+                snap["seq"] = seq1
+                return snap
+        raise RuntimeError("metrics snapshot kept changing under the reader")
+
+    def close(self):
+        self.__map.close()
+
+
+def read_snapshot(path=SHM_PATH):
+    """One-shot read; long-lived readers should keep a SnapshotReader."""
+    reader = SnapshotReader(path)
+    try:
+        return reader.read()
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    print(json.dumps(read_snapshot(sys.argv[1] if len(sys.argv) > 1 else SHM_PATH),
+                     indent=2, sort_keys=True))
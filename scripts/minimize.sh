@@ -108,6 +108,13 @@ EOF'
 sudo systemctl daemon-reload
 sudo systemctl enable jetson-clocks.service 2>/dev/null
 
+# Keep the OLED and portal daemons on CPU 0 at idle priority (scripts/isolation.py)
+sudo touch /etc/default/yahboom
+if ! grep -q '^YAHBOOM_ISOLATE=' /etc/default/yahboom; then
+  echo "YAHBOOM_ISOLATE=1" | sudo tee -a /etc/default/yahboom > /dev/null
+fi
+echo "  Status daemons isolated on CPU 0 (YAHBOOM_ISOLATE in /etc/default/yahboom)"
+
 echo ""
 echo "============================================"
 echo " Minimal headless setup complete!"
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""IPv4 address watcher on rtnetlink.
+
+AddressWatcher dumps the current addresses once (RTM_GETADDR) and then
+listens on the RTMGRP_IPV4_IFADDR multicast group, so a new DHCP lease or a
+dropped link shows up as a readable socket the moment the kernel applies
+it. Register it with Scheduler.add_reader(watcher, ...) and call handle()
+when it fires; nothing is read or forked in steady state.
+
+Which address is "the" address comes from a priority list of interface
+names or fnmatch patterns, e.g. ["enP8p1s0", "wl*", "*"].
+
+    python3 netwatch.py [iface-or-pattern ...]   # print address changes
+"""
+
+import errno
+import fnmatch
+import socket
+import struct
+import sys
+
+DEFAULT_PRIORITY = ["enP8p1s0", "wlP1p1s0"]
+
+NETLINK_ROUTE = 0
+RTMGRP_IPV4_IFADDR = 0x10
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLMSG_OVERRUN = 4
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+
+# struct nlmsghdr, struct ifaddrmsg, struct rtattr
+NLMSGHDR = struct.Struct("=LHHLL")
+IFADDRMSG = struct.Struct("=BBBBI")
+RTATTR = struct.Struct("=HH")
+
+
+def _align(n):
+    return (n + 3) & ~3
+
+
+def pick(addresses, priority):
+    """Return the address of the first interface matching `priority`.
+
+    addresses: {ifname: [ipv4, ...]}. Loopback only matches when named.
+    """
+    for pattern in priority:
+        names = sorted(name for name in addresses
+                       if addresses[name] and fnmatch.fnmatchcase(name, pattern)
+                       and (name != "lo" or pattern == "lo"))
+        if names:
+            return addresses[names[0]][0]
+    return None
+
+
+def parse_addr_message(msg_type, payload):
+    """Parse an RTM_NEWADDR/RTM_DELADDR payload into (ifname, ipv4) or None."""
+    family, _, _, _, index = IFADDRMSG.unpack_from(payload, 0)
+    if family != socket.AF_INET:
+        return None
+    attrs = {}
+    pos = _align(IFADDRMSG.size)
+    while pos + RTATTR.size <= len(payload):
+        length, kind = RTATTR.unpack_from(payload, pos)
+        if length < RTATTR.size:
+            break
+        attrs[kind] = payload[pos + RTATTR.size:pos + length]
+        pos += _align(length)
+    raw = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+    if raw is None or len(raw) != 4:
+        return None
+    try:
+        name = socket.if_indextoname(index)
+    except OSError:
+        # already gone (RTM_DELADDR on an unplugged device): use the label
+        name = attrs.get(IFA_LABEL, b"").rstrip(b"\0").decode().split(":")[0]
+    return name, socket.inet_ntoa(raw)
+
+
+class AddressWatcher:
+    def __init__(self, priority=DEFAULT_PRIORITY):
+        self.priority = list(priority)
+        self.addresses = {}
+        self.events = 0
+        self.__seq = 0
+        self.__sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        try:
+            self.__sock.bind((0, RTMGRP_IPV4_IFADDR))
+            self.__resync()
+        except OSError:
+            self.__sock.close()
+            raise
+        self.__current = self.address()
+
+    def fileno(self):
+        return self.__sock.fileno()
+
+    def close(self):
+        self.__sock.close()
+
+    def address(self):
+        """The current address by priority, or None."""
+        return pick(self.addresses, self.priority)
+
+    def handle(self):
+        """Drain pending events. Returns True if address() changed."""
+        while True:
+            try:
+                data = self.__sock.recv(65536, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                # the kernel dropped events: start over from a fresh dump
+                self.__resync()
+                continue
+            self.__parse(data)
+        current = self.address()
+        changed = current != self.__current
+        self.__current = current
+        return changed
+
+    def __resync(self):
+        self.__seq += 1
+        self.addresses = {}
+        request = NLMSGHDR.pack(NLMSGHDR.size + IFADDRMSG.size, RTM_GETADDR,
+                                NLM_F_REQUEST | NLM_F_DUMP, self.__seq, 0)
+        request += IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        self.__sock.send(request)
+        while not self.__parse(self.__sock.recv(65536), self.__seq):
+            pass
+
+    def __parse(self, data, dump_seq=None):
+        """Apply the messages in one datagram; True once dump_seq is done."""
+        done = False
+        pos = 0
+        while pos + NLMSGHDR.size <= len(data):
+            length, msg_type, _, seq, _ = NLMSGHDR.unpack_from(data, pos)
+            if length < NLMSGHDR.size:
+                break
+            payload = data[pos + NLMSGHDR.size:pos + length]
+            pos += _align(length)
+            if msg_type in (NLMSG_DONE, NLMSG_ERROR, NLMSG_OVERRUN):
+                if dump_seq is not None and seq == dump_seq:
+                    done = True
+                continue
+            if msg_type not in (RTM_NEWADDR, RTM_DELADDR):
+                continue
+            parsed = parse_addr_message(msg_type, payload)
+            if parsed is None:
+                continue
+            name, addr = parsed
+            self.events += 1
+            addrs = self.addresses.get(name, [])
+            if msg_type == RTM_NEWADDR and addr not in addrs:
+                self.addresses[name] = addrs + [addr]
+            elif msg_type == RTM_DELADDR and addr in addrs:
+                addrs.remove(addr)
+                if not addrs:
+                    del self.addresses[name]
+        return done
+
+
+if __name__ == "__main__":
+    import selectors
+    watcher = AddressWatcher(sys.argv[1:] or DEFAULT_PRIORITY + ["*"])
+    print(watcher.address(), watcher.addresses)
+    sel = selectors.DefaultSelector()
+    sel.register(watcher, selectors.EVENT_READ)
+    try:
+        while True:
+            sel.select()
+            if watcher.handle():
+                print(watcher.address(), watcher.addresses)
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        watcher.close()
@@ -0,0 +1,672 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""NetworkManager backends for the WiFi setup portal.
+
+Every NetworkManager interaction wifi_setup needs goes through one
+interface, NetworkBackend:
+
+- DBusBackend keeps one system-bus connection to NetworkManager open
+  (python3-dbus); a status check or scan request is a method call. With
+  python3-gi it also follows the device's StateChanged signal instead of
+  polling its state.
+- NmcliBackend runs nmcli with an argument list, no shell, for systems
+  without python3-dbus.
+- sim/fake_nm.py has an in-memory FakeBackend for tests.
+
+open_backend() picks D-Bus when it is available.
+
+Access points are returned as dicts: {"bssid", "ssid", "signal" (0-100),
+"security" (nmcli's wording, e.g. "WPA2 802.1X")}.
+"""
+
+import os
+import queue
+import selectors
+import subprocess
+import threading
+import time
+
+try:
+    import dbus
+except ImportError:
+    dbus = None
+
+try:
+    # signals need a main loop: python3-gi's GLib
+    import dbus.mainloop.glib
+    from gi.repository import GLib
+except ImportError:
+    GLib = None
+
+CONNECT_TIMEOUT = 45
+
+# NM_DEVICE_STATE_* -> the words `nmcli device` prints
+DEVICE_STATES = {
+    0: "unknown", 10: "unmanaged", 20: "unavailable", 30: "disconnected",
+    40: "connecting", 50: "connecting", 60: "connecting", 70: "connecting",
+    80: "connecting", 90: "connecting", 100: "connected",
+    110: "deactivating", 120: "failed",
+}
+
+
+class NetworkBackend:
+    """What wifi_setup needs from NetworkManager, for one WiFi interface."""
+    name = None
+
+    def __init__(self, iface):
+        self.iface = iface
+
+    def device_state(self):
+        """"connected", "connecting", "disconnected", ... for the interface."""
+        raise NotImplementedError
+
+    def request_scan(self):
+        """Ask the radio for a fresh scan. Returns False if it refused."""
+        raise NotImplementedError
+
+    def access_points(self):
+        """The radio's current scan list."""
+        raise NotImplementedError
+
+    def start_hotspot(self, con_name, ssid, password):
+        """Bring up a WPA2 access point with a shared IPv4 network. (ok, msg)"""
+        raise NotImplementedError
+
+    def stop_hotspot(self, con_name):
+        """Take the hotspot down and delete its connection profile."""
+        raise NotImplementedError
+
+    def connect(self, ssid, password):
+        """Join ssid and wait until it is activated or has failed. (ok, msg)"""
+        raise NotImplementedError
+
+    def ip4_address(self):
+        """The interface's IPv4 address, or None."""
+        raise NotImplementedError
+
+    def startup_complete(self):
+        """False while NetworkManager is still starting up (and autoconnecting)."""
+        raise NotImplementedError
+
+    def saved_wifi_profiles(self):
+        """{ssid: profile} for the saved client profiles NetworkManager may
+        autoconnect to; a profile is what activate_saved() takes."""
+        raise NotImplementedError
+
+    def saved_wifi_ssids(self):
+        return list(self.saved_wifi_profiles())
+
+    def activate_saved(self, profile, timeout):
+        """Bring up a saved profile and wait until it is activated. (ok, msg)"""
+        raise NotImplementedError
+
+    def active_ssid(self):
+        """The SSID the interface is connected to, or None."""
+        raise NotImplementedError
+
+    def watch_device(self):
+        """A DeviceWatch that reports the interface's state changes."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class DeviceWatch:
+    """State changes of one device, as device_state() words."""
+
+    def wait(self, timeout):
+        """Return the next state, or None if none arrived within timeout."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PollingDeviceWatch(DeviceWatch):
+    """Reports changes by reading the state every `interval` seconds."""
+
+    def __init__(self, read_state, interval=0.1):
+        self.read_state = read_state
+        self.interval = interval
+        self.state = read_state()
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            state = self.read_state()
+            if state != self.state:
+                self.state = state
+                return state
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(self.interval, remaining))
+
+
+# -- nmcli ------------------------------------------------------------------
+
+def split_terse(line):
+    """Split an `nmcli -t` line on its unescaped colons."""
+    fields, field = [], []
+    chars = iter(line)
+    for c in chars:
+        if c == "\\":
+            field.append(next(chars, ""))
+        elif c == ":":
+            fields.append("".join(field))
+            field = []
+        else:
+            field.append(c)
+    fields.append("".join(field))
+    return fields
+
+
+class NmcliDeviceWatch(DeviceWatch):
+    """One `nmcli device monitor` process; a state change is a readable line."""
+
+    def __init__(self, nmcli, iface):
+        self.iface = iface
+        self.proc = subprocess.Popen([nmcli, "device", "monitor", iface],
+                                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.__buffer = b""
+        self.__sel = selectors.DefaultSelector()
+        self.__sel.register(self.proc.stdout, selectors.EVENT_READ)
+
+    def __parse(self, line):
+        # "wlP1p1s0: connecting (prepare)", "wlP1p1s0: using connection 'Home'"
+        name, _, rest = line.decode(errors="replace").partition(": ")
+        word = rest.split(" ", 1)[0]
+        if name == self.iface and word in DEVICE_STATES.values():
+            return word
+        return None
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            while b"\n" in self.__buffer:
+                line, self.__buffer = self.__buffer.split(b"\n", 1)
+                state = self.__parse(line)
+                if state:
+                    return state
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.__sel.select(remaining):
+                return None
+            data = os.read(self.proc.stdout.fileno(), 4096)
+            if not data:
+                # nmcli exited; behave like a quiet device until the timeout
+                self.__sel.unregister(self.proc.stdout)
+                time.sleep(max(0.0, deadline - time.monotonic()))
+                return None
+            self.__buffer += data
+
+    def close(self):
+        self.__sel.close()
+        if self.proc.poll() is None:
+            self.proc.terminate()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+
+class NmcliBackend(NetworkBackend):
+    name = "nmcli"
+
+    def __init__(self, iface, nmcli="nmcli"):
+        super().__init__(iface)
+        self.nmcli = nmcli
+
+    def run(self, *args):
+        """Run nmcli with args (no shell). Returns (returncode, stdout, stderr)."""
+        r = subprocess.run([self.nmcli] + list(args), capture_output=True, text=True)
+        return r.returncode, r.stdout.strip(), r.stderr.strip()
+
+    def device_state(self):
+        _, out, _ = self.run("-t", "-f", "DEVICE,STATE", "device")
+        for line in out.splitlines():
+            parts = split_terse(line)
+            if len(parts) >= 2 and parts[0] == self.iface:
+                return parts[1]
+        return "unknown"
+
+    def request_scan(self):
+        rc, _, _ = self.run("device", "wifi", "rescan", "ifname", self.iface)
+        return rc == 0
+
+    def access_points(self):
+        _, out, _ = self.run("-t", "-f", "BSSID,SSID,SIGNAL,SECURITY", "device", "wifi", "list")
+        aps = []
+        for line in out.splitlines():
+            parts = split_terse(line)
+            if len(parts) < 4 or not parts[2].strip().isdigit():
+                continue
+            aps.append({"bssid": parts[0].strip(), "ssid": parts[1].strip(),
+                        "signal": int(parts[2]), "security": parts[3].strip()})
+        return aps
+
+    def start_hotspot(self, con_name, ssid, password):
+        self.run("connection", "delete", con_name)
+        rc, out, err = self.run("device", "wifi", "hotspot", "ifname", self.iface,
+                                "con-name", con_name, "ssid", ssid, "password", password)
+        return rc == 0, out if rc == 0 else (err or out)
+
+    def stop_hotspot(self, con_name):
+        self.run("connection", "down", con_name)
+        self.run("connection", "delete", con_name)
+
+    def connect(self, ssid, password):
+        rc, out, err = self.run("-w", str(CONNECT_TIMEOUT), "device", "wifi", "connect", ssid,
+                                "password", password, "ifname", self.iface)
+        return rc == 0, out if rc == 0 else (err or out)
+
+    def ip4_address(self):
+        _, out, _ = self.run("-t", "-f", "IP4.ADDRESS", "device", "show", self.iface)
+        for line in out.splitlines():
+            parts = split_terse(line)
+            if len(parts) >= 2 and parts[1]:
+                return parts[1].split("/")[0]
+        return None
+
+    def startup_complete(self):
+        _, out, _ = self.run("-t", "-f", "STARTUP", "general")
+        return out == "started"
+
+    def saved_wifi_profiles(self):
+        _, out, _ = self.run("-t", "-f", "NAME,TYPE,AUTOCONNECT", "connection", "show")
+        profiles = {}
+        for line in out.splitlines():
+            parts = split_terse(line)
+            if len(parts) < 3 or parts[1] != "802-11-wireless" or parts[2] != "yes":
+                continue
+            _, detail, _ = self.run("-g", "802-11-wireless.ssid,802-11-wireless.mode",
+                                    "connection", "show", parts[0])
+            values = [split_terse(v)[0] for v in detail.splitlines()]
+            if len(values) >= 2 and values[0] and values[1] != "ap":
+                profiles[values[0]] = parts[0]
+        return profiles
+
+    def activate_saved(self, profile, timeout):
+        rc, out, err = self.run("-w", str(int(timeout)), "connection", "up", "id", profile,
+                                "ifname", self.iface)
+        return rc == 0, out if rc == 0 else (err or out)
+
+    def active_ssid(self):
+        _, out, _ = self.run("-t", "-f", "ACTIVE,SSID", "device", "wifi", "list",
+                             "ifname", self.iface, "--rescan", "no")
+        for line in out.splitlines():
+            parts = split_terse(line)
+            if len(parts) >= 2 and parts[0] == "yes":
+                return parts[1]
+        return None
+
+    def watch_device(self):
+        return NmcliDeviceWatch(self.nmcli, self.iface)
+
+
+# -- D-Bus ------------------------------------------------------------------
+
+NM_BUS = "org.freedesktop.NetworkManager"
+NM_PATH = "/org/freedesktop/NetworkManager"
+NM_IFACE = "org.freedesktop.NetworkManager"
+NM_DEVICE = NM_IFACE + ".Device"
+NM_WIRELESS = NM_DEVICE + ".Wireless"
+NM_AP = NM_IFACE + ".AccessPoint"
+NM_SETTINGS_PATH = NM_PATH + "/Settings"
+NM_SETTINGS = NM_IFACE + ".Settings"
+NM_CONNECTION = NM_SETTINGS + ".Connection"
+NM_IP4CONFIG = NM_IFACE + ".IP4Config"
+NM_ACTIVE = NM_IFACE + ".Connection.Active"
+DBUS_PROPS = "org.freedesktop.DBus.Properties"
+
+# NM_802_11_AP_FLAGS_PRIVACY, NM_802_11_AP_SEC_*
+AP_FLAGS_PRIVACY = 0x1
+AP_SEC_KEY_MGMT_PSK = 0x100
+AP_SEC_KEY_MGMT_802_1X = 0x200
+AP_SEC_KEY_MGMT_SAE = 0x400
+
+# NM_ACTIVE_CONNECTION_STATE_*
+ACTIVE_ACTIVATED = 2
+ACTIVE_DEACTIVATED = 4
+
+
+def security_text(flags, wpa_flags, rsn_flags):
+    """Describe AP security the way `nmcli -f SECURITY` does."""
+    words = []
+    if flags & AP_FLAGS_PRIVACY and not wpa_flags and not rsn_flags:
+        words.append("WEP")
+    if wpa_flags:
+        words.append("WPA1")
+    if rsn_flags & (AP_SEC_KEY_MGMT_PSK | AP_SEC_KEY_MGMT_802_1X):
+        words.append("WPA2")
+    if rsn_flags & AP_SEC_KEY_MGMT_SAE:
+        words.append("WPA3")
+    if (wpa_flags | rsn_flags) & AP_SEC_KEY_MGMT_802_1X:
+        words.append("802.1X")
+    return " ".join(words)
+
+
+class DBusBackend(NetworkBackend):
+    """NetworkManager over one persistent system-bus connection."""
+    name = "D-Bus"
+
+    def __init__(self, iface, poll_interval=0.2):
+        if dbus is None:
+            raise RuntimeError("python3-dbus is not installed")
+        super().__init__(iface)
+        self.poll_interval = poll_interval
+        self.bus = dbus.SystemBus()
+        nm = self.bus.get_object(NM_BUS, NM_PATH)
+        self.nm = dbus.Interface(nm, NM_IFACE)
+        self.__nm_props = dbus.Interface(nm, DBUS_PROPS)
+        self.device_path = self.nm.GetDeviceByIpIface(iface)
+        device = self.bus.get_object(NM_BUS, self.device_path)
+        self.device_props = dbus.Interface(device, DBUS_PROPS)
+        self.wireless = dbus.Interface(device, NM_WIRELESS)
+        self.settings = dbus.Interface(self.bus.get_object(NM_BUS, NM_SETTINGS_PATH), NM_SETTINGS)
+
+    def __props(self, path, interface):
+        obj = self.bus.get_object(NM_BUS, path)
+        return dbus.Interface(obj, DBUS_PROPS).GetAll(interface)
+
+    def __state(self):
+        return int(self.device_props.Get(NM_DEVICE, "State"))
+
+    def device_state(self):
+        return DEVICE_STATES.get(self.__state(), "unknown")
+
+    def request_scan(self):
+        try:
+            self.wireless.RequestScan(dbus.Dictionary({}, signature="sv"))
+            return True
+        except dbus.DBusException:
+            return False
+
+    def access_points(self):
+        aps = []
+        for path in self.wireless.GetAllAccessPoints():
+            try:
+                p = self.__props(path, NM_AP)
+            except dbus.DBusException:
+                continue  # vanished between the list and the lookup
+            aps.append({
+                "bssid": str(p["HwAddress"]),
+                "ssid": bytes(bytearray(p["Ssid"])).decode("utf-8", "replace"),
+                "signal": int(p["Strength"]),
+                "security": security_text(int(p["Flags"]), int(p["WpaFlags"]),
+                                          int(p["RsnFlags"])),
+            })
+        return aps
+
+    def __find_connections(self, con_name):
+        found = []
+        for path in self.settings.ListConnections():
+            conn = dbus.Interface(self.bus.get_object(NM_BUS, path), NM_CONNECTION)
+            if str(conn.GetSettings()["connection"]["id"]) == con_name:
+                found.append(conn)
+        return found
+
+    def __activate(self, settings, specific="/"):
+        """Returns (settings connection path, active connection path)."""
+        return self.nm.AddAndActivateConnection(settings, self.device_path, specific)
+
+    def __wait_activated(self, active, timeout):
+        """Poll an active connection until it is activated or gone. (ok, msg)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                state = int(self.__props(active, NM_ACTIVE).get("State", 0))
+            except dbus.DBusException:
+                state = ACTIVE_DEACTIVATED  # NM removed it: activation failed
+            if state == ACTIVE_ACTIVATED:
+                return True, "activated"
+            if state == ACTIVE_DEACTIVATED:
+                reason = self.device_props.Get(NM_DEVICE, "StateReason")
+                return False, "activation failed (reason %d)" % int(reason[1])
+            time.sleep(self.poll_interval)
+        return False, "timed out after %d s" % timeout
+
+    def start_hotspot(self, con_name, ssid, password):
+        self.stop_hotspot(con_name)
+        settings = dbus.Dictionary({
+            "connection": dbus.Dictionary({
+                "id": con_name, "type": "802-11-wireless",
+                "autoconnect": dbus.Boolean(False)}, signature="sv"),
+            "802-11-wireless": dbus.Dictionary({
+                "ssid": dbus.ByteArray(ssid.encode()), "mode": "ap"}, signature="sv"),
+            "802-11-wireless-security": dbus.Dictionary({
+                "key-mgmt": "wpa-psk", "psk": password,
+                "proto": dbus.Array(["rsn"], signature="s"),
+                "pairwise": dbus.Array(["ccmp"], signature="s"),
+                "group": dbus.Array(["ccmp"], signature="s")}, signature="sv"),
+            "ipv4": dbus.Dictionary({"method": "shared"}, signature="sv"),
+            "ipv6": dbus.Dictionary({"method": "ignore"}, signature="sv"),
+        }, signature="sa{sv}")
+        try:
+            _, active = self.__activate(settings)
+        except dbus.DBusException as e:
+            return False, e.get_dbus_message()
+        return self.__wait_activated(active, CONNECT_TIMEOUT)
+
+    def stop_hotspot(self, con_name):
+        for conn in self.__find_connections(con_name):
+            try:
+                conn.Delete()  # deactivates it first if it is up
+            except dbus.DBusException:
+                pass
+
+    @staticmethod
+    def __security(ap, password):
+        """802-11-wireless-security settings for joining ap with password,
+        from the key management it advertises; None for an open network."""
+        key_mgmt = int(ap["WpaFlags"]) | int(ap["RsnFlags"])
+        if key_mgmt & AP_SEC_KEY_MGMT_PSK:
+            # also WPA2/WPA3 transition networks: every driver does PSK
+            return dbus.Dictionary({"key-mgmt": "wpa-psk", "psk": password}, signature="sv")
+        if key_mgmt & AP_SEC_KEY_MGMT_SAE:
+            return dbus.Dictionary({"key-mgmt": "sae", "psk": password}, signature="sv")
+        if key_mgmt & AP_SEC_KEY_MGMT_802_1X:
+            raise ValueError("802.1X (enterprise) networks need more than a password")
+        if int(ap["Flags"]) & AP_FLAGS_PRIVACY:
+            # WEP: 5/13 characters or 10/26 hex digits are a key, anything else a passphrase
+            key_type = 1 if len(password) in (5, 10, 13, 26) else 2
+            return dbus.Dictionary({"key-mgmt": "none", "wep-key0": password,
+                                    "wep-key-type": dbus.UInt32(key_type)}, signature="sv")
+        return None
+
+    def connect(self, ssid, password):
+        best, best_ap = "/", None
+        for path in self.wireless.GetAllAccessPoints():
+            try:
+                p = self.__props(path, NM_AP)
+            except dbus.DBusException:
+                continue
+            if bytes(bytearray(p["Ssid"])).decode("utf-8", "replace") == ssid \
+                    and (best_ap is None or int(p["Strength"]) > int(best_ap["Strength"])):
+                best, best_ap = path, p
+        if best == "/":
+            return False, "No network with SSID '%s' found." % ssid
+        try:
+            security = self.__security(best_ap, password)
+        except ValueError as e:
+            return False, str(e)
+        existing = self.__wifi_profile(ssid)
+        if existing is not None:
+            return self.__connect_existing(existing, security, best)
+        settings = dbus.Dictionary({
+            "connection": dbus.Dictionary({"id": ssid, "type": "802-11-wireless"},
+                                          signature="sv"),
+            "802-11-wireless": dbus.Dictionary({"ssid": dbus.ByteArray(ssid.encode())},
+                                               signature="sv"),
+        }, signature="sa{sv}")
+        if security is not None:
+            settings["802-11-wireless-security"] = security
+        try:
+            conn, active = self.__activate(settings, best)
+        except dbus.DBusException as e:
+            return False, e.get_dbus_message()
+        ok, msg = self.__wait_activated(active, CONNECT_TIMEOUT)
+        if not ok:
+            # like nmcli, do not leave a profile with a wrong password behind
+            try:
+                dbus.Interface(self.bus.get_object(NM_BUS, conn), NM_CONNECTION).Delete()
+            except dbus.DBusException:
+                pass
+        return ok, msg
+
+    def __connect_existing(self, profile, security, specific):
+        """Put the new password into a saved profile for the SSID and bring
+        it up, instead of adding a second profile next to it. If that fails
+        the profile gets its old settings and secrets back."""
+        path, old = profile
+        conn = dbus.Interface(self.bus.get_object(NM_BUS, path), NM_CONNECTION)
+        restore = dbus.Dictionary(old, signature="sa{sv}")
+        if "802-11-wireless-security" in old:
+            try:
+                secrets = conn.GetSecrets("802-11-wireless-security")
+                restore["802-11-wireless-security"] = dbus.Dictionary(
+                    dict(old["802-11-wireless-security"],
+                         **secrets.get("802-11-wireless-security", {})), signature="sv")
+            except dbus.DBusException:
+                pass  # secrets kept by an agent: NM still has them
+        settings = dbus.Dictionary(old, signature="sa{sv}")
+        if security is None:
+            settings.pop("802-11-wireless-security", None)
+        else:
+            settings["802-11-wireless-security"] = security
+        try:
+            conn.Update(settings)
+            active = self.nm.ActivateConnection(path, self.device_path, specific)
+        except dbus.DBusException as e:
+            ok, msg = False, e.get_dbus_message()
+        else:
+            ok, msg = self.__wait_activated(active, CONNECT_TIMEOUT)
+        if not ok:
+            try:
+                conn.Update(restore)
+            except dbus.DBusException:
+                pass
+        return ok, msg
+
+    def ip4_address(self):
+        path = self.device_props.Get(NM_DEVICE, "Ip4Config")
+        if path == "/":
+            return None
+        try:
+            data = self.__props(path, NM_IP4CONFIG).get("AddressData", [])
+        except dbus.DBusException:
+            return None
+        return str(data[0]["address"]) if data else None
+
+    def startup_complete(self):
+        return not bool(self.__nm_props.Get(NM_IFACE, "Startup"))
+
+    def __client_profiles(self):
+        """(ssid, path, settings) of every saved WiFi client profile."""
+        for path in self.settings.ListConnections():
+            try:
+                settings = dbus.Interface(self.bus.get_object(NM_BUS, path),
+                                          NM_CONNECTION).GetSettings()
+            except dbus.DBusException:
+                continue
+            wifi = settings.get("802-11-wireless")
+            if wifi is None or str(wifi.get("mode", "infrastructure")) == "ap":
+                continue
+            yield bytes(bytearray(wifi["ssid"])).decode("utf-8", "replace"), path, settings
+
+    def __wifi_profile(self, ssid):
+        """(path, settings) of a saved client profile for ssid, or None."""
+        for name, path, settings in self.__client_profiles():
+            if name == ssid:
+                return path, settings
+        return None
+
+    def saved_wifi_profiles(self):
+        profiles = {}
+        for ssid, path, settings in self.__client_profiles():
+            if bool(settings["connection"].get("autoconnect", True)):
+                profiles[ssid] = str(path)
+        return profiles
+
+    def activate_saved(self, profile, timeout):
+        try:
+            active = self.nm.ActivateConnection(profile, self.device_path, "/")
+        except dbus.DBusException as e:
+            return False, e.get_dbus_message()
+        return self.__wait_activated(active, timeout)
+
+    def active_ssid(self):
+        path = self.device_props.Get(NM_WIRELESS, "ActiveAccessPoint")
+        if path == "/":
+            return None
+        try:
+            ssid = self.__props(path, NM_AP)["Ssid"]
+        except dbus.DBusException:
+            return None
+        return bytes(bytearray(ssid)).decode("utf-8", "replace")
+
+    def watch_device(self):
+        if GLib is not None:
+            try:
+                return DBusDeviceWatch(self.device_path)
+            except dbus.DBusException:
+                pass
+        # no GLib main loop to deliver signals: poll the open connection
+        return PollingDeviceWatch(self.device_state)
+
+    def close(self):
+        self.bus.close()
+
+
+class DBusDeviceWatch(DeviceWatch):
+    """The device's StateChanged signal on a connection of its own.
+
+    dbus-python delivers signals only through a GLib main loop; one loop
+    runs on a daemon thread for all watches and hands the states to wait()
+    through a queue.
+    """
+    _loop = None
+    _lock = threading.Lock()
+
+    def __init__(self, device_path):
+        with DBusDeviceWatch._lock:
+            if DBusDeviceWatch._loop is None:
+                dbus.mainloop.glib.threads_init()
+                DBusDeviceWatch._loop = GLib.MainLoop()
+                threading.Thread(target=DBusDeviceWatch._loop.run, daemon=True).start()
+        self.state = None
+        self.__states = queue.Queue()
+        self.bus = dbus.SystemBus(mainloop=dbus.mainloop.glib.DBusGMainLoop(), private=True)
+        try:
+            self.__match = self.bus.add_signal_receiver(
+                self.__changed, "StateChanged", NM_DEVICE, NM_BUS, device_path)
+        except dbus.DBusException:
+            self.bus.close()
+            raise
+
+    def __changed(self, new, old, reason):
+        self.__states.put(DEVICE_STATES.get(int(new), "unknown"))
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                state = self.__states.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return None
+            # several NM states read "connecting"; report changes of the word
+            if state != self.state:
+                self.state = state
+                return state
+
+    def close(self):
+        self.__match.remove()
+        self.bus.close()
+
+
+def open_backend(iface):
+    """DBusBackend if python3-dbus and NetworkManager are reachable, else nmcli."""
+    if dbus is not None:
+        try:
+            return DBusBackend(iface)
+        except (dbus.DBusException, RuntimeError):
+            pass
+    return NmcliBackend(iface)
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # coding=utf-8
+import atexit
+import signal
+import socket
 import time
-import os
 import sys
 import Adafruit_SSD1306 as SSD
 
@@ -9,57 +11,137 @@ from PIL import Image
 from PIL import ImageDraw
 from PIL import ImageFont
 
-import subprocess
+import boottrace
+import history
+import i2c_broker
+import i2c_probe
+import isolation
+import metrics_http
+import metrics_shm
+import netwatch
+import portal_state
+from oled_driver import DiffDisplay
+from oled_pages import PageRotator, Sparkline, draw_sparkline, portal_page
+from oled_text import TextCache
+from providers import (CpuProvider, DiskProvider, FunctionProvider,
+                       GpuProvider, MemoryProvider, PortalProvider,
+                       ProviderRegistry, ThermalProvider)
+from sampler import SystemSampler
+from scheduler import Scheduler
+
+# Sampling intervals in seconds for the providers that are not defined in
+# providers.py. The screen is redrawn only when what it shows changes.
+IP_INTERVAL = 5          # only used when netlink is unavailable
+SETUP_INTERVAL = 1       # only used when the portal socket is unavailable
+
+# Interfaces (names or fnmatch patterns) whose address the IP line shows,
+# most preferred first.
+DEFAULT_IFACES = netwatch.DEFAULT_PRIORITY
+
+DEFAULT_PAGES = ["overview", "cores", "thermal", "gpu", "history"]
+PAGE_INTERVAL = 5
+
+# Metrics kept in the on-device history: name -> (sample step, downsampling).
+# Max keeps short load/temperature spikes visible at coarse resolutions.
+HISTORY_METRICS = {
+    "cpu": (CpuProvider.interval, "max"),
+    "temp": (ThermalProvider.interval, "max"),
+    "ram_used": (MemoryProvider.interval, "mean"),
+}
 
 # V1.0.6 - Modified: added CPU temp, removed time
 class Yahboom_OLED:
-    def __init__(self, i2c_bus=7, clear=False, debug=False):
+    def __init__(self, i2c_bus=7, clear=False, debug=False, pages=None,
+                 page_interval=PAGE_INTERVAL, snapshot_path=metrics_shm.SHM_PATH,
+                 root="/", ifaces=None, portal_socket=portal_state.STATE_SOCKET,
+                 portal_flag=portal_state.FLAG_FILE,
+                 broker_socket=i2c_broker.BROKER_SOCKET, backoff=None,
+                 metrics_address=None):
         self.__debug = debug
         self.__clear = clear
         self.__clear_count = 0
         self.__top = -2
         self.__x = 0
 
+        # preference order when the OLED answers on more than one bus
         self.__BUS_LIST = [1, 0, 7, 8]
-        self.__bus_index = 0
-        if i2c_bus != "auto":
-            self.__i2c_bus = int(i2c_bus)
-            self.__bus_index = 0xFF
-        else:
-            self.__i2c_bus = self.__BUS_LIST[self.__bus_index]
+        self.__auto = i2c_bus == "auto"
+        self.__i2c_bus = None if self.__auto else int(i2c_bus)
+        self.__broker_socket = broker_socket
+        self.__broker = None
 
-        self.__total_last = 0
-        self.__idle_last = 0
-        self.__str_CPU = "CPU:0%"
+        # root lets sim/ run the daemon against a fake /proc and /sys tree
+        self.__root = root
+        self.__sampler = SystemSampler(root=root)
+        # the running loop's registry values, for the get* methods
+        self.__values = {}
+        self.__ifaces = list(ifaces or DEFAULT_IFACES)
+        self.__watcher = None
+        self.__portal = None
+        self.__portal_socket = portal_socket
+        self.__portal_flag = portal_flag
+        self.__pages = PageRotator(pages or DEFAULT_PAGES)
+        self.__page_interval = page_interval
+        self.__page_ticks = 0
+        # isolation.LoadBackoff: sample and rotate pages less while the system is busy
+        self.__backoff = backoff
+        self.__shown = None
+        # frames pushed per page name, "setup" for the portal page
+        self.__page_frames = {}
+        self.__first_frame = False
+        self.__snapshot_path = snapshot_path
+        self.__snapshot = None
+        # (host, port) of the optional OpenMetrics endpoint
+        self.__metrics_address = metrics_address
+        self.__metrics = None
+        self.__history = history.History(HISTORY_METRICS)
 
         self.__WIDTH = 128
         self.__HEIGHT = 32
         self.__image = Image.new('1', (self.__WIDTH, self.__HEIGHT))
         self.__draw = ImageDraw.Draw(self.__image)
         self.__font = ImageFont.load_default()
+        self.__text = TextCache(self.__font)
 
     def __del__(self):
         if self.__debug:
             print("---OLED-DEL---")
 
     def begin(self):
+        # share the bus through i2c_broker.py when it runs and drives the panel
+        if self.__broker is not None:
+            self.__broker.close()
+        self.__broker = i2c_broker.connect("oled", self.__broker_socket, need="display")
+        if self.__broker is not None:
+            self.__display = i2c_broker.BrokerDisplay(self.__broker)
+            if self.__debug:
+                print("---OLED begin ok (I2C broker)!---")
+            return True
+        if self.__auto:
+            self.__i2c_bus = i2c_probe.find_bus(
+                i2c_probe.SSD1306_ADDRESS, preferred=self.__BUS_LIST)
+            if self.__i2c_bus is None:
+                if self.__debug:
+                    print("---OLED No Found!---: no I2C bus answers")
+                return False
         try:
             self.__oled = SSD.SSD1306_128_32(
                 rst=None, i2c_bus=self.__i2c_bus, gpio=1)
             self.__oled.begin()
             self.__oled.clear()
             self.__oled.display()
+            self.__display = DiffDisplay(
+                self.__oled._i2c, self.__WIDTH, self.__HEIGHT)
             if self.__debug:
                 print("---OLED begin ok!---")
             return True
         except:
             if self.__debug:
-                print("---OLED No Found!---:", self.__BUS_LIST[self.__bus_index])
-            if self.__bus_index == 0xFF:
+                print("---OLED No Found!---:", self.__i2c_bus)
+            if not self.__auto:
                 return
-            max_bus = len(self.__BUS_LIST)
-            self.__bus_index = (self.__bus_index + 1) % max_bus
-            self.__i2c_bus = self.__BUS_LIST[self.__bus_index]
+            # the remembered bus stopped working, rescan on the next call
+            i2c_probe.forget_state()
             return False
 
     def clear(self, refresh=False):
@@ -79,7 +161,7 @@ class Yahboom_OLED:
             return
         x = int(start_x + self.__x)
         y = int(start_y + self.__top)
-        self.__draw.text((x, y), str(text), font=self.__font, fill=255)
+        self.__text.draw(self.__image, (x, y), str(text))
         if refresh:
             self.refresh()
 
@@ -92,125 +174,277 @@ class Yahboom_OLED:
         self.add_text(0, y, text, refresh)
 
     def refresh(self):
-        self.__oled.image(self.__image)
-        self.__oled.display()
-
-    def getCPULoadRate(self, index):
-        count = 10
-        if index == 0:
-            f1 = os.popen("cat /proc/stat", 'r')
-            stat1 = f1.readline()
-            data_1 = []
-            for i in range(count):
-                data_1.append(int(stat1.split(' ')[i+2]))
-            self.__total_last = data_1[0]+data_1[1]+data_1[2]+data_1[3] + \
-                data_1[4]+data_1[5]+data_1[6]+data_1[7]+data_1[8]+data_1[9]
-            self.__idle_last = data_1[3]
-        elif index == 4:
-            f2 = os.popen("cat /proc/stat", 'r')
-            stat2 = f2.readline()
-            data_2 = []
-            for i in range(count):
-                data_2.append(int(stat2.split(' ')[i+2]))
-            total_now = data_2[0]+data_2[1]+data_2[2]+data_2[3] + \
-                data_2[4]+data_2[5]+data_2[6]+data_2[7]+data_2[8]+data_2[9]
-            idle_now = data_2[3]
-            total = int(total_now - self.__total_last)
-            idle = int(idle_now - self.__idle_last)
-            usage = int(total - idle)
-            usageRate = int(float(usage / total) * 100)
-            self.__str_CPU = "CPU:" + str(usageRate) + "%"
-            self.__total_last = 0
-            self.__idle_last = 0
-        return self.__str_CPU
+        sent = self.__display.show_image(self.__image)
+        if self.__debug and sent:
+            print("---OLED sent %d bytes---" % sent)
+        return sent
+
+    def getCPULoadRate(self, index=0):
+        """"CPU:12%" from the last sample. index is ignored; it was the step
+        of the old two-call /proc/stat measurement."""
+        cpu = self.__values.get("cpu")
+        if cpu is None:
+            cpu = self.__sampler.cpu_percent()
+        return "CPU:%d%%" % cpu
 
     def getCPUTemp(self):
-        try:
-            with open("/sys/devices/virtual/thermal/thermal_zone0/temp", "r") as f:
-                temp = int(f.read().strip()) / 1000.0
-            return "{:.1f}C".format(temp)
-        except:
-            return "--.-C"
+        if "temp" in self.__values:
+            temp = self.__values["temp"]
+        else:
+            temp = self.__sampler.temperature(0)
+        return "--.-C" if temp is None else "{:.1f}C".format(temp)
 
     def getUsagedRAM(self):
-        cmd = "free | awk 'NR==2{printf \"RAM:%2d%% -> %.1fGB \", 100*($2-$7)/$2, ($2/1048576.0)}'"
-        FreeRam = subprocess.check_output(cmd, shell=True)
-        str_FreeRam = str(FreeRam).lstrip('b\'')
-        str_FreeRam = str_FreeRam.rstrip('\'')
-        return str_FreeRam
+        if "ram_used" in self.__values:
+            used, total = self.__values["ram_used"], self.__values["ram_total"]
+        else:
+            used, total = self.__sampler.ram()
+        return "RAM:%2d%% -> %.1fGB " % (used, total)
 
     def getUsagedDisk(self):
-        cmd = "df -h | awk '$NF==\"/\"{printf \"SDC:%s -> %.1fGB\", $5, $2}'"
-        Disk = subprocess.check_output(cmd, shell=True)
-        str_Disk = str(Disk).lstrip('b\'')
-        str_Disk = str_Disk.rstrip('\'')
-        return str_Disk
+        if "disk_used" in self.__values:
+            used, total = self.__values["disk_used"], self.__values["disk_total"]
+        else:
+            used, total = self.__sampler.disk("/")
+        return "SDC:%d%% -> %.1fGB" % (used, total)
+
+    def getTextCacheStats(self):
+        """Line/glyph cache hit and miss counters of the text renderer."""
+        return self.__text.stats()
+
+    def getDisplayStats(self):
+        """Frames pushed, frames skipped as unchanged, I2C bytes sent and
+        frames drawn per page."""
+        display = self.__display
+        return {"frames": display.frames, "skipped": display.skipped,
+                "bytes": display.total_bytes, "pages": dict(self.__page_frames)}
 
     def getLocalIP(self):
-        ip = os.popen(
-            "/sbin/ifconfig enP8p1s0 | grep 'inet' | awk '{print $2}'").read()
-        ip = ip[0: ip.find('\n')]
-        if(ip == '' or len(ip) > 15):
-            ip = os.popen(
-                "/sbin/ifconfig wlP1p1s0 | grep 'inet' | awk '{print $2}'").read()
-            ip = ip[0: ip.find('\n')]
-            if(ip == ''):
-                ip = 'x.x.x.x'
-        if len(ip) > 15:
+        if self.__watcher is not None:
+            return self.__ip_text(self.__watcher.address())
+        # no netlink: ask the kernel for every interface the priority list
+        # can match
+        addresses = {}
+        for _, name in socket.if_nameindex():
+            ip = self.__sampler.ipv4_address(name)
+            if ip is not None:
+                addresses[name] = [ip]
+        return self.__ip_text(netwatch.pick(addresses, self.__ifaces))
+
+    @staticmethod
+    def __ip_text(ip):
+        if ip is None or len(ip) > 15:
             ip = 'x.x.x.x'
         return ip
 
     def getWifiSetupMode(self):
         """Check if WiFi setup portal is active. Returns IP string or None."""
-        try:
-            with open("/tmp/wifi_setup_active", "r") as f:
-                return f.read().strip()
-        except:
+        if self.__portal is not None:
+            state = self.__portal.state
+        else:
+            state = portal_state.read_flag(self.__portal_flag)
+        return PortalProvider.values_for(state)["setup"]
+
+    def __make_registry(self, epoch):
+        registry = ProviderRegistry(epoch=epoch)
+        registry.register(CpuProvider(self.__sampler))
+        registry.register(ThermalProvider(self.__sampler))
+        registry.register(MemoryProvider(self.__sampler))
+        registry.register(DiskProvider(self.__sampler))
+        registry.register(GpuProvider(self.__root))
+        if self.__watcher is None:
+            registry.register(FunctionProvider(
+                "ip", self.getLocalIP, IP_INTERVAL, cost=30))
+        if self.__portal is None:
+            registry.register(PortalProvider(self.__portal_flag, interval=SETUP_INTERVAL))
+        return registry
+
+    def __open_watcher(self):
+        """Follow address changes over netlink; fall back to polling if that fails."""
+        if self.__watcher is None:
+            try:
+                self.__watcher = netwatch.AddressWatcher(self.__ifaces)
+            except OSError as e:
+                if self.__debug:
+                    print("---OLED netlink unavailable, polling IP---:", e)
+        return self.__watcher
+
+    def __open_portal(self):
+        """Get portal state pushed over a socket; fall back to the flag file."""
+        if self.__portal is None and self.__portal_socket:
+            try:
+                self.__portal = portal_state.PortalListener(self.__portal_socket,
+                                                            self.__portal_flag)
+            except OSError as e:
+                if self.__debug:
+                    print("---OLED portal socket unavailable, polling flag---:", e)
+        return self.__portal
+
+    def __open_snapshot(self):
+        """Publish metrics for other processes; optional, so failures only log."""
+        if self.__snapshot is None and self.__snapshot_path:
+            try:
+                self.__snapshot = metrics_shm.SnapshotWriter(self.__snapshot_path)
+            except OSError as e:
+                if self.__debug:
+                    print("---OLED metrics snapshot disabled---:", e)
+        return self.__snapshot
+
+    def __open_metrics(self, registry, sched):
+        """Serve /metrics for monitoring; optional like the snapshot."""
+        if self.__metrics_address is None:
             return None
+        if self.__metrics is not None:
+            self.__metrics.close()
+            self.__metrics = None
+        try:
+            self.__metrics = metrics_http.MetricsEndpoint(
+                self.__metrics_address,
+                lambda: metrics_http.families(registry.values, registry, sched,
+                                              self.getDisplayStats()),
+                sched, registry.sampled_at)
+        except OSError as e:
+            if self.__debug:
+                print("---OLED metrics endpoint disabled---:", e)
+        return self.__metrics
+
+    def dumpHistory(self, path=history.HISTORY_DUMP):
+        """Write the metric history to a binary file (see history.py)."""
+        try:
+            self.__history.dump(path)
+            return True
+        except OSError as e:
+            if self.__debug:
+                print("---OLED history dump failed---:", e)
+            return False
+
+    def __show(self, values):
+        items = portal_page(values)
+        page = "setup"
+        if items is None:
+            page = self.__pages.current
+            items = self.__pages.render(dict(values, history=self.__history))
+        if items == self.__shown:
+            return
+        self.__page_frames[page] = self.__page_frames.get(page, 0) + 1
+        self.__shown = items
+        self.clear()
+        for x, line, text in items:
+            if isinstance(text, Sparkline):
+                # same origin as add_text, so bars line up with their label
+                draw_sparkline(self.__draw, x + self.__x, 8 * (line - 1) + self.__top, text)
+            else:
+                self.add_text(x, 8 * (line - 1), text)
+        self.refresh()
+        if not self.__first_frame:
+            self.__first_frame = True
+            boottrace.instant("first frame")
+            boottrace.flush()
 
     def main_program(self):
         state = False
         try:
-            cpu_index = 0
-            state = self.begin()
-            while state:
+            with boottrace.span("begin", auto=self.__auto):
+                state = self.begin()
+            if state:
                 self.clear()
                 if self.__clear:
                     self.refresh()
                     return True
 
-                setup_ip = self.getWifiSetupMode()
-                if setup_ip:
-                    self.add_line("** WiFi Setup **", 1)
-                    self.add_line("Join: JetsonSetup", 2)
-                    self.add_line("Pass: jetson1234", 3)
-                    self.add_line("Open:" + setup_ip, 4)
-                    self.refresh()
-                    time.sleep(1)
-                    continue
-
-                str_CPU = self.getCPULoadRate(cpu_index)
-                str_Temp = self.getCPUTemp()
-                if cpu_index == 0:
-                    str_FreeRAM = self.getUsagedRAM()
-                    str_Disk = self.getUsagedDisk()
-                    str_IP = "IP:" + self.getLocalIP()
-                self.add_text(0, 0, str_CPU)
-                self.add_text(68, 0, str_Temp)
-                self.add_line(str_FreeRAM, 2)
-                self.add_line(str_Disk, 3)
-                self.add_line(str_IP, 4)
-                self.refresh()
-                cpu_index = cpu_index + 1
-                if cpu_index >= 5:
-                    cpu_index = 0
-                time.sleep(.1)
+                self.__shown = None
+                with boottrace.span("setup"):
+                    sched = Scheduler()
+                    watcher = self.__open_watcher()
+                    portal = self.__open_portal()
+                    registry = self.__make_registry(sched.epoch)
+                    self.__values = registry.values
+                    snapshot = self.__open_snapshot()
+                    metrics = self.__open_metrics(registry, sched)
+
+                def tick():
+                    now = sched.clock()
+                    if registry.sample_due(now) and snapshot is not None:
+                        snapshot.publish(registry.values)
+                    if metrics is not None:
+                        metrics.invalidate()
+                    for key in HISTORY_METRICS:
+                        if registry.sampled_at.get(key) == now:
+                            # one point per regular step, also while backed off
+                            for _ in range(registry.slowdown):
+                                self.__history.record(key, registry.values.get(key))
+                    if self.__backoff is not None:
+                        slowdown = self.__backoff.update(registry.values.get("cpu"))
+                        if slowdown != registry.slowdown and self.__debug:
+                            print("---OLED load backoff x%d---" % slowdown)
+                        registry.slowdown = slowdown
+                    sched.call_at(registry.next_deadline(), tick)
+
+                def address_changed():
+                    if watcher.handle():
+                        registry.update({"ip": self.getLocalIP()})
+                        if snapshot is not None:
+                            snapshot.publish(registry.values)
+                        if metrics is not None:
+                            metrics.invalidate()
+
+                if watcher is not None:
+                    registry.update({"ip": self.getLocalIP()})
+                    sched.add_reader(watcher, address_changed)
+
+                def portal_changed():
+                    if portal.handle():
+                        registry.update(PortalProvider.values_for(portal.state))
+                        if snapshot is not None:
+                            snapshot.publish(registry.values)
+                        if metrics is not None:
+                            metrics.invalidate()
+
+                if portal is not None:
+                    registry.update(PortalProvider.values_for(portal.state))
+                    sched.add_reader(portal, portal_changed)
+
+                def next_page():
+                    self.__page_ticks += 1
+                    if self.__page_ticks >= registry.slowdown:
+                        self.__page_ticks = 0
+                        self.__pages.advance()
+
+                def retry_broker():
+                    client = i2c_broker.connect("oled", self.__broker_socket, need="display")
+                    if client is None:
+                        return
+                    # the broker is back (e.g. restarted) and has the panel: leave the bus to it
+                    broker_retry.cancel()
+                    self.__broker = client
+                    sched.add_reader(client, broker_gone)
+                    self.__display = i2c_broker.BrokerDisplay(client)
+                    self.__shown = None
+                    if self.__debug:
+                        print("---OLED back on the I2C broker---")
+
+                def broker_gone():
+                    # readable only at EOF: the broker stopped, begin() again
+                    sched.remove_reader(self.__broker)
+                    raise OSError("the I2C broker stopped")
+
+                if self.__broker is not None:
+                    sched.add_reader(self.__broker, broker_gone)
+                if self.__broker is None and self.__broker_socket:
+                    broker_retry = sched.every(i2c_broker.RECONNECT_INTERVAL, retry_broker,
+                                               delay=i2c_broker.RECONNECT_INTERVAL)
+                sched.call_at(registry.next_deadline(), tick)
+                if len(self.__pages.names) > 1:
+                    sched.every(self.__page_interval, next_page,
+                                delay=self.__page_interval)
+                sched.run_forever(after=lambda: self.__show(registry.values))
             if self.__clear:
                 self.__clear_count = self.__clear_count + 1
                 if self.__clear_count > len(self.__BUS_LIST):
                     return True
             return False
-        except:
+        except Exception:
+            # not SystemExit: SIGTERM must stop the daemon, not restart the loop
             if self.__debug:
                 print("!!!---OLED refresh error---!!!")
             return False
@@ -220,13 +454,38 @@ if __name__ == "__main__":
     try:
         oled_clear = False
         oled_debug = False
+        oled_pages = None
+        oled_ifaces = None
+        oled_args = {}
         state = False
         for arg in sys.argv:
             if str(arg) == "clear":
                 oled_clear = True
             if str(arg) == "debug":
                 oled_debug = True
-        oled = Yahboom_OLED(clear=oled_clear, debug=oled_debug)
+            if str(arg).startswith("pages="):
+                oled_pages = str(arg)[len("pages="):].split(",")
+            if str(arg).startswith("ifaces="):
+                oled_ifaces = str(arg)[len("ifaces="):].split(",")
+            if str(arg).startswith("bus="):
+                oled_args["i2c_bus"] = str(arg)[len("bus="):]
+            if str(arg).startswith("metrics="):
+                oled_args["metrics_address"] = metrics_http.parse_address(str(arg)[len("metrics="):])
+        boottrace.start("oled")
+        isolated = None if oled_clear else isolation.isolate()
+        if isolated is not None:
+            oled_args["backoff"] = isolation.LoadBackoff()
+            if oled_debug:
+                print("---OLED isolation---:", isolated)
+        oled = Yahboom_OLED(clear=oled_clear, debug=oled_debug,
+                            pages=oled_pages, ifaces=oled_ifaces, **oled_args)
+        if not oled_clear:
+            # before the first begin(): SIGUSR1's default action would kill us
+            signal.signal(signal.SIGUSR1, lambda signum, frame: oled.dumpHistory())
+            # a systemd stop unwinds normally, so the PID file goes away
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            history.write_pid()
+            atexit.register(history.remove_pid)
         while True:
             state = oled.main_program()
             if state:
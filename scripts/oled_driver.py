@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Dirty-region SSD1306 framebuffer updates.
+
+The SSD1306 keeps its own copy of the framebuffer (GDDRAM), laid out as
+pages of 8 pixel rows, one byte per column. DiffDisplay remembers the last
+frame it pushed and on every show() sends only the column runs that changed,
+using the controller's column/page address window. An unchanged frame costs
+no bus traffic at all.
+
+`device` is anything with Adafruit_GPIO.I2C.Device's write8(register, value)
+and writeList(register, data), e.g. the `_i2c` of an Adafruit_SSD1306
+instance, or sim.fake_i2c.FakeSSD1306 for testing without hardware.
+
+pack_image() converts a PIL '1' image to that page format in bulk, instead
+of Adafruit_SSD1306.image()'s per-pixel loop: NumPy bit-packing when NumPy
+is installed, otherwise Image.tobytes() through a precomputed 8x8 bit
+transpose table.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SSD1306_COLUMNADDR = 0x21
+SSD1306_PAGEADDR = 0x22
+
+CONTROL_COMMAND = 0x00
+CONTROL_DATA = 0x40
+
+# Bytes on the wire to (re)position the address window: one control byte
+# plus COLUMNADDR start end PAGEADDR start end. Unchanged gaps shorter than
+# this are cheaper to resend than to skip.
+WINDOW_COST = 7
+
+
+def _transpose_table():
+    # _TRANSPOSE[row][byte] spreads one packed row byte (8 pixels, MSB =
+    # leftmost) over 8 column bytes: bit `row` of column byte c, column byte
+    # c at bits 8c..8c+7 of the result.
+    table = []
+    for row in range(8):
+        entries = []
+        for value in range(256):
+            word = 0
+            for col in range(8):
+                if value & (0x80 >> col):
+                    word |= 1 << (8 * col + row)
+            entries.append(word)
+        table.append(entries)
+    return table
+
+
+_TRANSPOSE = _transpose_table()
+
+
+def pack_rows(raw, width, height):
+    """Convert packed 1-bit rows (PIL '1' tobytes()) to SSD1306 page bytes.
+
+    width must be a multiple of 8 and height a multiple of 8.
+    """
+    stride = width // 8
+    t0, t1, t2, t3, t4, t5, t6, t7 = _TRANSPOSE
+    out = []
+    for page in range(height // 8):
+        base = page * 8 * stride
+        rows = [raw[base + r * stride:base + (r + 1) * stride] for r in range(8)]
+        for b0, b1, b2, b3, b4, b5, b6, b7 in zip(*rows):
+            word = (t0[b0] | t1[b1] | t2[b2] | t3[b3] |
+                    t4[b4] | t5[b5] | t6[b6] | t7[b7])
+            out.append(word.to_bytes(8, "little"))
+    return b"".join(out)
+
+
+def pack_rows_numpy(raw, width, height):
+    """NumPy version of pack_rows()."""
+    bits = numpy.unpackbits(numpy.frombuffer(raw, numpy.uint8))
+    bits = bits.reshape(height // 8, 8, width).transpose(0, 2, 1)
+    return numpy.packbits(bits, axis=2, bitorder="little").tobytes()
+
+
+def pack_image(image):
+    """Return the SSD1306 page buffer for a PIL mode '1' image."""
+    if image.mode != '1':
+        raise ValueError("Image must be in mode 1.")
+    width, height = image.size
+    if numpy is not None:
+        return pack_rows_numpy(image.tobytes(), width, height)
+    return pack_rows(image.tobytes(), width, height)
+
+
+class DiffDisplay:
+    def __init__(self, device, width=128, height=32, chunk=32):
+        self.__device = device
+        self.width = width
+        self.pages = height // 8
+        self.chunk = chunk
+        self.__last = None
+
+        self.frames = 0
+        self.skipped = 0
+        self.last_bytes = 0
+        self.total_bytes = 0
+
+    def invalidate(self):
+        """Forget what the panel shows; the next show() sends a full frame."""
+        self.__last = None
+
+    def dirty_spans(self, buf):
+        """Return [(page, first_col, last_col), ...] that differ from the panel."""
+        last = self.__last
+        width = self.width
+        if last is None:
+            return [(page, 0, width - 1) for page in range(self.pages)]
+        spans = []
+        for page in range(self.pages):
+            base = page * width
+            if buf[base:base + width] == last[base:base + width]:
+                continue
+            run_start = None
+            run_end = None
+            for col in range(width):
+                if buf[base + col] == last[base + col]:
+                    continue
+                if run_start is None:
+                    run_start = col
+                elif col - run_end - 1 >= WINDOW_COST:
+                    spans.append((page, run_start, run_end))
+                    run_start = col
+                run_end = col
+            spans.append((page, run_start, run_end))
+        return spans
+
+    def show(self, buf):
+        """Push buf (pages * width bytes, SSD1306 page format) to the panel.
+
+        Returns the number of bytes written to the bus for this frame,
+        control bytes included, device address excluded.
+        """
+        buf = bytes(buf)
+        self.frames += 1
+        if buf == self.__last:
+            self.skipped += 1
+            self.last_bytes = 0
+            return 0
+
+        spans = self.dirty_spans(buf)
+        cost = sum(WINDOW_COST + self.__data_cost(end - start + 1)
+                   for _, start, end in spans)
+        full = WINDOW_COST + self.__data_cost(len(buf))
+        if cost >= full:
+            sent = self.__write(0, self.pages - 1, 0, self.width - 1, buf)
+        else:
+            sent = 0
+            for page, start, end in spans:
+                base = page * self.width
+                sent += self.__write(page, page, start, end,
+                                     buf[base + start:base + end + 1])
+
+        self.__last = buf
+        self.last_bytes = sent
+        self.total_bytes += sent
+        return sent
+
+    def show_image(self, image):
+        """Pack a PIL mode '1' image and show() it."""
+        return self.show(pack_image(image))
+
+    def __data_cost(self, length):
+        # one control byte per chunk
+        return length + (length + self.chunk - 1) // self.chunk
+
+    def __write(self, page_start, page_end, col_start, col_end, data):
+        self.__device.writeList(CONTROL_COMMAND, [
+            SSD1306_COLUMNADDR, col_start, col_end,
+            SSD1306_PAGEADDR, page_start, page_end])
+        sent = WINDOW_COST
+        for i in range(0, len(data), self.chunk):
+            block = list(data[i:i + self.chunk])
+            self.__device.writeList(CONTROL_DATA, block)
+            sent += 1 + len(block)
+        return sent
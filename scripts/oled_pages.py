@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""OLED screens built from provider values.
+
+A page turns the registry's value dict into 4-line screen content: a list
+of (x, line, text) items, line 1..4, where text may also be a Sparkline.
+PageRotator cycles through the pages the daemon was asked to show.
+"""
+
+from collections import namedtuple
+
+# Seconds per sparkline pixel on the history page, and sparkline width.
+HISTORY_RESOLUTION = 10
+SPARK_WIDTH = 72
+
+# Bar graph of `values` scaled from lo..hi, one column per value, filling a
+# text line (7 pixels tall). A tuple so pages still compare by value.
+Sparkline = namedtuple("Sparkline", "values lo hi")
+
+
+def _fmt(value, fmt, missing="--"):
+    return missing if value is None else fmt % value
+
+
+def overview_page(values):
+    """The classic CPU / temperature / RAM / disk / IP screen."""
+    items = [(0, 1, "CPU:%d%%" % values.get("cpu", 0))]
+    temp = values.get("temp")
+    items.append((68, 1, "--.-C" if temp is None else "{:.1f}C".format(temp)))
+    if "ram_used" in values:
+        items.append((0, 2, "RAM:%2d%% -> %.1fGB " % (values["ram_used"], values["ram_total"])))
+    if "disk_used" in values:
+        items.append((0, 3, "SDC:%d%% -> %.1fGB" % (values["disk_used"], values["disk_total"])))
+    if "ip" in values:
+        items.append((0, 4, "IP:" + values["ip"]))
+    return items
+
+
+def cores_page(values):
+    """Per-core load, three cores per line."""
+    cores = values.get("cpu_cores") or []
+    items = []
+    for i in range(0, min(len(cores), 12), 3):
+        text = " ".join("%d:%3d%%" % (n, cores[n]) for n in range(i, min(i + 3, len(cores))))
+        items.append((0, i // 3 + 1, text))
+    return items
+
+
+def thermal_page(values):
+    """Every thermal zone, two per line (up to eight)."""
+    temps = list((values.get("temps") or {}).items())[:8]
+    if not temps:
+        return [(0, 1, "no thermal zones")]
+    items = []
+    for i in range(0, len(temps), 2):
+        text = "  ".join("%-4s%5.1fC" % (name.replace("-thermal", "")[:4], temp)
+                         for name, temp in temps[i:i + 2])
+        items.append((0, i // 2 + 1, text))
+    return items
+
+
+def gpu_page(values):
+    """GPU load, GPU/EMC clocks against their maximum, and whether the
+    clocks look pinned at maximum the way jetson_clocks leaves them."""
+    gpu_clock, gpu_max = values.get("gpu_clock"), values.get("gpu_clock_max")
+    emc_clock, emc_max = values.get("emc_clock"), values.get("emc_clock_max")
+    pinned = [cur == top for cur, top in ((gpu_clock, gpu_max), (emc_clock, emc_max))
+              if cur is not None and top is not None]
+    if not pinned:
+        clocks = "clocks: unknown"
+    elif all(pinned):
+        clocks = "clocks: max"
+    else:
+        clocks = "clocks: scaling"
+    return [
+        (0, 1, "GPU:" + _fmt(values.get("gpu_load"), "%d%%")),
+        (0, 2, "GPU " + _fmt(gpu_clock, "%d") + "/" + _fmt(gpu_max, "%d") + "MHz"),
+        (0, 3, "EMC " + _fmt(emc_clock, "%d") + "/" + _fmt(emc_max, "%d") + "MHz"),
+        (0, 4, clocks),
+    ]
+
+
+def history_page(values):
+    """CPU, temperature and RAM sparklines from values["history"] (a
+    history.History), newest on the right, plus their peaks."""
+    history = values.get("history")
+    if history is None:
+        return [(0, 1, "no history")]
+    items = []
+    peaks = {}
+    rows = (("CPU", "cpu", "%3d%%", 0, 100),
+            ("TMP", "temp", "%2dC", None, None),
+            ("RAM", "ram_used", "%3d%%", 0, 100))
+    for line, (label, key, fmt, lo, hi) in enumerate(rows, 1):
+        series = history.series.get(key)
+        points = series.values(HISTORY_RESOLUTION, SPARK_WIDTH) if series else []
+        if not points:
+            items.append((0, line, label + " --"))
+            continue
+        if lo is None:
+            # auto-scale, but keep at least 5 degrees of range so sensor
+            # noise does not look like a swing
+            lo, hi = min(points), max(points)
+            if hi - lo < 5:
+                lo = (lo + hi) / 2 - 2.5
+                hi = lo + 5
+        peaks[key] = max(points)
+        items.append((0, line, label))
+        items.append((20, line, Sparkline(tuple(round(p, 1) for p in points), lo, hi)))
+        current = values.get(key)
+        items.append((96, line, fmt % (points[-1] if current is None else current)))
+    minutes = HISTORY_RESOLUTION * SPARK_WIDTH // 60
+    if "cpu" in peaks and "temp" in peaks:
+        items.append((0, 4, "%dm pk:%d%% %.1fC" % (minutes, peaks["cpu"], peaks["temp"])))
+    return items
+
+
+def draw_sparkline(draw, x, y, spark, height=7):
+    """Draw a Sparkline with an ImageDraw, top-left corner at (x, y)."""
+    span = (spark.hi - spark.lo) or 1
+    bottom = y + height - 1
+    for i, value in enumerate(spark.values):
+        level = min(max((value - spark.lo) / span, 0.0), 1.0)
+        draw.line((x + i, bottom, x + i, bottom - round(level * (height - 1))), fill=255)
+
+
+def portal_page(values):
+    """What the WiFi-setup portal is doing (values["portal"], see
+    portal_state.py), or None when it is idle."""
+    portal = values.get("portal") or {}
+    state = portal.get("state")
+    title = (0, 1, "** WiFi Setup **")
+    if state == "hotspot":
+        return [title,
+                (0, 2, "Join: " + portal.get("ssid", "JetsonSetup")),
+                (0, 3, "Pass: " + portal.get("password", "jetson1234")),
+                (0, 4, "Open:" + portal.get("ip", ""))]
+    if state == "scanning":
+        return [title, (0, 2, "Scanning..."), (0, 3, "hotspot back soon")]
+    if state == "connecting":
+        return [title, (0, 2, "Connecting to"), (0, 3, portal.get("ssid", "")[:21]),
+                (0, 4, "please wait...")]
+    if state == "failed":
+        return [title, (0, 2, "Failed: " + portal.get("connect_ssid", "")[:13]),
+                (0, 3, portal.get("detail", "")[:21]),
+                (0, 4, "Retry: " + portal.get("ip", ""))]
+    return None
+
+
+PAGES = {
+    "overview": overview_page,
+    "cores": cores_page,
+    "thermal": thermal_page,
+    "gpu": gpu_page,
+    "history": history_page,
+}
+
+
+class PageRotator:
+    def __init__(self, names):
+        unknown = [name for name in names if name not in PAGES]
+        if unknown:
+            raise ValueError("unknown OLED page(s): " + ", ".join(unknown))
+        self.names = list(names)
+        self.index = 0
+
+    @property
+    def current(self):
+        return self.names[self.index]
+
+    def advance(self):
+        """Move to the next page. Returns True if the visible page changed."""
+        if len(self.names) < 2:
+            return False
+        self.index = (self.index + 1) % len(self.names)
+        return True
+
+    def render(self, values):
+        return PAGES[self.current](values)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Cached text rendering for the OLED.
+
+Most OLED lines change rarely, so TextCache keeps the rendered 1-bit tile of
+each recent (text, position) in a bounded LRU and a frame becomes a handful
+of blits. On a miss the line is composed from a glyph atlas rasterized once
+at startup when the font is a fixed bitmap font (Pillow's classic default
+font), or rendered with ImageDraw.text otherwise: FreeType glyphs are hinted
+in context, so per-glyph composition would not be pixel-identical.
+"""
+
+from collections import OrderedDict
+
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+ATLAS_CHARS = "".join(chr(c) for c in range(32, 127))
+
+
+class TextCache:
+    def __init__(self, font, max_lines=64):
+        self.__font = font
+        self.__max_lines = max_lines
+        self.__lines = OrderedDict()
+        self.__atlas = None
+        self.__advance = 0
+        self.__line_height = 0
+        if isinstance(font, ImageFont.ImageFont):
+            self.__build_atlas()
+
+        self.line_hits = 0
+        self.line_misses = 0
+        self.glyph_hits = 0
+        self.glyph_misses = 0
+
+    def __build_atlas(self):
+        # Pillow pastes each bitmap glyph over the previous one inside the
+        # glyph's ink box, which can start a pixel left of its cell, and
+        # clips the result to the string's cells. Render every glyph between
+        # spaces and keep that box and its offset.
+        font = self.__font
+        advance = int(font.getlength("M"))
+        height = font.getbbox(ATLAS_CHARS)[3]
+        atlas = {}
+        for ch in ATLAS_CHARS:
+            if int(font.getlength(ch)) != advance:
+                return
+            cell = Image.new('1', (3 * advance, height))
+            ImageDraw.Draw(cell).text((0, 0), " " + ch + " ", font=font, fill=255)
+            box = cell.getbbox()
+            if box is None:
+                atlas[ch] = None
+                continue
+            atlas[ch] = (cell.crop(box), box[0] - advance, box[1])
+        self.__atlas = atlas
+        self.__advance = advance
+        self.__line_height = height
+
+    def stats(self):
+        return {
+            "line_hits": self.line_hits,
+            "line_misses": self.line_misses,
+            "glyph_hits": self.glyph_hits,
+            "glyph_misses": self.glyph_misses,
+            "lines_cached": len(self.__lines),
+        }
+
+    def draw(self, image, xy, text):
+        """Draw text at xy on a mode '1' image, like ImageDraw.text(fill=255)."""
+        key = (text, xy[0], xy[1])
+        entry = self.__lines.get(key)
+        if entry is not None:
+            self.line_hits += 1
+            self.__lines.move_to_end(key)
+        else:
+            self.line_misses += 1
+            entry = self.__compose(text)
+            if entry is None:
+                entry = self.__render(text)
+            self.__lines[key] = entry
+            if len(self.__lines) > self.__max_lines:
+                self.__lines.popitem(last=False)
+        tile, dx, dy = entry
+        if tile is not None:
+            image.paste(255, (xy[0] + dx, xy[1] + dy), mask=tile)
+
+    def __compose(self, text):
+        atlas = self.__atlas
+        if atlas is None:
+            return None
+        for ch in text:
+            if ch not in atlas:
+                self.glyph_misses += 1
+                return None
+        self.glyph_hits += len(text)
+        if not text:
+            return None, 0, 0
+        tile = Image.new('1', (self.__advance * len(text), self.__line_height))
+        x = 0
+        for ch in text:
+            glyph = atlas[ch]
+            if glyph is not None:
+                tile.paste(glyph[0], (x + glyph[1], glyph[2]))
+            x += self.__advance
+        return self.__trim(tile, 0, 0)
+
+    def __render(self, text):
+        # Measure in mode '1' like ImageDraw does on the panel: FreeType's
+        # mono hinting gives wider advances than the antialiased layout, so
+        # the default getbbox() would clip the end of long lines.
+        left, top, right, bottom = self.__font.getbbox(text, mode='1')
+        # getbbox() is the layout box, ink can spill past it; pad and trim
+        pad = max(bottom - top, 1)
+        dx, dy = min(0, left) - pad, min(0, top) - pad
+        tile = Image.new('1', (right - dx + pad, bottom - dy + pad))
+        ImageDraw.Draw(tile).text((-dx, -dy), text, font=self.__font, fill=255)
+        return self.__trim(tile, dx, dy)
+
+    @staticmethod
+    def __trim(tile, dx, dy):
+        box = tile.getbbox()
+        if box is None:
+            return None, 0, 0
+        return tile.crop(box), dx + box[0], dy + box[1]
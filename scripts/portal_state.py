@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""WiFi-setup portal state shared between wifi_setup.py and the OLED.
+
+wifi_setup announces every state change as one JSON datagram on a Unix
+socket the OLED daemon listens on, so the OLED switches screens on the same
+wakeup instead of polling. The latest state is also kept in FLAG_FILE so a
+daemon that starts (or restarts) later still finds it; the file only exists
+while the portal has something to show.
+
+States: "idle", "scanning", "hotspot" (ip, ssid, password),
+"connecting" (ssid), "failed" (ssid, detail, ip).
+
+    python3 portal_state.py            # print state changes as they arrive
+"""
+
+import json
+import os
+import socket
+import sys
+
+FLAG_FILE = "/tmp/wifi_setup_active"
+STATE_SOCKET = "/run/yahboom/portal.sock"
+
+IDLE = {"state": "idle"}
+
+
+def parse(raw):
+    """Parse a datagram or flag file body; a bare IP is the old flag format."""
+    text = raw.decode() if isinstance(raw, bytes) else raw
+    text = text.strip()
+    if not text:
+        return dict(IDLE)
+    try:
+        state = json.loads(text)
+    except ValueError:
+        return {"state": "hotspot", "ip": text}
+    if not isinstance(state, dict) or "state" not in state:
+        return dict(IDLE)
+    return state
+
+
+def read_flag(flag_file=FLAG_FILE):
+    try:
+        with open(flag_file, "r") as f:
+            return parse(f.read())
+    except OSError:
+        return dict(IDLE)
+
+
+def announce(state, flag_file=FLAG_FILE, socket_path=STATE_SOCKET, **fields):
+    """Record the portal state in flag_file and notify a listening OLED.
+
+    Never raises for a missing listener: the flag file is the fallback.
+    """
+    message = dict(fields, state=state)
+    data = json.dumps(message)
+    try:
+        if state == "idle":
+            os.remove(flag_file)
+        else:
+            tmp = flag_file + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.replace(tmp, flag_file)
+    except OSError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        sock.sendto(data.encode(), socket_path)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+    return message
+
+
+class PortalListener:
+    """Receiving end, owned by the OLED daemon; register it as a reader."""
+
+    def __init__(self, socket_path=STATE_SOCKET, flag_file=FLAG_FILE):
+        self.socket_path = socket_path
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            try:
+                os.unlink(socket_path)
+            except FileNotFoundError:
+                pass
+            self.__sock.bind(socket_path)
+            # only the service user's group may push state; root's
+            # wifi_setup gets through regardless of the mode
+            os.chmod(socket_path, 0o660)
+        except OSError:
+            self.__sock.close()
+            raise
+        self.__sock.setblocking(False)
+        self.state = read_flag(flag_file)
+
+    def fileno(self):
+        return self.__sock.fileno()
+
+    def handle(self):
+        """Drain pending datagrams. Returns True if the state changed."""
+        changed = False
+        while True:
+            try:
+                data = self.__sock.recv(4096)
+            except BlockingIOError:
+                break
+            state = parse(data)
+            if state != self.state:
+                self.state = state
+                changed = True
+        return changed
+
+    def close(self):
+        self.__sock.close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    import selectors
+    listener = PortalListener(sys.argv[1] if len(sys.argv) > 1 else STATE_SOCKET)
+    print(listener.state)
+    sel = selectors.DefaultSelector()
+    sel.register(listener, selectors.EVENT_READ)
+    try:
+        while True:
+            sel.select()
+            if listener.handle():
+                print(listener.state)
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        listener.close()
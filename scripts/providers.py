@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Metric providers for the status daemons.
+
+A provider samples one group of related metrics and declares how often it
+wants to run (`interval`, seconds) and roughly what one sample costs
+(`cost`, microseconds of CPU). The registry keeps every provider on a
+shared time grid and samples all providers that are due in one batched pass
+per tick, so the daemon wakes up once for everything due at that moment.
+
+Values are published in one flat dict, e.g. values["cpu"] = 12,
+values["temps"] = {"cpu-thermal": 48.1, ...}.
+"""
+
+import glob
+import os
+import time
+
+import portal_state
+from sampler import FileSource, under
+
+GPU_LOAD_PATHS = [
+    "/sys/devices/gpu.0/load",
+    "/sys/devices/platform/gpu.0/load",
+    "/sys/devices/*.ga10b/load",
+    "/sys/devices/platform/*.ga10b/load",
+    "/sys/devices/platform/bus@0/*.gpu/load",
+]
+GPU_DEVFREQ_PATHS = [
+    "/sys/class/devfreq/*.ga10b",
+    "/sys/class/devfreq/*.gpu",
+    "/sys/class/devfreq/*gv11b",
+]
+EMC_RATE_PATHS = [
+    "/sys/kernel/debug/bpmp/debug/clk/emc/rate",
+    "/sys/kernel/debug/clk/emc/clk_rate",
+]
+EMC_MAX_PATHS = [
+    "/sys/kernel/debug/bpmp/debug/clk/emc/max_rate",
+    "/sys/kernel/debug/clk/emc/clk_max_rate",
+]
+
+_MISSING = object()
+
+
+def find_path(candidates, root="/"):
+    """Return the first existing path matching one of the glob patterns."""
+    for pattern in candidates:
+        matches = sorted(glob.glob(under(root, pattern)))
+        if matches:
+            return matches[0]
+    return None
+
+
+def read_int(source):
+    """Read an integer from a FileSource, or None if it is missing/unreadable."""
+    if source is None:
+        return None
+    try:
+        return int(source.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Provider:
+    name = "provider"
+    interval = 1.0
+    cost = 50
+
+    def sample(self):
+        """Return a dict of metric name -> value."""
+        raise NotImplementedError
+
+
+class FunctionProvider(Provider):
+    """Wrap a callable returning a single value."""
+
+    def __init__(self, name, fn, interval=1.0, cost=50):
+        self.name = name
+        self.interval = interval
+        self.cost = cost
+        self.__fn = fn
+
+    def sample(self):
+        return {self.name: self.__fn()}
+
+
+class CpuProvider(Provider):
+    """Overall and per-core CPU load since the previous sample, in percent."""
+    name = "cpu"
+    interval = 1.0
+    cost = 60
+
+    def __init__(self, sampler):
+        self.__sampler = sampler
+        self.__last = {}
+
+    def sample(self):
+        loads = {}
+        for name, total, idle in self.__sampler.cpu_times():
+            last = self.__last.get(name)
+            self.__last[name] = (total, idle)
+            if last is None or total <= last[0]:
+                loads[name] = 0
+            else:
+                d_total = total - last[0]
+                loads[name] = int(100 * (d_total - (idle - last[1])) / d_total)
+        cores = [loads[name] for name in sorted(
+            (n for n in loads if n != "cpu"), key=lambda n: int(n[3:]))]
+        return {"cpu": loads.get("cpu", 0), "cpu_cores": cores}
+
+
+class ThermalProvider(Provider):
+    """Every thermal zone, plus thermal_zone0 as "temp"."""
+    name = "thermal"
+    interval = 2.0
+    cost = 80
+
+    def __init__(self, sampler):
+        self.__sampler = sampler
+
+    def sample(self):
+        return {"temps": self.__sampler.temperatures(),
+                "temp": self.__sampler.temperature(0)}
+
+
+class MemoryProvider(Provider):
+    name = "memory"
+    interval = 10.0
+    cost = 40
+
+    def __init__(self, sampler):
+        self.__sampler = sampler
+
+    def sample(self):
+        used, total = self.__sampler.ram()
+        return {"ram_used": used, "ram_total": total}
+
+
+class DiskProvider(Provider):
+    name = "disk"
+    interval = 10.0
+    cost = 20
+
+    def __init__(self, sampler, path="/"):
+        self.__sampler = sampler
+        self.__path = path
+
+    def sample(self):
+        used, total = self.__sampler.disk(self.__path)
+        return {"disk_used": used, "disk_total": total}
+
+
+class GpuProvider(Provider):
+    """GPU load (percent), GPU and EMC clocks (MHz) from sysfs/debugfs.
+
+    The EMC clock lives in debugfs, which is only readable as root; it is
+    reported as None otherwise.
+    """
+    name = "gpu"
+    interval = 1.0
+    cost = 60
+
+    def __init__(self, root="/"):
+        load = find_path(GPU_LOAD_PATHS, root)
+        devfreq = find_path(GPU_DEVFREQ_PATHS, root)
+        emc = find_path(EMC_RATE_PATHS, root)
+        emc_max = find_path(EMC_MAX_PATHS, root)
+        self.__load = FileSource(load, 32) if load else None
+        self.__gpu_cur = FileSource(os.path.join(devfreq, "cur_freq"), 32) if devfreq else None
+        self.__gpu_max = FileSource(os.path.join(devfreq, "max_freq"), 32) if devfreq else None
+        self.__emc = FileSource(emc, 32) if emc else None
+        self.__emc_max = FileSource(emc_max, 32) if emc_max else None
+
+    @staticmethod
+    def __mhz(value):
+        return None if value is None else value // 1000000
+
+    def sample(self):
+        load = read_int(self.__load)
+        return {
+            # the gpu load node counts in tenths of a percent
+            "gpu_load": None if load is None else load // 10,
+            "gpu_clock": self.__mhz(read_int(self.__gpu_cur)),
+            "gpu_clock_max": self.__mhz(read_int(self.__gpu_max)),
+            "emc_clock": self.__mhz(read_int(self.__emc)),
+            "emc_clock_max": self.__mhz(read_int(self.__emc_max)),
+        }
+
+
+class PortalProvider(Provider):
+    """WiFi-setup portal state from its flag file.
+
+    Only a fallback for when the OLED cannot listen on the portal socket;
+    "portal" is the state dict, "setup" the portal address while it is
+    showing anything (None otherwise).
+    """
+    name = "portal"
+    interval = 1.0
+    cost = 20
+
+    def __init__(self, flag_file=portal_state.FLAG_FILE, interval=1.0):
+        self.flag_file = flag_file
+        self.interval = interval
+
+    @staticmethod
+    def values_for(state):
+        active = state.get("state", "idle") != "idle"
+        return {"portal": state, "setup": state.get("ip") if active else None}
+
+    def sample(self):
+        return self.values_for(portal_state.read_flag(self.flag_file))
+
+
+class ProviderRegistry:
+    def __init__(self, clock=time.monotonic, epoch=None):
+        self.clock = clock
+        self.__entries = []
+        # share a Scheduler's epoch to land on the same wakeups as its tasks
+        self.__epoch = clock() if epoch is None else epoch
+        self.values = {}
+        # metric name -> clock time of the sample that produced it
+        self.sampled_at = {}
+        # every interval is multiplied by this (isolation.LoadBackoff)
+        self.slowdown = 1
+
+    def register(self, provider):
+        self.__entries.append({"provider": provider, "due": self.__epoch,
+                               "last_cost": None})
+        return provider
+
+    def providers(self):
+        return [entry["provider"] for entry in self.__entries]
+
+    def stats(self):
+        """Return {provider name: (interval, declared cost us, measured cost us)}."""
+        return {e["provider"].name: (e["provider"].interval, e["provider"].cost,
+                                     e["last_cost"]) for e in self.__entries}
+
+    def next_deadline(self):
+        if not self.__entries:
+            return None
+        return min(entry["due"] for entry in self.__entries)
+
+    def update(self, values, now=None):
+        """Store values that arrived outside of a provider (e.g. from an event
+        source). Returns the set of metric names whose value changed."""
+        if now is None:
+            now = self.clock()
+        changed = set()
+        for key, value in values.items():
+            if self.values.get(key, _MISSING) != value:
+                self.values[key] = value
+                changed.add(key)
+            self.sampled_at[key] = now
+        return changed
+
+    def sample_due(self, now=None):
+        """Sample every provider that is due, cheapest first.
+
+        Returns the set of metric names whose value changed.
+        """
+        if now is None:
+            now = self.clock()
+        due = [e for e in self.__entries if e["due"] <= now]
+        due.sort(key=lambda e: e["provider"].cost)
+        changed = set()
+        for entry in due:
+            provider = entry["provider"]
+            t0 = time.perf_counter()
+            try:
+                values = provider.sample()
+            except (OSError, ValueError, KeyError, IndexError):
+                values = {}
+            entry["last_cost"] = (time.perf_counter() - t0) * 1e6
+            changed |= self.update(values, now)
+            interval = provider.interval * self.slowdown
+            entry["due"] += interval
+            if entry["due"] <= now:
+                entry["due"] += ((now - entry["due"]) // interval + 1) * interval
+        return changed
@@ -1,9 +1,205 @@
 #!/usr/bin/env python3
-from CubeNanoLib import CubeNano
-
-bot = CubeNano(i2c_bus=7)
-bot.set_RGB_Color(2)    # Blue
-bot.set_RGB_Effect(6)   # Cycle breathing
-bot.set_RGB_Speed(2)    # Medium
-bot.set_Fan(1)          # Fan on
-del bot
+# coding=utf-8
+"""Fan and RGB controller for the CUBE case.
+
+Reads every thermal zone (the same SystemSampler source as the OLED) and
+drives the CubeNano:
+
+- Fan: on at FAN_ON_C, off again only below FAN_OFF_C and after it has
+  been on for FAN_MIN_ON seconds, so it does not flap around one value.
+- RGB: the hottest zone's headroom to its passive trip point (where the
+  kernel starts throttling) picks a level, from the usual blue breathing
+  when cool to fast red when throttling. A level is entered at once and
+  left only LEVEL_HYSTERESIS degrees further down and after
+  LEVEL_MIN_DWELL seconds.
+
+A setting is written to the CubeNano only when it changes. When the I2C
+broker (i2c_broker.py) runs, the settings go through it instead of
+opening the bus here. If the broker goes away, or has no CubeNano, the
+controller opens the bus itself, and it goes back to the broker once that
+is up again with the CubeNano; either way every setting is written again
+after the switch.
+
+    python3 rgb_blue.py [bus=7] [interval=2] [debug]
+"""
+
+import signal
+import sys
+import time
+
+import i2c_broker
+from sampler import SystemSampler
+
+INTERVAL = 2.0
+FAN_ON_C = 55.0
+FAN_OFF_C = 45.0
+FAN_MIN_ON = 60.0
+THROTTLE_C = 95.0           # used when no zone reports a passive trip point
+LEVEL_HYSTERESIS = 3.0
+LEVEL_MIN_DWELL = 10.0
+
+# name, entered at headroom <= (degrees C), (color, effect, speed).
+# Colors: 0=Red 2=Blue 3=Yellow; effects: 1=Breathing 2=Marquee 6=Cycle breathing.
+LEVELS = [
+    ("cool", None, (2, 6, 2)),
+    ("warm", 30.0, (3, 1, 2)),
+    ("hot", 12.0, (0, 1, 3)),
+    ("throttling", 0.0, (0, 2, 3)),
+]
+
+
+class ThermalController:
+    def __init__(self, bot, levels=LEVELS, fan_on=FAN_ON_C, fan_off=FAN_OFF_C,
+                 fan_min_on=FAN_MIN_ON, hysteresis=LEVEL_HYSTERESIS,
+                 min_dwell=LEVEL_MIN_DWELL, throttle_c=THROTTLE_C):
+        self.bot = bot
+        self.levels = levels
+        self.fan_on = fan_on
+        self.fan_off = fan_off
+        self.fan_min_on = fan_min_on
+        self.hysteresis = hysteresis
+        self.min_dwell = min_dwell
+        self.throttle_c = throttle_c
+        self.fan = None
+        self.level = None
+        self.writes = 0
+        self.__written = {}
+        self.__fan_since = None
+        self.__level_since = None
+
+    def headroom(self, temps, trips):
+        """Degrees C until the nearest zone reaches its throttling trip point."""
+        room = None
+        for name, temp in temps.items():
+            if temp <= -40:
+                continue  # unpowered or bogus sensor
+            r = trips.get(name, self.throttle_c) - temp
+            room = r if room is None else min(room, r)
+        return room
+
+    def __target_level(self, room):
+        target = 0
+        for i, (_, enter, _) in enumerate(self.levels):
+            if enter is not None and room <= enter:
+                target = i
+        return target
+
+    def update(self, temps, trips, now):
+        """Apply one reading. Returns (fan, level name)."""
+        readings = [t for t in temps.values() if t > -40]
+        if not readings:
+            return self.fan, self.levels[self.level or 0][0]
+        hottest = max(readings)
+        room = self.headroom(temps, trips)
+
+        fan = self.fan
+        if hottest >= self.fan_on:
+            fan = True
+        elif hottest < self.fan_off and (self.__fan_since is None
+                                         or now - self.__fan_since >= self.fan_min_on):
+            fan = False
+        elif fan is None:
+            fan = True  # start safe in the band between the two thresholds
+        if fan != self.fan:
+            self.fan = fan
+            self.__fan_since = now if fan else None
+
+        target = self.__target_level(room)
+        if self.level is None or target > self.level:
+            self.level, self.__level_since = target, now
+        elif target < self.level and now - self.__level_since >= self.min_dwell:
+            # step down one level once clear of its threshold by the hysteresis
+            if room > self.levels[self.level][1] + self.hysteresis:
+                self.level, self.__level_since = self.level - 1, now
+
+        color, effect, speed = self.levels[self.level][2]
+        self.__write("set_Fan", 1 if self.fan else 0)
+        self.__write("set_RGB_Color", color)
+        self.__write("set_RGB_Effect", effect)
+        self.__write("set_RGB_Speed", speed)
+        return self.fan, self.levels[self.level][0]
+
+    def forget(self):
+        """Write every setting again on the next update (after a new bot)."""
+        self.__written = {}
+
+    def __write(self, method, value):
+        if self.__written.get(method) != value:
+            getattr(self.bot, method)(value)
+            self.__written[method] = value
+            self.writes += 1
+
+
+def open_bot(i2c_bus, broker_socket=i2c_broker.BROKER_SOCKET):
+    client = i2c_broker.connect("rgb", broker_socket, need="leds")
+    if client is not None:
+        return i2c_broker.BrokerCubeNano(client)
+    from CubeNanoLib import CubeNano
+    return CubeNano(i2c_bus=i2c_bus)
+
+
+def close_bot(bot):
+    if isinstance(bot, i2c_broker.BrokerCubeNano):
+        bot.client.close()
+
+
+def main(i2c_bus=7, interval=INTERVAL, debug=False, root="/",
+         broker_socket=i2c_broker.BROKER_SOCKET):
+    bot = open_bot(i2c_bus, broker_socket)
+    sampler = SystemSampler(root=root)
+    trips = sampler.trip_points()
+    controller = ThermalController(bot)
+    retry_at = time.monotonic() + i2c_broker.RECONNECT_INTERVAL
+    # leave the fan on when stopped: the controller is no longer watching
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            now = time.monotonic()
+            if (broker_socket and now >= retry_at
+                    and not isinstance(bot, i2c_broker.BrokerCubeNano)):
+                # on the bus ourselves: hand it back once the broker is up with the CubeNano
+                retry_at = now + i2c_broker.RECONNECT_INTERVAL
+                client = i2c_broker.connect("rgb", broker_socket, need="leds")
+                if client is not None:
+                    bot = controller.bot = i2c_broker.BrokerCubeNano(client)
+                    controller.forget()
+                    if debug:
+                        print("---RGB back on the I2C broker---")
+            try:
+                if isinstance(bot, i2c_broker.BrokerCubeNano) and not bot.client.connected():
+                    raise OSError("the I2C broker stopped")
+                state = controller.update(sampler.temperatures(), trips, now)
+            except OSError as e:
+                # the broker went away (or the bus failed): reopen and write everything again
+                if debug:
+                    print("---RGB write failed, reopening---:", e)
+                close_bot(bot)
+                bot = controller.bot = open_bot(i2c_bus, broker_socket)
+                controller.forget()
+                retry_at = now + i2c_broker.RECONNECT_INTERVAL
+                time.sleep(interval)
+                continue
+            if debug:
+                print("fan %s, %s, %d writes" % (state[0], state[1], controller.writes))
+            time.sleep(interval)
+    finally:
+        try:
+            bot.set_Fan(1)
+        except OSError:
+            pass  # the broker is gone; it turns the fan on itself when it stops
+        del bot
+
+
+if __name__ == "__main__":
+    rgb_args = {}
+    for arg in sys.argv[1:]:
+        if arg.startswith("bus="):
+            rgb_args["i2c_bus"] = int(arg[len("bus="):])
+        elif arg.startswith("interval="):
+            rgb_args["interval"] = float(arg[len("interval="):])
+        elif arg == "debug":
+            rgb_args["debug"] = True
+    try:
+        main(**rgb_args)
+    except KeyboardInterrupt:
+        pass
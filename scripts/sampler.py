@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""In-process system metrics for the OLED daemon.
+
+Every source is read through a file handle that stays open for the life of
+the process: a sample is an lseek(0) + read() and a bit of parsing, never a
+fork/exec of cat, free, df or ifconfig.
+"""
+
+import fcntl
+import glob
+import math
+import os
+import socket
+import struct
+
+PROC_STAT = "/proc/stat"
+PROC_MEMINFO = "/proc/meminfo"
+THERMAL_DIR = "/sys/devices/virtual/thermal"
+
+SIOCGIFADDR = 0x8915
+
+
+def under(root, path):
+    """Return the absolute `path` re-rooted at `root` (e.g. a fake /proc tree)."""
+    return os.path.join(root, path.lstrip("/"))
+
+
+class FileSource:
+    """A /proc or sysfs file kept open and re-read from offset 0."""
+
+    def __init__(self, path, size=4096):
+        self.path = path
+        self.size = size
+        self.__fd = None
+
+    def read(self):
+        if self.__fd is None:
+            self.__fd = os.open(self.path, os.O_RDONLY)
+        os.lseek(self.__fd, 0, os.SEEK_SET)
+        return os.read(self.__fd, self.size)
+
+    def close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+
+class SystemSampler:
+    """CPU, memory, disk, temperature and IPv4 address without subprocesses."""
+
+    def __init__(self, proc_stat=PROC_STAT, proc_meminfo=PROC_MEMINFO,
+                 thermal_dir=THERMAL_DIR, root="/"):
+        # Only the leading "cpu" lines are parsed, the interrupt counters
+        # that follow them in /proc/stat are never needed.
+        self.__stat = FileSource(under(root, proc_stat), 4096)
+        self.__meminfo = FileSource(under(root, proc_meminfo), 2048)
+        self.__thermal_dir = under(root, thermal_dir)
+        self.__zones = None
+        self.__sock = None
+        self.__cpu_last = None
+
+    def close(self):
+        self.__stat.close()
+        self.__meminfo.close()
+        for _, source in self.__zones or []:
+            source.close()
+        self.__zones = None
+        if self.__sock is not None:
+            self.__sock.close()
+            self.__sock = None
+
+    # -- CPU ---------------------------------------------------------------
+
+    def cpu_times(self):
+        """Return [(name, total, idle), ...] for "cpu" and every "cpuN" line."""
+        times = []
+        for line in self.__stat.read().split(b"\n"):
+            if not line.startswith(b"cpu"):
+                break
+            fields = line.split()
+            values = [int(v) for v in fields[1:11]]
+            times.append((fields[0].decode(), sum(values), values[3]))
+        return times
+
+    def cpu_percent(self):
+        """Overall CPU usage in percent since the previous call.
+
+        The first call only records a baseline and returns 0.
+        """
+        _, total, idle = self.cpu_times()[0]
+        last = self.__cpu_last
+        self.__cpu_last = (total, idle)
+        if last is None:
+            return 0
+        d_total = total - last[0]
+        d_idle = idle - last[1]
+        if d_total <= 0:
+            return 0
+        return int(100 * (d_total - d_idle) / d_total)
+
+    # -- Memory and disk ---------------------------------------------------
+
+    def meminfo(self):
+        """Return the /proc/meminfo fields as a dict of kB values."""
+        info = {}
+        for line in self.__meminfo.read().split(b"\n"):
+            key, _, rest = line.partition(b":")
+            if rest:
+                info[key.decode()] = int(rest.split()[0])
+        return info
+
+    def ram(self):
+        """Return (used_percent, total_GB), matching `free`'s used column."""
+        info = self.meminfo()
+        total = info["MemTotal"]
+        available = info.get("MemAvailable", info.get("MemFree", 0))
+        return 100.0 * (total - available) / total, total / 1048576.0
+
+    def disk(self, path="/"):
+        """Return (used_percent, total_GB) of the filesystem holding path.
+
+        used_percent is rounded up like df's Use% column.
+        """
+        st = os.statvfs(path)
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        avail = st.f_bavail * st.f_frsize
+        total = st.f_blocks * st.f_frsize
+        if used + avail == 0:
+            return 0, 0.0
+        return math.ceil(100.0 * used / (used + avail)), total / 1073741824.0
+
+    # -- Thermal -----------------------------------------------------------
+
+    def thermal_zones(self):
+        """Return [(type, FileSource), ...] for every thermal zone, sorted."""
+        if self.__zones is None:
+            zones = []
+            paths = glob.glob(os.path.join(self.__thermal_dir, "thermal_zone*"))
+            for path in sorted(paths, key=lambda p: int(p.rsplit("zone", 1)[1])):
+                try:
+                    with open(os.path.join(path, "type"), "r") as f:
+                        name = f.read().strip()
+                except OSError:
+                    name = os.path.basename(path)
+                zones.append((name, FileSource(os.path.join(path, "temp"), 32)))
+            self.__zones = zones
+        return self.__zones
+
+    def temperatures(self):
+        """Return {zone_type: degrees_C} for every readable thermal zone."""
+        temps = {}
+        for name, source in self.thermal_zones():
+            try:
+                temps[name] = int(source.read()) / 1000.0
+            except (OSError, ValueError):
+                continue
+        return temps
+
+    def trip_points(self):
+        """Return {zone_type: lowest passive trip in degrees C} (where the
+        kernel starts throttling), for the zones that have one."""
+        trips = {}
+        paths = glob.glob(os.path.join(self.__thermal_dir, "thermal_zone*"))
+        for (name, _), path in zip(self.thermal_zones(),
+                                   sorted(paths, key=lambda p: int(p.rsplit("zone", 1)[1]))):
+            for type_path in glob.glob(os.path.join(path, "trip_point_*_type")):
+                try:
+                    with open(type_path, "r") as f:
+                        if f.read().strip() != "passive":
+                            continue
+                    with open(type_path[:-len("type")] + "temp", "r") as f:
+                        temp = int(f.read()) / 1000.0
+                except (OSError, ValueError):
+                    continue
+                if temp > 0 and (name not in trips or temp < trips[name]):
+                    trips[name] = temp
+        return trips
+
+    def temperature(self, zone=0):
+        """Return thermal_zone<zone> in degrees C, or None if unreadable."""
+        zones = self.thermal_zones()
+        if zone >= len(zones):
+            return None
+        try:
+            return int(zones[zone][1].read()) / 1000.0
+        except (OSError, ValueError):
+            return None
+
+    # -- Network -----------------------------------------------------------
+
+    def ipv4_address(self, ifname):
+        """Return the IPv4 address of ifname, or None if it has none."""
+        if self.__sock is None:
+            self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        req = struct.pack("256s", ifname.encode()[:15])
+        try:
+            res = fcntl.ioctl(self.__sock.fileno(), SIOCGIFADDR, req)
+        except OSError:
+            return None
+        return socket.inet_ntoa(res[20:24])
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Deadline scheduler for the status daemons.
+
+Periodic tasks each have their own interval; between deadlines the process
+sleeps in a single select() that also watches registered file descriptors,
+so it wakes up only when a task is due or an event source has data. Tasks
+that fall due together run in the same wakeup.
+"""
+
+import heapq
+import itertools
+import selectors
+import time
+
+
+class Task:
+    def __init__(self, fn, interval, when):
+        self.fn = fn
+        self.interval = interval
+        self.when = when
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.__heap = []
+        self.__seq = itertools.count()
+        self.__selector = selectors.DefaultSelector()
+        self.__running = False
+        self.epoch = clock()
+        self.wakeups = 0
+        # seconds spent running callbacks, and how late timed tasks ran
+        self.busy = 0.0
+        self.last_late = 0.0
+        self.max_late = 0.0
+
+    def call_at(self, when, fn):
+        """Run fn() once at clock time `when`."""
+        task = Task(fn, None, when)
+        heapq.heappush(self.__heap, (when, next(self.__seq), task))
+        return task
+
+    def call_later(self, delay, fn):
+        return self.call_at(self.clock() + delay, fn)
+
+    def every(self, interval, fn, delay=0.0):
+        """Run fn() every `interval` seconds, starting `delay` after creation.
+
+        All periodic tasks are laid on one grid measured from the scheduler's
+        creation, so a 1 s and a 2 s task wake the process together.
+        """
+        when = self.epoch + delay
+        task = Task(fn, interval, when)
+        heapq.heappush(self.__heap, (when, next(self.__seq), task))
+        return task
+
+    def add_reader(self, fileobj, fn):
+        """Run fn() whenever fileobj is readable."""
+        self.__selector.register(fileobj, selectors.EVENT_READ, fn)
+
+    def remove_reader(self, fileobj):
+        try:
+            self.__selector.unregister(fileobj)
+        except KeyError:
+            pass
+
+    def next_deadline(self):
+        while self.__heap and self.__heap[0][2].cancelled:
+            heapq.heappop(self.__heap)
+        return self.__heap[0][0] if self.__heap else None
+
+    def run_once(self, max_wait=None):
+        """Sleep until the next deadline or event, then run what is due.
+
+        Returns the number of callbacks that ran.
+        """
+        deadline = self.next_deadline()
+        timeout = max_wait
+        if deadline is not None:
+            timeout = max(0.0, deadline - self.clock())
+            if max_wait is not None:
+                timeout = min(timeout, max_wait)
+        if self.__selector.get_map():
+            events = self.__selector.select(timeout)
+        else:
+            events = []
+            if timeout is None:
+                raise RuntimeError("scheduler has nothing to wait for")
+            time.sleep(timeout)
+        self.wakeups += 1
+        started = time.perf_counter()
+
+        ran = 0
+        for key, _ in events:
+            key.data()
+            ran += 1
+        now = self.clock()
+        while self.__heap and self.__heap[0][0] <= now:
+            _, _, task = heapq.heappop(self.__heap)
+            if task.cancelled:
+                continue
+            self.last_late = now - task.when
+            self.max_late = max(self.max_late, self.last_late)
+            task.fn()
+            ran += 1
+            if task.interval is not None and not task.cancelled:
+                # stay on the original grid so tasks that share a period keep
+                # sharing wakeups; skip missed slots instead of bursting
+                task.when += task.interval
+                if task.when <= now:
+                    task.when += ((now - task.when) // task.interval + 1) * task.interval
+                heapq.heappush(self.__heap, (task.when, next(self.__seq), task))
+        self.busy += time.perf_counter() - started
+        return ran
+
+    def run_forever(self, after=None):
+        """Run until stop(); after() is called after every wakeup that ran work."""
+        self.__running = True
+        while self.__running:
+            if self.run_once() and after is not None:
+                started = time.perf_counter()
+                after()
+                self.busy += time.perf_counter() - started
+
+    def stop(self):
+        self.__running = False
@@ -1,146 +1,504 @@
 #!/usr/bin/env python3
 """WiFi Setup Portal for Jetson Orin Nano.
 
-On boot: waits for WiFi to connect. If it doesn't connect within 15s,
-creates a hotspot (JetsonSetup / jetson1234) and serves a web page at
+On boot: waits for WiFi to connect. If it doesn't connect within 15s, or
+NetworkManager has already failed every saved network in range, creates a
+hotspot (JetsonSetup / jetson1234) and serves a web page at
 10.42.0.1 where the user can select a WiFi network and enter credentials.
 """
 
-import subprocess
+import gzip
+import hashlib
+import itertools
+import signal
+import threading
 import time
 import json
 import sys
-import os
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import parse_qs
 
+import boottrace
+import isolation
+import known_networks
+import nm_backend
+import portal_state
+
 WIFI_IFACE = "wlP1p1s0"
 HOTSPOT_SSID = "JetsonSetup"
 HOTSPOT_PASS = "jetson1234"
 HOTSPOT_IP = "10.42.0.1"
 HOTSPOT_CON_NAME = "JetsonSetup-Hotspot"
 WAIT_TIMEOUT = 15
+GIVE_UP_RECHECK = 2    # seconds between checks whether NM has given up
+FAST_RECONNECT_TRIES = 2     # known networks tried at boot before the hotspot
+FAST_RECONNECT_TIMEOUT = 12  # seconds each of those tries may take
 WEB_PORT = 80
-FLAG_FILE = "/tmp/wifi_setup_active"
+SCAN_TTL = 15          # /scan refreshes results older than this (seconds)
+SCAN_EXPIRE = 120      # access points not seen for this long are dropped
+AP_SCAN_RETRIES = 2    # extra reads of an AP-mode scan that came back empty
+AP_SCAN_EMPTY_LIMIT = 3  # empty AP-mode scans in a row, with networks around, that mean it cannot work
+IP_TIMEOUT = 20        # seconds to wait for DHCP after joining a network
+JOB_TTL = 300          # finished connect jobs are forgotten after this (seconds)
+# How long the hotspot can be gone during a failed connect before it is back
+# up; the page assumes the connect worked once this has passed.
+CONNECT_DEADLINE = nm_backend.CONNECT_TIMEOUT + 30
+FLAG_FILE = portal_state.FLAG_FILE
+PORTAL_SOCKET = portal_state.STATE_SOCKET
 
 # Cached network list (scan must happen while not in AP mode)
 cached_networks = []
 
+# Scan results and connect outcomes, kept across boots
+known = known_networks.KnownNetworks(known_networks.STORE_FILE)
+
+# Every NetworkManager call goes through this; main() swaps in the D-Bus
+# backend when python3-dbus is available (see nm_backend.py).
+backend = nm_backend.NmcliBackend(WIFI_IFACE)
+
+# Scans and connects both take the radio away from the hotspot; only one
+# may run at a time.
+radio_lock = threading.Lock()
+
 
 # ---------------------------------------------------------------------------
 # WiFi helpers
 # ---------------------------------------------------------------------------
 
-def run(cmd):
-    """Run a shell command and return (returncode, stdout)."""
-    r = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    return r.returncode, r.stdout.strip()
-
-
 def wifi_is_connected():
     """Return True if the WiFi interface has an active connection."""
-    rc, out = run(f"nmcli -t -f DEVICE,STATE device | grep '^{WIFI_IFACE}:'")
-    return ":connected" in out
+    return backend.device_state() == "connected"
+
+
+def nothing_left_to_try(failed_attempts, saved=None):
+    """True once NetworkManager has tried (and failed) every saved profile
+    that is in range, so waiting any longer cannot connect us.
+
+    saved: the saved SSIDs if the caller already read them after
+    NetworkManager finished starting up; otherwise they are read here.
+    """
+    if saved is None:
+        if not backend.startup_complete():
+            return False  # still autoconnecting
+        saved = backend.saved_wifi_ssids()
+    saved = set(saved)
+    if not saved:
+        return True
+    visible = {ap["ssid"] for ap in backend.access_points()}
+    if not visible:
+        return False  # no scan results yet
+    return failed_attempts >= len(saved & visible)
 
 
 def wait_for_wifi(timeout=WAIT_TIMEOUT):
-    """Poll every 2s for up to timeout seconds. Return True if connected."""
-    elapsed = 0
-    while elapsed < timeout:
-        if wifi_is_connected():
+    """Wait for the interface to connect. Return True if it did.
+
+    Follows the device's state changes instead of polling, so it returns
+    the moment the interface is connected, and gives up before timeout
+    once NetworkManager has nothing left to try (nothing_left_to_try() is
+    re-checked on every change, and every GIVE_UP_RECHECK seconds for
+    scan results that arrive without one).
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    watch = backend.watch_device()
+    # the saved profiles do not change while we wait: read them once (with
+    # nmcli that is a process per profile), after NM's startup loaded them
+    saved = None
+    try:
+        state = backend.device_state()
+        failed = 0
+        while True:
+            if state == "connected":
+                decision = "connected"
+                break
+            if state in ("disconnected", "failed"):
+                if saved is None and backend.startup_complete():
+                    saved = backend.saved_wifi_ssids()
+                if saved is not None and nothing_left_to_try(failed, saved):
+                    decision = f"no saved network to connect to ({failed} failed attempt(s))"
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                decision = f"timed out after {timeout} s"
+                break
+            new = watch.wait(min(remaining, GIVE_UP_RECHECK))
+            if new is None:
+                continue
+            if state == "connecting" and new in ("disconnected", "failed"):
+                failed += 1
+            state = new
+    finally:
+        watch.close()
+    boottrace.instant("wifi decision", decision=decision)
+    print(f"[wifi_setup] decision after {time.monotonic() - start:.2f} s "
+          f"({time.clock_gettime(time.CLOCK_BOOTTIME):.1f} s since boot): {decision}")
+    return state == "connected"
+
+
+def wait_until(ready, timeout, first=0.1, longest=1.0):
+    """Call ready() with exponential backoff until it returns something
+    truthy or timeout seconds have passed. Returns its last result."""
+    deadline = time.monotonic() + timeout
+    delay = first
+    while True:
+        result = ready()
+        remaining = deadline - time.monotonic()
+        if result or remaining <= 0:
+            return result
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, longest)
+
+
+def wait_radio_free(timeout=5):
+    """Wait until the hotspot has let go of the radio."""
+    return wait_until(lambda: backend.device_state() != "connected", timeout)
+
+
+def save_known():
+    try:
+        known.save()
+    except OSError as e:
+        print(f"[wifi_setup] cannot save {known.path}: {e}", file=sys.stderr)
+
+
+def fast_reconnect():
+    """Try the best-ranked saved networks in range ourselves (at most
+    FAST_RECONNECT_TRIES). Return True once one of them is up."""
+    saved = backend.saved_wifi_profiles()
+    visible = {}
+    for n in cached_networks:
+        visible[n["ssid"]] = int(n["signal"])
+    for ssid in known.ranked(visible, saved)[:FAST_RECONNECT_TRIES]:
+        print(f"[wifi_setup] trying known network '{ssid}'...")
+        announce("connecting", ssid=ssid)
+        start = time.monotonic()
+        ok, out = backend.activate_saved(saved[ssid], FAST_RECONNECT_TIMEOUT)
+        join_s = time.monotonic() - start
+        known.record_attempt(ssid, ok, join_s if ok else None)
+        save_known()
+        print(f"[wifi_setup] '{ssid}': {'joined' if ok else 'failed'} "
+              f"after {join_s:.2f} s{'' if ok else ': ' + out}")
+        if ok:
+            announce("idle")
             return True
-        time.sleep(2)
-        elapsed += 2
     return False
 
 
-def start_hotspot():
-    """Create a WiFi hotspot using NetworkManager."""
-    # Delete any stale hotspot connection
-    run(f"nmcli connection delete '{HOTSPOT_CON_NAME}' 2>/dev/null")
-    rc, out = run(
-        f"nmcli device wifi hotspot ifname {WIFI_IFACE} "
-        f"con-name '{HOTSPOT_CON_NAME}' "
-        f"ssid {HOTSPOT_SSID} password {HOTSPOT_PASS}"
-    )
-    if rc != 0:
+def announce(state, **fields):
+    """Tell the OLED what the portal is doing (see portal_state.py)."""
+    portal_state.announce(state, FLAG_FILE, PORTAL_SOCKET, **fields)
+
+
+def start_hotspot(state="hotspot", **fields):
+    """Create a WiFi hotspot using NetworkManager.
+
+    Once it is up, the portal state `state` is announced with the hotspot
+    details added to `fields`.
+    """
+    # The backend deletes any stale hotspot connection first
+    ok, out = backend.start_hotspot(HOTSPOT_CON_NAME, HOTSPOT_SSID, HOTSPOT_PASS)
+    if not ok:
         print(f"[wifi_setup] hotspot failed: {out}", file=sys.stderr)
         return False
     # Signal OLED to show setup instructions
-    with open(FLAG_FILE, "w") as f:
-        f.write(HOTSPOT_IP)
+    announce(state, ip=HOTSPOT_IP, ssid=HOTSPOT_SSID, password=HOTSPOT_PASS, **fields)
     print(f"[wifi_setup] hotspot '{HOTSPOT_SSID}' active on {HOTSPOT_IP}")
     return True
 
 
 def stop_hotspot():
-    """Tear down the hotspot connection."""
-    # Remove OLED flag
-    try:
-        os.remove(FLAG_FILE)
-    except FileNotFoundError:
-        pass
-    run(f"nmcli connection down '{HOTSPOT_CON_NAME}' 2>/dev/null")
-    run(f"nmcli connection delete '{HOTSPOT_CON_NAME}' 2>/dev/null")
+    """Tear down the hotspot connection (the caller announces what is next)."""
+    backend.stop_hotspot(HOTSPOT_CON_NAME)
+
+
+def list_access_points():
+    """Return the radio's current scan list as [{bssid, ssid, signal, security}]."""
+    return [ap for ap in backend.access_points()
+            if ap["ssid"] and ap["ssid"] != HOTSPOT_SSID]
+
+
+class ScanCache:
+    """Scan results per BSSID, merged scan after scan.
+
+    An access point keeps its last reading until it has not been seen for
+    SCAN_EXPIRE seconds, so one scan that misses a weak AP does not make it
+    vanish from the list.
+    """
+
+    def __init__(self, ttl=SCAN_TTL, expire=SCAN_EXPIRE):
+        self.ttl = ttl
+        self.expire = expire
+        self.access_points = {}
+        self.updated = None
+        # whether the driver can scan while the hotspot is up (None: untried)
+        self.ap_scan = None
+        self.ap_scan_empty = 0
+        self.__lock = threading.Lock()
+
+    def merge(self, aps, now=None):
+        now = time.monotonic() if now is None else now
+        with self.__lock:
+            for ap in aps:
+                self.access_points[ap["bssid"]] = dict(ap, seen=now)
+            for bssid, ap in list(self.access_points.items()):
+                if now - ap["seen"] > self.expire:
+                    del self.access_points[bssid]
+            self.updated = now
+
+    def age(self, now=None):
+        if self.updated is None:
+            return None
+        return (time.monotonic() if now is None else now) - self.updated
+
+    def stale(self, now=None):
+        age = self.age(now)
+        return age is None or age > self.ttl
+
+    def networks(self):
+        """Strongest reading per SSID, strongest first (the portal's format)."""
+        best = {}
+        with self.__lock:
+            for ap in self.access_points.values():
+                if ap["ssid"] not in best or ap["signal"] > best[ap["ssid"]]["signal"]:
+                    best[ap["ssid"]] = ap
+        return [{"ssid": ap["ssid"], "signal": str(ap["signal"]), "security": ap["security"]}
+                for ap in sorted(best.values(), key=lambda ap: ap["signal"], reverse=True)]
+
+
+scan_cache = ScanCache()
 
 
 def scan_networks():
     """Scan for WiFi networks. Must be called when NOT in AP/hotspot mode."""
     global cached_networks
-    run(f"nmcli device wifi rescan ifname {WIFI_IFACE} 2>/dev/null")
+    backend.request_scan()
     time.sleep(2)
-    _, out = run("nmcli -t -f SSID,SIGNAL,SECURITY device wifi list")
-    networks = {}
-    for line in out.splitlines():
-        parts = line.split(":")
-        if len(parts) < 3:
-            continue
-        ssid = parts[0].strip()
-        if not ssid or ssid == HOTSPOT_SSID:
-            continue
-        signal = parts[1].strip()
-        security = parts[2].strip()
-        # Keep the strongest signal per SSID
-        if ssid not in networks or int(signal) > int(networks[ssid]["signal"]):
-            networks[ssid] = {"ssid": ssid, "signal": signal, "security": security}
-    # Sort by signal strength descending
-    cached_networks = sorted(networks.values(), key=lambda n: int(n["signal"]), reverse=True)
+    aps = list_access_points()
+    scan_cache.merge(aps)
+    cached_networks = scan_cache.networks()
+    known.record_scan(aps)
+    save_known()
+    return cached_networks
+
+
+class SingleFlight:
+    """Run a call once for all callers that ask while it is in flight."""
+
+    def __init__(self, fn):
+        self.__fn = fn
+        self.__lock = threading.Lock()
+        self.__flight = None
+        self.calls = 0
+
+    @property
+    def in_flight(self):
+        return self.__flight is not None
+
+    def start(self):
+        """Start a call in the background unless one is already in flight."""
+        if not self.in_flight:
+            threading.Thread(target=self.__background, daemon=True).start()
+
+    def __background(self):
+        try:
+            self()
+        except Exception as e:
+            print(f"[wifi_setup] background call failed: {e}", file=sys.stderr)
+
+    def __call__(self):
+        with self.__lock:
+            flight = self.__flight
+            leader = flight is None
+            if leader:
+                flight = self.__flight = {"done": threading.Event()}
+        if not leader:
+            flight["done"].wait()
+            if "error" in flight:
+                raise flight["error"]
+            return flight["result"]
+        try:
+            self.calls += 1
+            flight["result"] = self.__fn()
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self.__lock:
+                self.__flight = None
+            flight["done"].set()
+        return flight["result"]
+
+
+def scan_in_ap_mode():
+    """Scan without dropping the hotspot. Returns the networks, [] if the
+    scan came back empty, or None if the driver refused to scan while it
+    is an access point."""
+    global cached_networks
+    if not backend.request_scan():
+        return None
+    for _ in range(1 + AP_SCAN_RETRIES):
+        time.sleep(2)
+        aps = list_access_points()
+        if aps:
+            break
+    if not aps:
+        # no networks around, results not in yet, or a driver that only
+        # reports its own AP: rescan_networks() tells them apart
+        return []
+    scan_cache.merge(aps)
+    cached_networks = scan_cache.networks()
+    known.record_scan(aps)
+    save_known()
     return cached_networks
 
 
 def rescan_networks():
-    """Stop hotspot, scan, restart hotspot. Returns updated network list."""
-    print("[wifi_setup] rescan: stopping hotspot temporarily...")
-    stop_hotspot()
-    time.sleep(2)
-    results = scan_networks()
-    print(f"[wifi_setup] rescan: found {len(results)} networks, restarting hotspot...")
-    start_hotspot()
-    time.sleep(2)
-    return results
+    """Refresh the scan cache, keeping the hotspot up if the driver can
+    scan in AP mode; otherwise stop hotspot, scan, restart hotspot.
+    Returns the updated network list."""
+    with radio_lock, boottrace.span("rescan"):
+        ap_empty = False
+        if scan_cache.ap_scan is not False:
+            results = scan_in_ap_mode()
+            if results:
+                scan_cache.ap_scan_empty = 0
+                if scan_cache.ap_scan is None:
+                    scan_cache.ap_scan = True
+                    print("[wifi_setup] scanning in AP mode works")
+                return results
+            if results is None:
+                scan_cache.ap_scan = False
+                print("[wifi_setup] scanning in AP mode is not supported")
+            ap_empty = results == []
+        print("[wifi_setup] rescan: stopping hotspot temporarily...")
+        announce("scanning")
+        stop_hotspot()
+        wait_radio_free()
+        results = scan_networks()
+        if ap_empty and results:
+            # the AP-mode scan missed networks that are there; after a few
+            # of those in a row, stop trying it
+            scan_cache.ap_scan_empty += 1
+            if scan_cache.ap_scan_empty >= AP_SCAN_EMPTY_LIMIT:
+                scan_cache.ap_scan = False
+                print("[wifi_setup] scanning in AP mode is not supported "
+                      "(it only sees the hotspot)")
+        print(f"[wifi_setup] rescan: found {len(results)} networks, restarting hotspot...")
+        start_hotspot()
+        return results
+
 
+# /scan refreshes in the background; concurrent requests share one rescan.
+shared_rescan = SingleFlight(rescan_networks)
 
-def connect_wifi(ssid, password):
-    """Stop hotspot and connect to the given WiFi network. Return (ok, msg)."""
+
+def connect_wifi(ssid, password, progress=None):
+    """Stop hotspot and connect to the given WiFi network. Return (ok, msg).
+
+    progress(phase, message), if given, is called as the attempt moves on.
+    """
+    progress = progress or (lambda phase, message: None)
+    with radio_lock:
+        return _connect_wifi(ssid, password, progress)
+
+
+def _connect_wifi(ssid, password, progress):
+    announce("connecting", ssid=ssid)
+    progress("stopping_hotspot", "Stopping the setup hotspot...")
     stop_hotspot()
-    time.sleep(2)
-    rc, out = run(
-        f'nmcli device wifi connect "{ssid}" password "{password}" ifname {WIFI_IFACE}'
-    )
-    if rc == 0:
-        # Wait a moment for IP assignment
-        time.sleep(3)
-        _, ip_out = run(
-            f"nmcli -t -f IP4.ADDRESS device show {WIFI_IFACE} | head -1"
-        )
-        ip = ip_out.split(":")[-1].split("/")[0] if ip_out else "unknown"
+    wait_radio_free()
+    progress("joining", f"Joining {ssid}...")
+    start = time.monotonic()
+    ok, out = backend.connect(ssid, password)
+    if ok:
+        progress("waiting_for_ip", f"Joined {ssid}, waiting for an IP address...")
+        ip = wait_until(backend.ip4_address, IP_TIMEOUT) or "unknown"
+        known.record_attempt(ssid, True, time.monotonic() - start)
+        save_known()
+        announce("idle")
         return True, f"Connected to {ssid} — IP: {ip}"
     else:
         # Reconnect hotspot so user can retry
-        start_hotspot()
+        detail = out.splitlines()[-1] if out else "wrong password?"
+        known.record_attempt(ssid, False)
+        save_known()
+        progress("restarting_hotspot", "Could not join, restarting the setup hotspot...")
+        start_hotspot("failed", connect_ssid=ssid, detail=detail)
         return False, f"Failed to connect: {out}"
 
 
+class ConnectJob:
+    """One connect attempt, run on its own thread.
+
+    Every phase is kept, so any number of clients can follow the job and a
+    client that lost the hotspot mid-way catches up from where it left off.
+    """
+
+    __ids = itertools.count(1)
+
+    def __init__(self, ssid):
+        self.id = "%d-%d" % (next(ConnectJob.__ids), int(time.time()))
+        self.ssid = ssid
+        self.events = []
+        self.done = False
+        self.ok = None
+        self.finished_at = None
+        self.__cond = threading.Condition()
+        self.__start = time.monotonic()
+
+    def progress(self, phase, message, **fields):
+        with self.__cond:
+            self.events.append(dict(fields, phase=phase, message=message,
+                                    t=round(time.monotonic() - self.__start, 3)))
+            self.__cond.notify_all()
+
+    def finish(self, ok, message):
+        self.ok = ok
+        self.progress("connected" if ok else "failed", message, done=True, ok=ok)
+        self.finished_at = time.monotonic()
+        self.done = True
+
+    def wait_events(self, after, timeout):
+        """Events after the first `after`, waiting up to timeout for one."""
+        with self.__cond:
+            self.__cond.wait_for(lambda: len(self.events) > after, timeout)
+            return self.events[after:]
+
+    def run(self, password, on_done=None):
+        self.progress("queued", f"Connecting to {self.ssid}...")
+        try:
+            with boottrace.span("connect", job=self.id):
+                ok, message = connect_wifi(self.ssid, password, self.progress)
+        except Exception as e:
+            ok, message = False, f"Failed to connect: {e}"
+        self.finish(ok, message)
+        boottrace.flush()
+        if on_done:
+            on_done(self)
+
+
+jobs = {}
+
+
+def prune_jobs(ttl=JOB_TTL, now=None):
+    """Forget jobs that finished more than ttl seconds ago. Until then a
+    client that lost the hotspot can still reconnect and read the outcome."""
+    now = time.monotonic() if now is None else now
+    for job_id, job in list(jobs.items()):
+        if job.finished_at is not None and now - job.finished_at > ttl:
+            jobs.pop(job_id, None)
+
+
+def start_connect(ssid, password, on_done=None):
+    """Start a ConnectJob in the background and return it."""
+    prune_jobs()
+    job = ConnectJob(ssid)
+    jobs[job.id] = job
+    threading.Thread(target=job.run, args=(password, on_done), daemon=True).start()
+    return job
+
+
 # ---------------------------------------------------------------------------
 # HTML template
 # ---------------------------------------------------------------------------
@@ -178,7 +536,7 @@ HTML_PAGE = """\
   <form id="form" method="POST" action="/connect">
     <label for="ssid">Network</label>
     <select name="ssid" id="ssid">
-      {options}
+      <option value="">Loading networks...</option>
     </select>
     <div class="net-info" id="net-info"></div>
     <label for="password">Password</label>
@@ -186,11 +544,11 @@ HTML_PAGE = """\
     <label style="display:flex;align-items:center;gap:.4rem;margin-top:-.5rem;margin-bottom:1rem;cursor:pointer"><input type="checkbox" id="show-pass" style="width:auto;margin:0"> Show password</label>
     <button type="submit" class="btn-primary" id="submit-btn">Connect</button>
   </form>
-  <button class="btn-secondary" onclick="rescan()">Rescan Networks</button>
+  <button class="btn-secondary" onclick="rescan(this)">Rescan Networks</button>
   <div id="status"></div>
 </div>
 <script>
-const nets = {networks_json};
+const nets = {};
 const sel = document.getElementById('ssid');
 const info = document.getElementById('net-info');
 function updateInfo() {
@@ -198,7 +556,20 @@ function updateInfo() {
   if (n) info.textContent = 'Signal: ' + n.signal + '%  |  Security: ' + n.security;
 }
 sel.addEventListener('change', updateInfo);
-updateInfo();
+function fill(data) {
+  const chosen = sel.value;
+  sel.innerHTML = '';
+  Object.keys(nets).forEach(k => delete nets[k]);
+  data.forEach(n => {
+    nets[n.ssid] = n;
+    const o = document.createElement('option');
+    o.value = n.ssid; o.textContent = n.ssid + ' (' + n.signal + '%)';
+    sel.appendChild(o);
+  });
+  if (nets[chosen]) sel.value = chosen;
+  updateInfo();
+}
+fetch('/networks').then(r => r.json()).then(fill).catch(() => {});
 document.getElementById('show-pass').addEventListener('change', function() {
   document.getElementById('password').type = this.checked ? 'text' : 'password';
 });
@@ -215,31 +586,52 @@ document.getElementById('form').addEventListener('submit', function(e) {
     headers: {'Content-Type': 'application/x-www-form-urlencoded'},
     body: 'ssid=' + encodeURIComponent(sel.value) + '&password=' + encodeURIComponent(document.getElementById('password').value)
   }).then(r => r.json()).then(d => {
-    st.textContent = d.message;
-    st.className = d.ok ? 'success' : 'error';
-    btn.disabled = false;
-    btn.textContent = 'Connect';
-  }).catch(() => {
-    st.textContent = 'Connection lost — if the Jetson connected successfully, check the OLED for its new IP.';
-    st.className = 'success';
+    if (!d.ok) { finish(d.ok, d.message); return; }
+    follow(d.job, d.deadline, sel.value);
+  }).catch(() => finish(false, 'Could not reach the Jetson. Reconnect to JetsonSetup and try again.'));
+
+  function finish(ok, message) {
+    st.textContent = message;
+    st.className = ok ? 'success' : 'error';
     btn.disabled = false;
     btn.textContent = 'Connect';
-  });
+  }
+
+  // The hotspot goes down while the Jetson tries the network. EventSource
+  // reconnects by itself and resumes from the last phase it saw; if the
+  // hotspot is not back within the deadline, the Jetson has joined.
+  function follow(job, deadline, ssid) {
+    const es = new EventSource('/connect/' + encodeURIComponent(job) + '/events');
+    let lost = null;
+    es.addEventListener('phase', ev => {
+      const p = JSON.parse(ev.data);
+      lost = null;
+      btn.innerHTML = '<span class="spinner"></span>' + p.message.replace(/</g, '&lt;');
+      if (p.done) { es.close(); finish(p.ok, p.message); }
+    });
+    es.onerror = () => {
+      if (lost === null) {
+        lost = Date.now();
+        btn.innerHTML = '<span class="spinner"></span>Hotspot down while joining ' + ssid.replace(/</g, '&lt;') + '...';
+      } else if (Date.now() - lost > deadline * 1000) {
+        es.close();
+        finish(true, 'The Jetson joined ' + ssid + ' (the setup hotspot did not come back). Check the OLED for its new IP.');
+      }
+    };
+  }
 });
 
-function rescan() {
-  const btn = event.target;
+function rescan(btn, retries) {
+  if (retries === undefined) retries = 3;
   btn.disabled = true; btn.textContent = 'Scanning...';
-  fetch('/scan').then(r => r.json()).then(data => {
-    sel.innerHTML = '';
-    Object.keys(nets).forEach(k => delete nets[k]);
-    data.forEach(n => {
-      nets[n.ssid] = n;
-      const o = document.createElement('option');
-      o.value = n.ssid; o.textContent = n.ssid + ' (' + n.signal + '%)';
-      sel.appendChild(o);
-    });
-    updateInfo();
+  let refreshing = false;
+  fetch('/scan').then(r => {
+    refreshing = r.headers.get('X-Scan-Refreshing') === '1';
+    return r.json();
+  }).then(data => {
+    fill(data);
+    // results were cached; fetch again once the background scan is done
+    if (refreshing && retries > 0) { setTimeout(() => rescan(btn, retries - 1), 3000); return; }
     btn.disabled = false; btn.textContent = 'Rescan Networks';
   }).catch(() => { btn.disabled = false; btn.textContent = 'Rescan Networks'; });
 }
@@ -253,18 +645,83 @@ function rescan() {
 # Web server
 # ---------------------------------------------------------------------------
 
-class WifiHandler(BaseHTTPRequestHandler):
-    server_should_stop = False
-    connected_ok = False
+# Where phones and laptops look for a captive portal. Anything that is not
+# ours gets a small redirect to the portal, which is how they recognise one.
+PORTAL_URL = f"http://{HOTSPOT_IP}/"
+
+
+class Asset:
+    """A response body prepared once: gzip-compressed and with an ETag, so a
+    repeat load over the hotspot is a 304 with no body."""
+
+    def __init__(self, body, content_type, cache_control="no-cache"):
+        self.body = body
+        self.gzipped = gzip.compress(body, 9, mtime=0)
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        self.content_type = content_type
+        self.cache_control = cache_control
 
+    def send(self, handler, headers=()):
+        """Answer handler's request with this asset plus extra `headers`."""
+        tags = [t.strip() for t in handler.headers.get("If-None-Match", "").split(",")]
+        if self.etag in tags or "W/" + self.etag in tags:
+            handler.send_response(304)
+            body, encoding = b"", None
+        else:
+            handler.send_response(200)
+            gzip_ok = "gzip" in handler.headers.get("Accept-Encoding", "")
+            if gzip_ok and len(self.gzipped) < len(self.body):
+                body, encoding = self.gzipped, "gzip"
+            else:
+                body, encoding = self.body, None
+            handler.send_header("Content-Type", self.content_type)
+            handler.send_header("Content-Length", str(len(body)))
+            if encoding:
+                handler.send_header("Content-Encoding", encoding)
+        handler.send_header("ETag", self.etag)
+        handler.send_header("Cache-Control", self.cache_control)
+        handler.send_header("Vary", "Accept-Encoding")
+        for name, value in headers:
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+INDEX = Asset(HTML_PAGE.encode(), "text/html; charset=utf-8")
+
+_networks_asset = (None, None)
+
+
+def networks_asset():
+    """cached_networks as a JSON Asset, rebuilt only after a scan."""
+    global _networks_asset
+    networks = cached_networks
+    if _networks_asset[0] is not networks:
+        _networks_asset = (networks, Asset(json.dumps(networks).encode(), "application/json"))
+    return _networks_asset[1]
+
+
+class WifiHandler(BaseHTTPRequestHandler):
     def log_message(self, fmt, *args):
         print(f"[wifi_setup] {args[0]}")
 
     def do_GET(self):
-        if self.path == "/scan":
+        path = self.path.split("?", 1)[0]
+        if path == "/":
+            INDEX.send(self)
+        elif path == "/networks":
+            networks_asset().send(self)
+        elif path == "/scan":
             self._handle_scan()
+        elif path.startswith("/connect/") and path.endswith("/events"):
+            self._handle_events(path[len("/connect/"):-len("/events")])
+        elif path == "/favicon.ico":
+            self.send_response(204)
+            self.send_header("Cache-Control", "max-age=86400")
+            self.end_headers()
         else:
-            self._handle_index()
+            # /generate_204, /hotspot-detect.html, /connecttest.txt, ...
+            self._redirect_to_portal()
 
     def do_POST(self):
         if self.path == "/connect":
@@ -272,25 +729,22 @@ class WifiHandler(BaseHTTPRequestHandler):
         else:
             self.send_error(404)
 
-    def _handle_index(self):
-        networks = cached_networks
-        options = "\n".join(
-            f'<option value="{n["ssid"]}">{n["ssid"]} ({n["signal"]}%)</option>'
-            for n in networks
-        )
-        nets_json = json.dumps({n["ssid"]: n for n in networks})
-        html = HTML_PAGE.replace("{options}", options).replace("{networks_json}", nets_json)
-        self.send_response(200)
-        self.send_header("Content-Type", "text/html")
+    def _redirect_to_portal(self):
+        self.send_response(302)
+        self.send_header("Location", PORTAL_URL)
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Content-Length", "0")
         self.end_headers()
-        self.wfile.write(html.encode())
 
     def _handle_scan(self):
-        networks = rescan_networks()
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(networks).encode())
+        # stale-while-revalidate: answer from the cache right away and let a
+        # background rescan bring it up to date for the next request
+        if scan_cache.stale():
+            shared_rescan.start()
+        age = scan_cache.age()
+        networks_asset().send(self, [
+            ("X-Scan-Age", "%d" % (age or 0)),
+            ("X-Scan-Refreshing", "1" if shared_rescan.in_flight else "0")])
 
     def _handle_connect(self):
         length = int(self.headers.get("Content-Length", 0))
@@ -304,47 +758,139 @@ class WifiHandler(BaseHTTPRequestHandler):
             return
 
         print(f"[wifi_setup] connecting to '{ssid}'...")
-        ok, msg = connect_wifi(ssid, password)
-        self._json_response(ok, msg)
-
-        if ok:
-            WifiHandler.connected_ok = True
-            WifiHandler.server_should_stop = True
-
-    def _json_response(self, ok, message):
-        data = json.dumps({"ok": ok, "message": message})
+        server = self.server
+
+        def on_done(job):
+            print(f"[wifi_setup] connect job {job.id}: {job.events[-1]['message']}")
+            if job.ok:
+                server.request_stop(connected=True)
+
+        # answer before the hotspot goes down; the page follows the job
+        job = start_connect(ssid, password, on_done)
+        self._json_response(True, f"Connecting to {ssid}...", job=job.id,
+                            deadline=CONNECT_DEADLINE)
+
+    def _handle_events(self, job_id):
+        """Server-Sent Events: one "phase" event per ConnectJob phase.
+
+        Event ids count the phases, so EventSource's automatic reconnect
+        (Last-Event-ID) resumes where the client left off.
+        """
+        prune_jobs()
+        job = jobs.get(job_id)
+        if job is None:
+            self.send_error(404)
+            return
+        try:
+            sent = min(max(0, int(self.headers.get("Last-Event-ID", "0"))), len(job.events))
+        except ValueError:
+            sent = 0
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            self.wfile.write(b"retry: 2000\n\n")
+            self.wfile.flush()
+            while True:
+                events = job.wait_events(sent, timeout=15)
+                if not events:
+                    if job.done:
+                        return  # the client already has the outcome
+                    self.wfile.write(b": keep-alive\n\n")
+                for event in events:
+                    sent += 1
+                    self.wfile.write(b"id: %d\nevent: phase\ndata: %s\n\n"
+                                     % (sent, json.dumps(event).encode()))
+                self.wfile.flush()
+                if events and events[-1].get("done"):
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the hotspot went down under the client
+
+    def _json_response(self, ok, message, **fields):
+        data = json.dumps(dict(fields, ok=ok, message=message))
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
         self.end_headers()
         self.wfile.write(data.encode())
 
 
-class StoppableHTTPServer(HTTPServer):
-    def service_actions(self):
-        if WifiHandler.server_should_stop:
-            raise KeyboardInterrupt
+class StoppableHTTPServer(ThreadingHTTPServer):
+    """One thread per request, so a slow /scan or /connect does not hold up
+    page loads and captive-portal probes. request_stop() ends serve_forever()
+    from any thread or signal handler."""
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connected_ok = False
+        self.stopping = threading.Event()
+
+    def request_stop(self, connected=False):
+        if connected:
+            self.connected_ok = True
+        if not self.stopping.is_set():
+            self.stopping.set()
+            # shutdown() waits for serve_forever() to return, so it must not
+            # run on the thread serving (or in a signal handler on it)
+            threading.Thread(target=self.shutdown, daemon=True).start()
 
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
-def main():
+def boot_connect(timeout=WAIT_TIMEOUT):
+    """Get on a network without the user: let NetworkManager autoconnect,
+    then try the best known networks in range. Return True if connected."""
     print("[wifi_setup] waiting for WiFi connection...")
-    if wait_for_wifi():
-        print("[wifi_setup] WiFi already connected. Exiting.")
-        return
+    with boottrace.span("wait_for_wifi", timeout=timeout):
+        connected = wait_for_wifi(timeout)
+    if connected:
+        ssid = backend.active_ssid()
+        if ssid:
+            known.record_attempt(ssid, True)
+            save_known()
+        print("[wifi_setup] WiFi already connected.")
+        return True
 
     print("[wifi_setup] no WiFi connection. Scanning for networks...")
-    scan_networks()
-    print(f"[wifi_setup] found {len(cached_networks)} networks. Starting hotspot...")
-    if not start_hotspot():
+    announce("scanning")
+    with boottrace.span("scan"):
+        scan_networks()
+    print(f"[wifi_setup] found {len(cached_networks)} networks.")
+    with boottrace.span("fast_reconnect"):
+        return fast_reconnect()
+
+
+def main():
+    global backend
+    boottrace.start("wifi_setup")
+    isolated = isolation.isolate()
+    if isolated is not None:
+        print(f"[wifi_setup] isolation: {isolated}")
+    with boottrace.span("open_backend"):
+        backend = nm_backend.open_backend(WIFI_IFACE)
+    print(f"[wifi_setup] using the {backend.name} backend")
+    if boot_connect():
+        print("[wifi_setup] connected. Exiting.")
+        return
+
+    print("[wifi_setup] starting hotspot...")
+    with boottrace.span("start_hotspot"):
+        hotspot_ok = start_hotspot()
+    if not hotspot_ok:
+        announce("idle")
         print("[wifi_setup] failed to start hotspot. Exiting.", file=sys.stderr)
         sys.exit(1)
 
-    time.sleep(2)
     print(f"[wifi_setup] starting web server on {HOTSPOT_IP}:{WEB_PORT}")
-    server = StoppableHTTPServer(("0.0.0.0", WEB_PORT), WifiHandler)
+    with boottrace.span("bind_web_server", port=WEB_PORT):
+        server = StoppableHTTPServer(("0.0.0.0", WEB_PORT), WifiHandler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.request_stop())
+    boottrace.instant("portal serving")
+    boottrace.flush()
 
     try:
         server.serve_forever(poll_interval=0.5)
@@ -353,10 +899,11 @@ def main():
     finally:
         server.server_close()
 
-    if WifiHandler.connected_ok:
+    if server.connected_ok:
         print("[wifi_setup] WiFi configured successfully. Shutting down.")
     else:
         stop_hotspot()
+        announce("idle")
         print("[wifi_setup] shutting down without connecting.")
 
 
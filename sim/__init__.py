@@ -0,0 +1 @@
+"""Fake hardware and system stand-ins for running the scripts off-device."""
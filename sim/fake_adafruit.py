@@ -0,0 +1,38 @@
+"""Stand-in for the Adafruit_SSD1306 package.
+
+install() registers this module as `Adafruit_SSD1306`, so `import
+Adafruit_SSD1306 as SSD` in oled.py gets an SSD1306_128_32 whose `_i2c` is a
+FakeSSD1306. Every display created is kept in DISPLAYS.
+"""
+
+import sys
+
+from sim.fake_i2c import FakeSSD1306
+
+DISPLAYS = []
+
+
+class SSD1306_128_32:
+    width = 128
+    height = 32
+
+    def __init__(self, rst=None, i2c_bus=None, gpio=None, **kwargs):
+        self.i2c_bus = i2c_bus
+        self._i2c = FakeSSD1306(self.width, self.height)
+        DISPLAYS.append(self)
+
+    def begin(self):
+        # display off, horizontal addressing, display on
+        self._i2c.writeList(0x00, [0xAE, 0x20, 0x00, 0xAF])
+
+    def clear(self):
+        pass
+
+    def display(self):
+        self._i2c.writeList(0x00, [0x21, 0, self.width - 1, 0x22, 0, self.height // 8 - 1])
+        for i in range(0, len(self._i2c.ram), 16):
+            self._i2c.writeList(0x40, bytes(16))
+
+
+def install():
+    sys.modules["Adafruit_SSD1306"] = sys.modules[__name__]
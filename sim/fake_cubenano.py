@@ -0,0 +1,59 @@
+"""Stand-in for the CubeNanoLib package (the CUBE case's fan/RGB controller).
+
+install() registers this module as `CubeNanoLib`, so `from CubeNanoLib
+import CubeNano` in rgb_blue.py gets a CubeNano that records every call in
+`calls` instead of writing to I2C. Every instance is kept in BOTS.
+write_s is how long each register write takes; the next `failures`
+writes raise OSError, like a NACK on the bus.
+"""
+
+import sys
+import time
+
+BOTS = []
+
+
+class CubeNano:
+    def __init__(self, i2c_bus=7, write_s=0.0):
+        self.i2c_bus = i2c_bus
+        self.write_s = write_s
+        self.failures = 0
+        self.calls = []
+        self.fan = None
+        self.rgb = {}
+        BOTS.append(self)
+
+    def set_Fan(self, state):
+        self.__write()
+        self.calls.append(("set_Fan", state))
+        self.fan = state
+
+    def set_RGB_Effect(self, effect):
+        self.__write()
+        self.calls.append(("set_RGB_Effect", effect))
+        self.rgb["effect"] = effect
+
+    def set_RGB_Color(self, color):
+        self.__write()
+        self.calls.append(("set_RGB_Color", color))
+        self.rgb["color"] = color
+
+    def set_RGB_Speed(self, speed):
+        self.__write()
+        self.calls.append(("set_RGB_Speed", speed))
+        self.rgb["speed"] = speed
+
+    def get_Version(self):
+        self.__write()
+        return 1
+
+    def __write(self):
+        if self.failures:
+            self.failures -= 1
+            raise OSError(121, "Remote I/O error")
+        if self.write_s:
+            time.sleep(self.write_s)
+
+
+def install():
+    sys.modules["CubeNanoLib"] = sys.modules[__name__]
@@ -0,0 +1,124 @@
+"""Fake SSD1306 on a fake I2C bus.
+
+FakeSSD1306 implements the write8/writeList interface of
+Adafruit_GPIO.I2C.Device, records every transfer and decodes the command
+stream well enough to keep an emulated GDDRAM, so a test can check that what
+the driver sent really produces the intended picture.
+
+byte_s makes every transfer take as long as it would on the wire (about
+22.5 us per byte at 400 kHz).
+
+FakeI2CBuses stands in for the /dev/i2c-* probing of i2c_probe, with
+per-bus devices and probe delays.
+"""
+
+import time
+
+# Commands that are followed by argument bytes (horizontal addressing mode).
+_COMMAND_ARGS = {
+    0x20: 1,  # memory addressing mode
+    0x21: 2,  # column address window
+    0x22: 2,  # page address window
+    0x81: 1,  # contrast
+    0x8D: 1,  # charge pump
+    0xA8: 1,  # multiplex ratio
+    0xD3: 1,  # display offset
+    0xD5: 1,  # clock divide
+    0xD9: 1,  # pre-charge
+    0xDA: 1,  # COM pins
+    0xDB: 1,  # VCOMH deselect
+}
+
+
+class FakeSSD1306:
+    def __init__(self, width=128, height=32, byte_s=0.0):
+        self.width = width
+        self.byte_s = byte_s
+        self.pages = height // 8
+        self.ram = bytearray(width * self.pages)
+        self.transfers = []
+        self.bytes_written = 0
+
+        self.__col_start, self.__col_end = 0, width - 1
+        self.__page_start, self.__page_end = 0, self.pages - 1
+        self.__col, self.__page = 0, 0
+        self.__pending = []
+
+    # -- Adafruit_GPIO.I2C.Device interface --------------------------------
+
+    def write8(self, register, value):
+        self.writeList(register, [value])
+
+    def writeList(self, register, data):
+        data = bytes(data)
+        self.transfers.append((register, data))
+        self.bytes_written += 1 + len(data)
+        if self.byte_s:
+            # address byte + register + data
+            time.sleep((2 + len(data)) * self.byte_s)
+        if register & 0x40:
+            for b in data:
+                self.__data(b)
+        else:
+            for b in data:
+                self.__command(b)
+
+    # -- helpers -------------------------------------------------------------
+
+    def reset_stats(self):
+        self.transfers = []
+        self.bytes_written = 0
+
+    def pixel(self, x, y):
+        return (self.ram[(y // 8) * self.width + x] >> (y % 8)) & 1
+
+    # -- emulation -----------------------------------------------------------
+
+    def __command(self, b):
+        if self.__pending:
+            self.__pending.append(b)
+        elif b in _COMMAND_ARGS:
+            self.__pending = [b]
+        if not self.__pending or len(self.__pending) <= _COMMAND_ARGS[self.__pending[0]]:
+            return
+        cmd, args = self.__pending[0], self.__pending[1:]
+        self.__pending = []
+        if cmd == 0x21:
+            self.__col_start, self.__col_end = args
+            self.__col = self.__col_start
+        elif cmd == 0x22:
+            self.__page_start, self.__page_end = args
+            self.__page = self.__page_start
+
+    def __data(self, b):
+        self.ram[self.__page * self.width + self.__col] = b
+        if self.__col < self.__col_end:
+            self.__col += 1
+            return
+        self.__col = self.__col_start
+        self.__page = self.__page + 1 if self.__page < self.__page_end else self.__page_start
+
+
+class FakeI2CBuses:
+    """A set of fake I2C buses for i2c_probe.discover()/find_bus().
+
+    devices maps bus number -> addresses that ACK; delays maps bus number
+    -> seconds a probe on that bus takes (use a large value for a wedged
+    bus). Pass `buses` as discover()'s bus list and `probe` as its probe.
+    """
+
+    def __init__(self, devices, delays=None):
+        self.devices = {bus: set(addrs) for bus, addrs in devices.items()}
+        self.delays = dict(delays or {})
+        self.probes = []
+
+    @property
+    def buses(self):
+        return sorted(self.devices)
+
+    def probe(self, bus, address):
+        self.probes.append((bus, address))
+        delay = self.delays.get(bus, 0)
+        if delay:
+            time.sleep(delay)
+        return address in self.devices.get(bus, ())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""In-memory NetworkManager backend for wifi_setup.py.
+
+FakeBackend implements nm_backend.NetworkBackend over the same scripted
+world as sim.fake_nmcli (visible networks, their passwords, whether the
+interface is connected and whether the hotspot is up) without starting
+any process, so a run measures wifi_setup itself. Every call is appended
+to `calls` as [method, args...]. set_state() scripts the device state
+changes NetworkManager would make on its own, e.g. autoconnecting at boot.
+
+    wifi_setup.backend = FakeBackend()
+"""
+
+import copy
+import queue
+import threading
+import time
+
+from sim.fake_nmcli import DEFAULT_NETWORKS
+
+
+class FakeDeviceWatch:
+    def __init__(self, backend):
+        self.backend = backend
+        self.changes = queue.Queue()
+
+    def wait(self, timeout):
+        try:
+            return self.changes.get(timeout=max(0.0, timeout))
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.backend.watches.remove(self)
+
+
+class FakeBackend:
+    name = "fake"
+
+    def __init__(self, networks=DEFAULT_NETWORKS, connected=False, iface="wlP1p1s0",
+                 ip="192.168.1.50", delay=0.0, ap_scan=False, saved=(), startup=True,
+                 broken=()):
+        """delay: seconds every call takes; ap_scan: whether the fake driver
+        can scan while the hotspot is up; saved: SSIDs of saved profiles;
+        startup: whether NetworkManager has finished starting up;
+        broken: saved profiles that fail to activate."""
+        self.iface = iface
+        self.networks = copy.deepcopy(networks)
+        self.state = "connected" if connected else "disconnected"
+        self.hotspot = False
+        self.saved = list(saved)
+        self.broken = list(broken)
+        self.active = None
+        self.startup = startup
+        self.watches = []
+        self.ip = ip
+        self.delay = delay
+        self.ap_scan = ap_scan
+        self.calls = []
+        self.__lock = threading.Lock()
+
+    def __call(self, *call):
+        with self.__lock:
+            self.calls.append(list(call))
+        if self.delay:
+            time.sleep(self.delay)
+
+    @property
+    def connected(self):
+        return self.state == "connected"
+
+    def set_state(self, state):
+        """Change the device state and tell every watch."""
+        self.state = state
+        for watch in list(self.watches):
+            watch.changes.put(state)
+
+    def device_state(self):
+        self.__call("device_state")
+        return self.state
+
+    def request_scan(self):
+        self.__call("request_scan")
+        return not self.hotspot or self.ap_scan
+
+    def access_points(self):
+        self.__call("access_points")
+        if self.hotspot and not self.ap_scan:
+            return []
+        return [{"bssid": n["bssid"], "ssid": n["ssid"], "signal": n["signal"],
+                 "security": n["security"]} for n in self.networks]
+
+    def start_hotspot(self, con_name, ssid, password):
+        self.__call("start_hotspot", con_name, ssid)
+        self.hotspot = True
+        self.set_state("disconnected")
+        return True, "Device '%s' successfully activated." % self.iface
+
+    def stop_hotspot(self, con_name):
+        self.__call("stop_hotspot", con_name)
+        self.hotspot = False
+
+    def connect(self, ssid, password):
+        self.__call("connect", ssid)
+        for n in self.networks:
+            if n["ssid"] == ssid and n["password"] is not None and n["password"] == password:
+                self.hotspot = False
+                self.active = ssid
+                self.set_state("connected")
+                return True, "Device '%s' successfully activated." % self.iface
+        return False, "Error: Connection activation failed: Secrets were required, but not provided."
+
+    def ip4_address(self):
+        self.__call("ip4_address")
+        return self.ip if self.connected else None
+
+    def startup_complete(self):
+        self.__call("startup_complete")
+        return self.startup
+
+    def saved_wifi_profiles(self):
+        self.__call("saved_wifi_profiles")
+        return {ssid: ssid for ssid in self.saved}
+
+    def saved_wifi_ssids(self):
+        self.__call("saved_wifi_ssids")
+        return list(self.saved)
+
+    def activate_saved(self, profile, timeout):
+        self.__call("activate_saved", profile)
+        visible = {n["ssid"] for n in self.networks}
+        if profile in self.saved and profile in visible and profile not in self.broken:
+            self.hotspot = False
+            self.active = profile
+            self.set_state("connected")
+            return True, "Connection successfully activated."
+        return False, "Error: Connection activation failed: (7) Secrets were required."
+
+    def active_ssid(self):
+        self.__call("active_ssid")
+        return self.active if self.connected else None
+
+    def watch_device(self):
+        self.__call("watch_device")
+        watch = FakeDeviceWatch(self)
+        self.watches.append(watch)
+        return watch
+
+    def close(self):
+        pass
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Scripted stand-in for the nmcli commands wifi_setup.py runs.
+
+FakeNmcli writes an `nmcli` wrapper into a scratch bin directory and keeps
+the scripted world in a JSON state file: the visible networks, their
+passwords, whether the WiFi interface is connected and whether the hotspot
+is up. Put `bin_dir` first on PATH (env() does that) and wifi_setup's
+shell commands reach this script instead of NetworkManager. Every call is
+appended to the state's "calls" list.
+
+The state file is found through the FAKE_NMCLI_STATE environment variable.
+`nmcli device monitor` keeps running and prints a line whenever another
+call (or set_device_state()) changes the device state.
+"""
+
+import json
+import os
+import stat
+import sys
+import time
+
+DEFAULT_NETWORKS = [
+    {"bssid": "A0:B1:C2:00:00:01", "ssid": "HomeNet", "signal": 82, "security": "WPA2",
+     "password": "correct horse"},
+    {"bssid": "A0:B1:C2:00:00:02", "ssid": "HomeNet", "signal": 41, "security": "WPA2",
+     "password": "correct horse"},
+    {"bssid": "10:22:33:44:55:66", "ssid": "Cafe", "signal": 57, "security": "WPA1 WPA2",
+     "password": "latte1234"},
+    {"bssid": "10:22:33:44:55:77", "ssid": "Office 5G", "signal": 33, "security": "WPA2 802.1X",
+     "password": None},
+    {"bssid": "F0:00:00:00:00:09", "ssid": "", "signal": 20, "security": "WPA2", "password": None},
+]
+
+
+class FakeNmcli:
+    def __init__(self, workdir, networks=DEFAULT_NETWORKS, connected=False,
+                 iface="wlP1p1s0", ip="192.168.1.50", delay=0.0, ap_scan=False,
+                 saved=(), startup=True, broken=()):
+        """delay: seconds every nmcli call takes, on top of process start-up;
+        ap_scan: whether the fake driver can scan while the hotspot is up;
+        saved: SSIDs of saved profiles (named after the SSID);
+        startup: whether NetworkManager has finished starting up;
+        broken: saved profiles that fail to activate."""
+        self.bin_dir = os.path.join(workdir, "bin")
+        self.state_file = os.path.join(workdir, "nmcli_state.json")
+        os.makedirs(self.bin_dir, exist_ok=True)
+        wrapper = os.path.join(self.bin_dir, "nmcli")
+        with open(wrapper, "w") as f:
+            f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, os.path.abspath(__file__)))
+        os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IEXEC)
+        self.save({"networks": networks, "connected": connected, "hotspot": False,
+                   "iface": iface, "ip": ip, "delay": delay, "ap_scan": ap_scan,
+                   "saved": list(saved), "startup": startup, "device_state": None,
+                   "broken": list(broken), "active_ssid": None,
+                   "calls": []})
+
+    def load(self):
+        with open(self.state_file, "r") as f:
+            return json.load(f)
+
+    def save(self, state):
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
+
+    def set_device_state(self, device_state):
+        """Script a state change NetworkManager makes on its own."""
+        state = self.load()
+        state["device_state"] = device_state
+        state["connected"] = device_state == "connected"
+        self.save(state)
+
+    def env(self):
+        """Return os.environ with the fake nmcli first on PATH."""
+        env = dict(os.environ)
+        env["PATH"] = self.bin_dir + os.pathsep + env.get("PATH", "")
+        env["FAKE_NMCLI_STATE"] = self.state_file
+        return env
+
+    def activate(self):
+        """Point this process (and the shells it spawns) at the fake nmcli."""
+        os.environ.update(self.env())
+
+
+def _option(args, name, default=None):
+    return args[args.index(name) + 1] if name in args and args.index(name) + 1 < len(args) else default
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace(":", "\\:")
+
+
+def _device_state(state):
+    if state.get("device_state"):
+        return state["device_state"]
+    return "connected" if state["connected"] else "disconnected"
+
+
+def run(args, state):
+    """Execute one nmcli call against state; return (exit code, stdout)."""
+    state["calls"].append(args)
+    if args[:1] in (["-w"], ["--wait"]):
+        args = args[2:]
+    iface = state["iface"]
+    fields = _option(args, "-f")
+    words = [a for a in args if not a.startswith("-")]
+    if fields == "DEVICE,STATE" and words[-1:] == ["device"]:
+        return 0, "%s:%s\nlo:unmanaged\n" % (iface, _device_state(state))
+    if fields == "STARTUP" and words[-1:] == ["general"]:
+        return 0, "started\n" if state.get("startup", True) else "starting\n"
+    if fields == "NAME,TYPE,AUTOCONNECT" and words[-2:] == ["connection", "show"]:
+        return 0, "".join("%s:802-11-wireless:yes\n" % _escape(ssid)
+                          for ssid in state.get("saved", []))
+    if fields == "ACTIVE,SSID":
+        if not state["connected"] or not state.get("active_ssid"):
+            return 0, ""
+        return 0, "yes:%s\n" % _escape(state["active_ssid"])
+    if args[:3] == ["connection", "up", "id"]:
+        name = args[3]
+        visible = {n["ssid"] for n in state["networks"]}
+        if name in state.get("saved", []) and name in visible \
+                and name not in state.get("broken", []):
+            state.update(connected=True, hotspot=False, device_state=None, active_ssid=name)
+            return 0, "Connection successfully activated.\n"
+        return 4, "Error: Connection activation failed: (7) Secrets were required.\n"
+    if args[:1] == ["-g"] and args[2:4] == ["connection", "show"]:
+        if args[4] in state.get("saved", []):
+            return 0, "%s\ninfrastructure\n" % _escape(args[4])
+        return 10, "Error: %s - no such connection profile.\n" % args[4]
+    if fields in ("SSID,SIGNAL,SECURITY", "BSSID,SSID,SIGNAL,SECURITY"):
+        if state["hotspot"] and not state.get("ap_scan"):
+            return 0, ""
+        with_bssid = fields.startswith("BSSID")
+        return 0, "".join(
+            (_escape(n["bssid"]) + ":" if with_bssid else "")
+            + "%s:%d:%s\n" % (_escape(n["ssid"]), n["signal"], n["security"])
+            for n in state["networks"])
+    if fields == "IP4.ADDRESS":
+        return 0, ("IP4.ADDRESS[1]:%s/24\n" % state["ip"]) if state["connected"] else ""
+    if args[:2] == ["connection", "delete"] or args[:2] == ["connection", "down"]:
+        if state["hotspot"]:
+            state["hotspot"] = False
+            return 0, ""
+        return 10, ""
+    if args[:3] == ["device", "wifi", "hotspot"]:
+        state["hotspot"] = True
+        state["connected"] = False
+        state["device_state"] = None
+        return 0, "Device '%s' successfully activated.\n" % iface
+    if args[:3] == ["device", "wifi", "rescan"]:
+        return (1, "") if state["hotspot"] and not state.get("ap_scan") else (0, "")
+    if args[:3] == ["device", "wifi", "connect"]:
+        ssid, password = args[3], _option(args, "password")
+        for n in state["networks"]:
+            if n["ssid"] == ssid and n["password"] is not None and n["password"] == password:
+                state["connected"] = True
+                state["hotspot"] = False
+                state["device_state"] = None
+                state["active_ssid"] = ssid
+                return 0, "Device '%s' successfully activated.\n" % iface
+        return 4, "Error: Connection activation failed: Secrets were required, but not provided.\n"
+    return 2, "Error: fake nmcli does not know '%s'.\n" % " ".join(args)
+
+
+def monitor(path, iface):
+    """`nmcli device monitor IFACE`: print state changes until killed."""
+    last = None
+    while True:
+        try:
+            with open(path, "r") as f:
+                current = _device_state(json.load(f))
+        except (OSError, ValueError):
+            current = last
+        if current != last and last is not None:
+            sys.stdout.write("%s: %s\n" % (iface, current))
+            sys.stdout.flush()
+        last = current
+        time.sleep(0.02)
+
+
+def main(argv):
+    path = os.environ.get("FAKE_NMCLI_STATE")
+    if not path:
+        print("Error: FAKE_NMCLI_STATE is not set.", file=sys.stderr)
+        return 8
+    if argv[:2] == ["device", "monitor"]:
+        monitor(path, argv[2])
+    with open(path, "r") as f:
+        state = json.load(f)
+    if state.get("delay"):
+        time.sleep(state["delay"])
+    rc, out = run(argv, state)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+    sys.stdout.write(out)
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
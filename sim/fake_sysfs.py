@@ -0,0 +1,112 @@
+"""A fake /proc and /sys tree for SystemSampler and the providers.
+
+FakeSystemTree lays out /proc/stat, /proc/meminfo, thermal zones and the
+Jetson GPU/EMC nodes under a scratch directory; pass that directory as the
+`root` of SystemSampler, GpuProvider or Yahboom_OLED. step() advances the
+counters by one scripted second.
+
+Numbers are written zero-padded at a fixed width with pwrite(), so files
+keep their size and a reader holding them open (FileSource) never sees a
+truncated file half-way through an update.
+"""
+
+import os
+
+CORES = 6
+ZONES = ["cpu-thermal", "gpu-thermal", "cv0-thermal", "soc0-thermal",
+         "soc1-thermal", "soc2-thermal", "tj-thermal"]
+MEM_TOTAL_KB = 7802816
+GPU_MAX_HZ = 1020000000
+EMC_MAX_HZ = 3199000000
+TRIP_C = 99.0
+
+
+def load_pattern(t):
+    """Scripted CPU load in percent at second t: idle with a burst every 30 s."""
+    return 85 if t % 30 < 3 else 12 + (t * 7) % 9
+
+
+class FakeSystemTree:
+    def __init__(self, root, cores=CORES, zones=ZONES, pattern=load_pattern, trip_c=TRIP_C):
+        """trip_c: the zones' passive (throttling) trip point."""
+        self.root = root
+        self.trip_c = trip_c
+        self.cores = cores
+        self.zones = list(zones)
+        self.pattern = pattern
+        self.t = 0
+        self.__jiffies = [[0, 0] for _ in range(cores)]  # busy, idle
+        self.__temp = 42.0
+        self.__fds = {}
+        self.__write_all()
+
+    def path(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    @property
+    def temperature(self):
+        """The scripted temperature of zone 0 in degrees C."""
+        return self.__temp
+
+    def step(self):
+        """Advance one second of scripted load, temperature and GPU activity."""
+        load = self.pattern(self.t)
+        for i, core in enumerate(self.__jiffies):
+            busy = min(100, max(0, load + (i * 5) % 11 - 5))
+            core[0] += busy
+            core[1] += 100 - busy
+        # first-order lag towards a load-dependent steady state
+        self.__temp += (40.0 + 0.3 * load - self.__temp) * 0.1
+        self.t += 1
+        self.__write_all()
+
+    def close(self):
+        for fd in self.__fds.values():
+            os.close(fd)
+        self.__fds = {}
+
+    # -- layout --------------------------------------------------------------
+
+    def __write(self, path, text):
+        fd = self.__fds.get(path)
+        if fd is None:
+            full = self.path(path)
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            fd = os.open(full, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            self.__fds[path] = fd
+        os.pwrite(fd, text.encode(), 0)
+
+    def __write_all(self):
+        lines = []
+        total_busy = sum(c[0] for c in self.__jiffies)
+        total_idle = sum(c[1] for c in self.__jiffies)
+        for name, busy, idle in [("cpu ", total_busy, total_idle)] + [
+                ("cpu%d" % i, c[0], c[1]) for i, c in enumerate(self.__jiffies)]:
+            # user nice system idle iowait irq softirq steal guest guest_nice
+            lines.append("%s %012d 0 0 %012d 0 0 0 0 0 0" % (name, busy, idle))
+        lines.append("intr 0")
+        self.__write("/proc/stat", "\n".join(lines) + "\n")
+
+        used = 0.25 + 0.002 * (self.t % 120)
+        available = int(MEM_TOTAL_KB * (1 - used))
+        self.__write("/proc/meminfo", (
+            "MemTotal:       %010d kB\n"
+            "MemFree:        %010d kB\n"
+            "MemAvailable:   %010d kB\n") % (MEM_TOTAL_KB, available, available))
+
+        for i, name in enumerate(self.zones):
+            zone = "/sys/devices/virtual/thermal/thermal_zone%d/" % i
+            self.__write(zone + "type", name + "\n")
+            millideg = int((self.__temp + i * 0.5) * 1000)
+            self.__write(zone + "temp", "%06d\n" % millideg)
+            self.__write(zone + "trip_point_0_type", "passive\n")
+            self.__write(zone + "trip_point_0_temp", "%06d\n" % int(self.trip_c * 1000))
+
+        load = self.pattern(self.t)
+        self.__write("/sys/devices/gpu.0/load", "%04d\n" % (load * 5))
+        devfreq = "/sys/class/devfreq/17000000.ga10b/"
+        self.__write(devfreq + "cur_freq", "%010d\n" % GPU_MAX_HZ)
+        self.__write(devfreq + "max_freq", "%010d\n" % GPU_MAX_HZ)
+        emc = "/sys/kernel/debug/bpmp/debug/clk/emc/"
+        self.__write(emc + "rate", "%010d\n" % EMC_MAX_HZ)
+        self.__write(emc + "max_rate", "%010d\n" % EMC_MAX_HZ)
@@ -0,0 +1,698 @@
+#!/usr/bin/env python3
+"""Run oled.py and wifi_setup.py off-device and report their performance.
+
+    python3 -m sim.harness [--duration 60] [--sleep-scale 1.0]
+                           [--backend nmcli|fake] [--ap-scan]
+                           [--trace DIR] [--json out.json] [--baseline base.json]
+                           [--tolerance 0.25]
+
+The OLED daemon runs Yahboom_OLED.main_program in a child process against a
+fake SSD1306 (sim.fake_adafruit) and a fake /proc and /sys tree
+(sim.fake_sysfs) that the parent advances once a second. The child reports
+its own CPU time from the moment main_program starts, so interpreter
+start-up and imports are not counted, and then times scrapes of its
+/metrics endpoint. Its portal flag file lives in the fake tree, so a host
+with the portal running does not keep it on the WiFi Setup page; if the
+overview page is never drawn or fewer than MIN_FRAMES_PER_S frames a second
+reach the panel, the exit status is 1.
+
+The portal runs wifi_setup's real WifiHandler on 127.0.0.1 with the
+scripted nmcli (sim.fake_nmcli) first on PATH, or with --backend fake the
+in-memory NetworkManager backend (sim.fake_nm), and times the requests a
+phone makes: the index page (gzip, then revalidated with its ETag), the
+network list, a rescan, the index page and concurrent
+rescans while a background rescan is running, and a wrong password and a
+successful connect, each followed over its event stream to the outcome.
+--ap-scan makes the fake driver able to scan while the hotspot is up. It
+also times wait_for_wifi's boot decision against scripted NetworkManager
+behaviour: autoconnecting at 2.1 s, no saved network in range, and a saved
+network that fails; and boot_connect's fast reconnect to a known network
+after NetworkManager autoconnected to the wrong one. wifi_setup's remaining fixed sleeps (the scan waits)
+and the scripted event times are part of those latencies; --sleep-scale
+shrinks them for quick runs.
+
+The fan/RGB controller (rgb_blue.py) runs against a fake CubeNano
+(sim.fake_cubenano) and the fake tree in simulated time; the report counts
+its CubeNano writes and fan switches next to a controller without
+hysteresis. The I2C broker (i2c_broker.py) serves a client sending OLED
+frames and one flooding LED settings over its socket; the report gives
+each client's coalesced updates, bus time and longest wait for the bus.
+i2c_probe.find_bus() runs over fake buses (sim.fake_i2c): a wedged bus,
+the cached bus, a stale cache, several buses answering and none; a wrong
+choice makes the exit status 1.
+
+With --baseline, every lower-is-better number is compared against a
+previous --json report and the exit status is 1 if any got worse by more
+than --tolerance.
+"""
+
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = os.path.join(REPO, "scripts")
+# run as `python3 sim/harness.py` too, not only with -m from the repo root
+sys.path.insert(0, REPO)
+
+# Numbers where a larger value is a regression.
+LOWER_IS_BETTER = ["oled.cpu_s_per_min", "oled.i2c_bytes_per_s", "oled.metrics_scrape.p50_ms",
+                   "portal.index.p50_ms", "portal.index_bytes", "portal.scan.p50_ms",
+                   "portal.index_during_scan.max_ms", "portal.scan_rescans",
+                   "portal.refresh_ms", "portal.hotspot_restarts",
+                   "portal.connect_reply.max_ms",
+                   "portal.connect_bad.p50_ms", "portal.connect_ok.p50_ms",
+                   "boot.connects.lag_ms", "boot.none_in_range.lag_ms",
+                   "boot.saved_fails.lag_ms", "boot.fast_reconnect.time_to_network_ms",
+                   "thermal.writes", "thermal.fan_switches"]
+
+# Below this the panel is stuck (e.g. on the WiFi Setup page) rather than
+# following the fake tree, whose load changes every second.
+MIN_FRAMES_PER_S = 0.25
+
+
+# -- OLED ------------------------------------------------------------------
+
+def oled_child(root, duration):
+    """Child process body: run main_program for `duration` seconds, print JSON."""
+    sys.path.insert(0, SCRIPTS)
+    from sim import fake_adafruit
+    fake_adafruit.install()
+    import boottrace
+    import oled
+    boottrace.start("oled")
+
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    # the host's own flag file must not put the daemon on the WiFi Setup page
+    display = oled.Yahboom_OLED(snapshot_path=None, root=root,
+                                portal_socket=os.path.join(root, "portal.sock"),
+                                portal_flag=os.path.join(root, "wifi_setup_active"),
+                                broker_socket=None, metrics_address=("127.0.0.1", port))
+    start = os.times()
+
+    def finish():
+        time.sleep(duration)
+        end = os.times()
+        report = {"cpu_s": (end.user - start.user) + (end.system - start.system),
+                  "duration_s": duration}
+        # scrapes after the CPU measurement: they are served by the daemon's loop,
+        # with idle clients connected that must not hold it up
+        idle = [socket.create_connection(("127.0.0.1", port)) for _ in range(6)]
+        scrapes = []
+        for accept in ("application/openmetrics-text", "text/plain") * 10:
+            t0 = time.perf_counter()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/metrics", headers={"Accept": accept})
+            body = conn.getresponse().read()
+            conn.close()
+            scrapes.append((time.perf_counter() - t0) * 1000)
+        for sock in idle:
+            sock.close()
+        report["metrics_scrape"] = _summary(scrapes)
+        report["metrics_bytes"] = len(body)
+        report.update(display.getDisplayStats())
+        report["text_cache"] = display.getTextCacheStats()
+        report["bus_bytes"] = sum(d._i2c.bytes_written for d in fake_adafruit.DISPLAYS)
+        sys.stdout.write(json.dumps(report) + "\n")
+        sys.stdout.flush()
+        os._exit(0)
+
+    threading.Thread(target=finish, daemon=True).start()
+    display.main_program()
+    os._exit(1)
+
+
+def bench_oled(duration):
+    from sim.fake_sysfs import FakeSystemTree
+    with tempfile.TemporaryDirectory(prefix="yahboom-sim-") as root:
+        tree = FakeSystemTree(root)
+        child = subprocess.Popen(
+            [sys.executable, "-m", "sim.harness", "--oled-child", root, str(duration)],
+            cwd=REPO, stdout=subprocess.PIPE, text=True)
+        next_step = time.monotonic() + 1
+        while child.poll() is None:
+            time.sleep(max(0.0, next_step - time.monotonic()))
+            tree.step()
+            next_step += 1
+        out = child.stdout.read()
+        tree.close()
+    if child.returncode != 0:
+        raise RuntimeError("OLED child exited with %d" % child.returncode)
+    raw = json.loads(out.strip().splitlines()[-1])
+    pushed = raw["frames"] - raw["skipped"]
+    overview = raw["pages"].get("overview", 0)
+    return {
+        "ok": overview > 0 and pushed / duration >= MIN_FRAMES_PER_S,
+        "overview_frames": overview,
+        "frames_per_s": pushed / duration,
+        "skipped_per_s": raw["skipped"] / duration,
+        "i2c_bytes_per_s": raw["bytes"] / duration,
+        "cpu_s_per_min": raw["cpu_s"] * 60.0 / duration,
+        "metrics_scrape": raw["metrics_scrape"],
+        "metrics_bytes": raw["metrics_bytes"],
+        "raw": raw,
+    }
+
+
+# -- portal ----------------------------------------------------------------
+
+class _ScaledTime:
+    """time module look-alike whose sleep() is scaled."""
+
+    def __init__(self, scale):
+        self.scale = scale
+
+    def sleep(self, seconds):
+        time.sleep(seconds * self.scale)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def _request(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    headers = dict(headers or {})
+    if body:
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+    start = time.perf_counter()
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    elapsed = (time.perf_counter() - start) * 1000.0
+    conn.close()
+    return elapsed, response.status, data, response
+
+
+def _connect(port, body):
+    """POST /connect and follow the job's event stream to its outcome.
+
+    Returns (ms until the POST was answered, ms until the outcome, final event).
+    """
+    start = time.perf_counter()
+    reply_ms, _, data, _ = _request(port, "POST", "/connect", body)
+    job = json.loads(data)["job"]
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    conn.request("GET", "/connect/%s/events" % job)
+    response = conn.getresponse()
+    final = None
+    while final is None:
+        line = response.fp.readline().decode()
+        if not line:
+            raise RuntimeError("event stream for job %s ended early" % job)
+        if line.startswith("data: "):
+            event = json.loads(line[len("data: "):])
+            if event.get("done"):
+                final = event
+    conn.close()
+    return reply_ms, (time.perf_counter() - start) * 1000.0, final
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {"n": len(samples), "p50_ms": samples[len(samples) // 2],
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "max_ms": samples[-1]}
+
+
+def bench_portal(sleep_scale, ap_scan=False, backend="nmcli", index_requests=20):
+    sys.path.insert(0, SCRIPTS)
+    from sim.fake_nm import FakeBackend
+    from sim.fake_nmcli import FakeNmcli
+    import boottrace
+    import known_networks
+    import nm_backend
+    import wifi_setup
+
+    boottrace.start("wifi_setup")
+    with tempfile.TemporaryDirectory(prefix="yahboom-sim-") as workdir:
+        wifi_setup.known = known_networks.KnownNetworks(os.path.join(workdir, "known.json"))
+        if backend == "fake":
+            fake = wifi_setup.backend = FakeBackend(ap_scan=ap_scan)
+        else:
+            nmcli = FakeNmcli(workdir, ap_scan=ap_scan)
+            nmcli.activate()
+            wifi_setup.backend = nm_backend.NmcliBackend(wifi_setup.WIFI_IFACE)
+        wifi_setup.FLAG_FILE = os.path.join(workdir, "wifi_setup_active")
+        wifi_setup.PORTAL_SOCKET = os.path.join(workdir, "portal.sock")
+        wifi_setup.time = _ScaledTime(sleep_scale)
+
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            start = time.perf_counter()
+            wifi_setup.scan_networks()
+            wifi_setup.start_hotspot()
+            startup_ms = (time.perf_counter() - start) * 1000.0
+
+            server = wifi_setup.StoppableHTTPServer(("127.0.0.1", 0), wifi_setup.WifiHandler)
+            port = server.server_address[1]
+
+            thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.5},
+                                      daemon=True)
+            thread.start()
+
+            results = {"index": [], "index_revalidate": [], "networks": [], "scan": [],
+                       "index_during_scan": [], "connect_reply": [], "connect_bad": [],
+                       "connect_ok": []}
+            gzip_ok = {"Accept-Encoding": "gzip"}
+            for _ in range(index_requests):
+                elapsed, status, page, response = _request(port, "GET", "/", headers=gzip_ok)
+                results["index"].append(elapsed)
+            etag = response.getheader("ETag")
+            for _ in range(index_requests):
+                elapsed, status, data, _ = _request(port, "GET", "/",
+                                                    headers=dict(gzip_ok, **{"If-None-Match": etag}))
+                assert status == 304 and not data, status
+                results["index_revalidate"].append(elapsed)
+            elapsed, _, networks, _ = _request(port, "GET", "/networks", headers=gzip_ok)
+            results["networks"].append(elapsed)
+            _, status, _, response = _request(port, "GET", "/generate_204")
+            assert status == 302 and response.getheader("Location") == wifi_setup.PORTAL_URL
+            results["scan"].append(_request(port, "GET", "/scan")[0])
+
+            # make the cache stale: three phones hit /scan at once while a
+            # fourth loads the page, then wait for the background refresh
+            wifi_setup.scan_cache.ttl = 0
+            rescans_before = wifi_setup.shared_rescan.calls
+            refresh = time.perf_counter()
+            scanners = [threading.Thread(
+                target=lambda: results["scan"].append(_request(port, "GET", "/scan")[0]))
+                for _ in range(3)]
+            for t in scanners:
+                t.start()
+            for _ in range(5):
+                elapsed = _request(port, "GET", "/", headers=gzip_ok)[0]
+                results["index_during_scan"].append(elapsed)
+            for t in scanners:
+                t.join()
+            while wifi_setup.shared_rescan.in_flight:
+                time.sleep(0.01)
+            refresh_ms = (time.perf_counter() - refresh) * 1000.0
+            wifi_setup.scan_cache.ttl = wifi_setup.SCAN_TTL
+            rescans = wifi_setup.shared_rescan.calls - rescans_before
+            reply, elapsed, final = _connect(port, "ssid=Cafe&password=wrong")
+            assert not final["ok"], final
+            results["connect_reply"].append(reply)
+            results["connect_bad"].append(elapsed)
+            reply, elapsed, final = _connect(port, "ssid=HomeNet&password=correct+horse")
+            assert final["ok"], final
+            results["connect_reply"].append(reply)
+            results["connect_ok"].append(elapsed)
+
+            stop = time.perf_counter()
+            thread.join(10)
+            stop_ms = (time.perf_counter() - stop) * 1000.0
+            server.server_close()
+        if backend == "fake":
+            calls = fake.calls
+            hotspots = sum(1 for c in calls if c[0] == "start_hotspot")
+        else:
+            calls = nmcli.load()["calls"]
+            hotspots = sum(1 for c in calls if c[:3] == ["device", "wifi", "hotspot"])
+
+    boottrace.flush()
+    report = {name: _summary(samples) for name, samples in results.items()}
+    report["startup_ms"] = startup_ms
+    report["shutdown_ms"] = stop_ms
+    report["index_bytes"] = len(page)
+    report["networks_bytes"] = len(networks)
+    report["backend"] = backend
+    report["nm_calls"] = len(calls)
+    report["hotspot_restarts"] = hotspots - 1
+    report["scan_rescans"] = rescans
+    report["refresh_ms"] = refresh_ms
+    report["ap_scan"] = ap_scan
+    report["sleep_scale"] = sleep_scale
+    return report
+
+
+# -- boot ------------------------------------------------------------------
+
+# name: (saved SSIDs, [(seconds, device state NM moves to)], expected result,
+#        seconds at which the outcome is known)
+BOOT_SCENARIOS = {
+    "connects": (["HomeNet"], [(0.3, "connecting"), (2.1, "connected")], True, 2.1),
+    "none_in_range": (["Elsewhere"], [], False, 0.0),
+    "saved_fails": (["Cafe"], [(0.3, "connecting"), (3.0, "failed"), (3.1, "disconnected")],
+                    False, 3.0),
+}
+
+
+def bench_boot(sleep_scale, backend="nmcli"):
+    sys.path.insert(0, SCRIPTS)
+    from sim.fake_nm import FakeBackend
+    from sim.fake_nmcli import FakeNmcli
+    import known_networks
+    import nm_backend
+    import wifi_setup
+
+    def run(saved, timeline, broken=(), boot=False, store=None):
+        with tempfile.TemporaryDirectory(prefix="yahboom-sim-") as workdir:
+            if backend == "fake":
+                fake = wifi_setup.backend = FakeBackend(saved=saved, broken=broken)
+                set_state = fake.set_state
+            else:
+                nmcli = FakeNmcli(workdir, saved=saved, broken=broken)
+                nmcli.activate()
+                wifi_setup.backend = nm_backend.NmcliBackend(wifi_setup.WIFI_IFACE)
+                set_state = nmcli.set_device_state
+            wifi_setup.known = known_networks.KnownNetworks(os.path.join(workdir, "known.json"))
+            if store:
+                wifi_setup.known.networks.update(store)
+            timers = [threading.Timer(at * sleep_scale, set_state, (state,))
+                      for at, state in timeline]
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                start = time.perf_counter()
+                for t in timers:
+                    t.start()
+                if boot:
+                    result = wifi_setup.boot_connect(wifi_setup.WAIT_TIMEOUT * sleep_scale)
+                else:
+                    result = wifi_setup.wait_for_wifi()
+                elapsed = (time.perf_counter() - start) * 1000.0
+            for t in timers:
+                t.cancel()
+                if t.is_alive():
+                    t.join()
+            return result, elapsed, log.getvalue(), wifi_setup.backend.active_ssid()
+
+    report = {}
+    for name, (saved, timeline, expected, known_at) in BOOT_SCENARIOS.items():
+        result, elapsed, log, _ = run(saved, timeline)
+        assert result == expected, (name, result, log)
+        report[name] = {"decision_ms": elapsed,
+                        "lag_ms": elapsed - known_at * sleep_scale * 1000.0}
+
+    # moved to another site: NM autoconnects a saved network that no longer
+    # works here and never gets to the one that does; the store knows HomeNet
+    store = {"HomeNet": {"signal": 80, "last_seen": time.time() - 3600,
+                         "last_success": time.time() - 3600, "last_failure": None,
+                         "failures": 0, "join_s": 3.0}}
+    result, elapsed, log, ssid = run(["Cafe", "HomeNet"],
+                                     [(0.3, "connecting"), (3.0, "failed")],
+                                     broken=["Cafe"], boot=True, store=store)
+    assert result and ssid == "HomeNet", (result, ssid, log)
+    report["fast_reconnect"] = {"time_to_network_ms": elapsed}
+    report["sleep_scale"] = sleep_scale
+    return report
+
+
+# -- thermal ---------------------------------------------------------------
+
+def thermal_pattern(t):
+    """CPU load for the thermal run: idle, a long jetson_clocks-style soak,
+    then a load that keeps the temperature hovering at the fan threshold."""
+    phase = t % 600
+    if phase < 120:
+        return 10
+    if phase < 360:
+        return 100
+    return 45 + 10 * ((t // 7) % 2)
+
+
+def bench_thermal(seconds=1800, interval=2):
+    """Run rgb_blue's controller against the fake tree in simulated time,
+    next to a controller with no hysteresis that writes every reading."""
+    sys.path.insert(0, SCRIPTS)
+    from sim import fake_cubenano
+    from sim.fake_sysfs import FakeSystemTree
+    from sampler import SystemSampler
+    import rgb_blue
+
+    with tempfile.TemporaryDirectory(prefix="yahboom-sim-") as root:
+        tree = FakeSystemTree(root, pattern=thermal_pattern, trip_c=72.0)
+        sampler = SystemSampler(root=root)
+        trips = sampler.trip_points()
+        bot = fake_cubenano.CubeNano()
+        controller = rgb_blue.ThermalController(bot)
+        naive_fan, naive_switches, fan_switches, levels = None, 0, 0, []
+        last_fan = None
+        for t in range(seconds):
+            tree.step()
+            if t % interval:
+                continue
+            # +-1 C of sensor noise
+            temps = {name: temp + (0.9 if (t // interval) % 2 else -0.9)
+                     for name, temp in sampler.temperatures().items()}
+            fan, level = controller.update(temps, trips, float(t))
+            fan_switches += last_fan is not None and fan != last_fan
+            last_fan = fan
+            if not levels or levels[-1] != level:
+                levels.append(level)
+            naive = max(temps.values()) >= rgb_blue.FAN_ON_C
+            naive_switches += naive_fan is not None and naive != naive_fan
+            naive_fan = naive
+        sampler.close()
+        tree.close()
+    readings = seconds // interval
+    return {"seconds": seconds, "readings": readings, "writes": controller.writes,
+            "fan_switches": fan_switches, "level_changes": len(levels) - 1,
+            "levels_seen": sorted(set(levels)),
+            "naive_writes": readings * 4, "naive_fan_switches": naive_switches}
+
+
+# -- I2C bus probe ---------------------------------------------------------
+
+# name -> (devices, delays, cached bus, preferred, expected bus)
+PROBE_SCENARIOS = {
+    "wedged_bus": ({1: [], 7: [0x3C], 8: []}, {8: 5.0}, None, [1, 0, 7, 8], 7),
+    "cached_bus": ({1: [0x3C], 7: [0x3C]}, {}, 7, [1, 0, 7, 8], 7),
+    "stale_cache": ({1: [], 7: [0x3C]}, {}, 1, [1, 0, 7, 8], 7),
+    "tie_break": ({0: [0x3C], 7: [0x3C], 8: [0x3C]}, {}, None, [1, 0, 7, 8], 0),
+    "not_found": ({0: [], 1: [], 7: []}, {}, 7, [1, 0, 7, 8], None),
+}
+
+
+def bench_probe():
+    """Run i2c_probe.find_bus() over fake buses: a wedged bus that only the
+    timeout ends, the cached bus (probed alone first), a cache pointing at
+    a bus that no longer answers, several buses answering, and none."""
+    sys.path.insert(0, SCRIPTS)
+    from sim.fake_i2c import FakeI2CBuses
+    import i2c_probe
+
+    report = {}
+    with tempfile.TemporaryDirectory(prefix="yahboom-sim-") as root:
+        for name, (devices, delays, cached, preferred, expected) in PROBE_SCENARIOS.items():
+            state_file = os.path.join(root, name)
+            if cached is not None:
+                i2c_probe.write_state(cached, state_file)
+            fake = FakeI2CBuses(devices, delays)
+            t0 = time.perf_counter()
+            bus = i2c_probe.find_bus(i2c_probe.SSD1306_ADDRESS, preferred, state_file,
+                                     buses=fake.buses, probe=fake.probe)
+            elapsed = (time.perf_counter() - t0) * 1000
+            cached_first = cached is None or fake.probes[0][0] == cached
+            remembered = i2c_probe.read_state(state_file)
+            report[name] = {"bus": bus, "expected": expected, "ms": elapsed,
+                            "probes": len(fake.probes), "cached_first": cached_first,
+                            "remembered": remembered,
+                            "ok": bus == expected == remembered and cached_first}
+    report["timeout_ms"] = i2c_probe.PROBE_TIMEOUT * 1000
+    return report
+
+
+# -- I2C broker ------------------------------------------------------------
+
+def bench_broker(seconds=2.0, frame_hz=100, led_hz=500):
+    """Run i2c_broker's BusBroker on a fake SSD1306 and CubeNano with an
+    OLED client sending frames and an LED client flooding settings. The
+    CubeNano rejects a few writes, which the broker must survive."""
+    sys.path.insert(0, SCRIPTS)
+    from sim import fake_cubenano
+    from sim.fake_i2c import FakeSSD1306
+    import i2c_broker
+    from oled_driver import DiffDisplay
+
+    with tempfile.TemporaryDirectory(prefix="yahboom-sim-") as root:
+        path = os.path.join(root, "i2c.sock")
+        # 400 kHz: 9 bit times per byte
+        panel = FakeSSD1306(byte_s=9 / 400e3)
+        bot = fake_cubenano.CubeNano(write_s=3 * 9 / 400e3)
+        bot.failures = 3
+        broker = i2c_broker.BusBroker(DiffDisplay(panel), bot, path)
+        running = True
+
+        def serve():
+            while running:
+                if broker.sched.run_once(max_wait=0.05):
+                    broker.flush()
+
+        def oled_client():
+            client = i2c_broker.BrokerClient("oled", path)
+            frame = bytearray(512)
+            for i in range(int(seconds * frame_hz)):
+                for col in range(64):            # half a text line changes per frame
+                    frame[(i * 64 + col) % 512] ^= 0xFF
+                client.show(frame)
+                time.sleep(1.0 / frame_hz)
+            client.close()
+
+        def led_client():
+            client = i2c_broker.BrokerClient("rgb", path)
+            for i in range(int(seconds * led_hz)):
+                client.set_leds(fan=1, color=i % 2, effect=1, speed=3)
+                time.sleep(1.0 / led_hz)
+            client.close()
+
+        server = threading.Thread(target=serve, daemon=True)
+        server.start()
+        clients = [threading.Thread(target=oled_client), threading.Thread(target=led_client)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        time.sleep(0.1)
+        stats = broker.stats()
+        running = False
+        server.join()
+        broker.close()
+    oled, rgb = stats["clients"]["oled"], stats["clients"]["rgb"]
+    return {"seconds": seconds, "oled": oled, "rgb": rgb, "wakeups": stats["wakeups"],
+            "bus_bytes": panel.bytes_written, "write_errors": stats["errors"],
+            "fan": bot.fan,
+            "frame_wait_max_ms": oled["max_wait_ms"],
+            "led_writes_per_message": round(rgb["writes"] / max(1, rgb["messages"]), 3)}
+
+
+# -- report ----------------------------------------------------------------
+
+def _flatten(report, prefix=""):
+    flat = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + "."))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(report, baseline, tolerance):
+    """Return [(metric, baseline, now)] for metrics worse than tolerance allows."""
+    now, base = _flatten(report), _flatten(baseline)
+    worse = []
+    for key in LOWER_IS_BETTER:
+        if key in now and key in base and now[key] > base[key] * (1 + tolerance):
+            worse.append((key, base[key], now[key]))
+    return worse
+
+
+def print_report(report):
+    o = report["oled"]
+    print("OLED daemon, %d s against the fake tree" % o["raw"]["duration_s"])
+    print("  frames/s         %8.2f  (+%.2f/s unchanged, skipped)" % (o["frames_per_s"], o["skipped_per_s"]))
+    print("  I2C bytes/s      %8.1f" % o["i2c_bytes_per_s"])
+    print("  CPU s/min        %8.3f" % o["cpu_s_per_min"])
+    print("  /metrics         %8.2f ms p50, %.2f ms max, %d bytes" % (
+        o["metrics_scrape"]["p50_ms"], o["metrics_scrape"]["max_ms"], o["metrics_bytes"]))
+    print("  pages            %s  %s" % (
+        ", ".join("%s %d" % item for item in sorted(o["raw"]["pages"].items())) or "none",
+        "ok" if o["ok"] else "FAIL (overview never drawn or under %.2f frames/s)" % MIN_FRAMES_PER_S))
+    p = report["portal"]
+    print("Portal, sleep scale %.2f, %d %s backend calls, AP-mode scan %s" % (
+        p["sleep_scale"], p["nm_calls"], p["backend"], "on" if p["ap_scan"] else "off"))
+    print("  startup (scan + hotspot) %8.1f ms" % p["startup_ms"])
+    print("  3 concurrent /scan -> %d rescan(s), refreshed in %.1f ms" % (
+        p["scan_rescans"], p["refresh_ms"]))
+    print("  hotspot restarts         %8d" % p["hotspot_restarts"])
+    print("  index page %d bytes (304 when unchanged), networks %d bytes" % (
+        p["index_bytes"], p["networks_bytes"]))
+    for name in ("index", "index_revalidate", "networks", "scan", "index_during_scan",
+                 "connect_reply", "connect_bad", "connect_ok"):
+        s = p[name]
+        print("  %-17s n=%-3d p50 %8.1f ms  p95 %8.1f ms  max %8.1f ms" % (
+            name, s["n"], s["p50_ms"], s["p95_ms"], s["max_ms"]))
+    print("  shutdown after connect   %8.1f ms" % p["shutdown_ms"])
+    t = report["thermal"]
+    print("Thermal controller, %d simulated s, %d readings" % (t["seconds"], t["readings"]))
+    print("  CubeNano writes %d (naive: %d), fan switches %d (no hysteresis: %d)" % (
+        t["writes"], t["naive_writes"], t["fan_switches"], t["naive_fan_switches"]))
+    print("  level changes %d, levels seen: %s" % (t["level_changes"], ", ".join(t["levels_seen"])))
+    i = report["broker"]
+    print("I2C broker, %.0f s of OLED frames and LED updates" % i["seconds"])
+    for name in ("oled", "rgb"):
+        c = i[name]
+        print("  %-5s msgs %-6d coalesced %-6d bus writes %-6d bus %7.1f ms  max wait %6.2f ms" % (
+            name, c["messages"], c["coalesced"], c["writes"], c["bus_ms"], c["max_wait_ms"]))
+    print("  %d wakeups, %d panel bytes, %d rejected writes survived (fan ends %s)" % (
+        i["wakeups"], i["bus_bytes"], i["write_errors"], i["fan"]))
+    q = report["probe"]
+    print("I2C bus probe (find_bus on fake buses, %.0f ms timeout)" % q["timeout_ms"])
+    for name in PROBE_SCENARIOS:
+        r = q[name]
+        print("  %-12s bus %-4s (want %-4s) %7.1f ms, %d probes, remembered %-4s %s" % (
+            name, r["bus"], r["expected"], r["ms"], r["probes"], r["remembered"],
+            "ok" if r["ok"] else "WRONG"))
+    b = report["boot"]
+    print("Boot decision (wait_for_wifi), event times x %.2f" % b["sleep_scale"])
+    for name in BOOT_SCENARIOS:
+        print("  %-17s %8.1f ms  (%.1f ms after the outcome was known)" % (
+            name, b[name]["decision_ms"], b[name]["lag_ms"]))
+    print("  moved site, fast reconnect to a known network %8.1f ms" % (
+        b["fast_reconnect"]["time_to_network_ms"]))
+
+
+def main(argv):
+    if argv[:1] == ["--oled-child"]:
+        oled_child(argv[1], float(argv[2]))
+        return 1
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=60.0,
+                        help="seconds to run the OLED daemon (default 60)")
+    parser.add_argument("--sleep-scale", type=float, default=1.0,
+                        help="factor applied to wifi_setup's sleeps (default 1.0)")
+    parser.add_argument("--backend", choices=["nmcli", "fake"], default="nmcli",
+                        help="NetworkManager backend for the portal (default nmcli)")
+    parser.add_argument("--ap-scan", action="store_true",
+                        help="fake a driver that can scan while the hotspot is up")
+    parser.add_argument("--trace", metavar="DIR",
+                        help="record boottrace timelines of both daemons in DIR")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--baseline", help="previous --json report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative regression (default 0.25)")
+    args = parser.parse_args(argv)
+    if args.trace:
+        # inherited by the OLED child; bench_portal starts its own tracer
+        os.environ["YAHBOOM_TRACE"] = os.path.abspath(args.trace)
+
+    report = {"oled": bench_oled(args.duration), "portal": bench_portal(args.sleep_scale, args.ap_scan,
+                                                                    args.backend),
+              "boot": bench_boot(args.sleep_scale, args.backend),
+              "thermal": bench_thermal(), "broker": bench_broker(), "probe": bench_probe()}
+    print_report(report)
+    status = 0 if all(report["probe"][name]["ok"] for name in PROBE_SCENARIOS) else 1
+    if not report["oled"]["ok"]:
+        status = 1
+    if args.trace:
+        sys.path.insert(0, SCRIPTS)
+        import boottrace
+        paths = [os.path.join(args.trace, "trace-%s.json" % name) for name in ("oled", "wifi_setup")]
+        with open(os.path.join(args.trace, "boot-trace.json"), "w") as f:
+            json.dump(boottrace.merge(paths), f)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            worse = compare(report, json.load(f), args.tolerance)
+        for key, base, now in worse:
+            print("REGRESSION %s: %.3f -> %.3f" % (key, base, now))
+        return 1 if worse else status
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -5,12 +5,28 @@ echo "Stopping and removing Yahboom services..."
 
 sudo systemctl stop yahboom_oled.service 2>/dev/null || true
 sudo systemctl stop yahboom_rgb.service 2>/dev/null || true
+sudo systemctl stop yahboom_i2c.service 2>/dev/null || true
+sudo systemctl stop yahboom_wifi_setup.service 2>/dev/null || true
 sudo systemctl disable yahboom_oled.service 2>/dev/null || true
 sudo systemctl disable yahboom_rgb.service 2>/dev/null || true
+sudo systemctl disable yahboom_i2c.service 2>/dev/null || true
+sudo systemctl disable yahboom_wifi_setup.service 2>/dev/null || true
 sudo rm -f /etc/systemd/system/yahboom_oled.service
 sudo rm -f /etc/systemd/system/yahboom_rgb.service
+sudo rm -f /etc/systemd/system/yahboom_i2c.service
+sudo rm -f /etc/systemd/system/yahboom_wifi_setup.service
+sudo rm -f /etc/tmpfiles.d/yahboom.conf
+sudo rm -rf /run/yahboom
+# YAHBOOM_TRACE / YAHBOOM_ISOLATE settings
+sudo rm -f /etc/default/yahboom
 sudo systemctl daemon-reload
 
+# Stop answering every DNS name with the portal's address on hotspots
+if [ -f /etc/NetworkManager/dnsmasq-shared.d/yahboom-portal.conf ]; then
+    sudo rm -f /etc/NetworkManager/dnsmasq-shared.d/yahboom-portal.conf
+    sudo systemctl reload NetworkManager 2>/dev/null || true
+fi
+
 # Clear OLED
 python3 "$(dirname "$0")/scripts/oled.py" clear 2>/dev/null || true
 
@@ -23,4 +39,4 @@ bot.set_Fan(0)
 del bot
 " 2>/dev/null || true
 
-echo "Done. Services removed, OLED cleared, RGB off."
+echo "Done. Services and their configuration removed, OLED cleared, RGB off."